@@ -0,0 +1,72 @@
+"""Compares throughput of XML engines used by `AnnotationParser`.
+
+Usage:
+
+    python -m benchmark.parser_engines [num_tokens]
+
+A synthetic recognized document (1M tokens by default) with nested named entities is generated into a temporary file.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from psan.tool.parser import ENGINES, AnnotationParser, parse_annotations
+
+VOCABULARY = [f"word{i}" for i in range(5000)] + ["a&amp;b", "x&lt;y"]
+
+
+class CountingParser(AnnotationParser):
+    """Parser which only counts words and entities"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.words = 0
+        self.entities = 0
+
+    def onWord(self, word) -> None:
+        self.words += 1
+
+    def onNameEntity(self, start, end, ne_type, depth) -> None:
+        self.entities += 1
+
+
+def make_document(num_tokens: int) -> str:
+    file = tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False)
+    with file:
+        file.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n")
+        for start in range(0, num_tokens, 20):
+            end = min(start + 20, num_tokens)
+            file.write(f"<sentence start=\"{start}\" end=\"{end}\">")
+            token_id = start
+            while token_id < end:
+                if token_id + 1 < end and random.random() < 0.05:
+                    # Nested entity over two tokens
+                    file.write(f"<ne start=\"{token_id}\" end=\"{token_id + 1}\" type=\"P\">"
+                               f"<ne start=\"{token_id}\" end=\"{token_id}\" type=\"pf\">"
+                               f"<token id=\"{token_id}\">{random.choice(VOCABULARY)}</token></ne> "
+                               f"<token id=\"{token_id + 1}\">{random.choice(VOCABULARY)}</token></ne> ")
+                    token_id += 2
+                else:
+                    file.write(f"<token id=\"{token_id}\">{random.choice(VOCABULARY)}</token> ")
+                    token_id += 1
+            file.write("</sentence>\n")
+        file.write("</submission>")
+    return file.name
+
+
+if __name__ == "__main__":
+    num_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(0)
+    document = make_document(num_tokens)
+    print(f"{num_tokens} tokens, {os.path.getsize(document) / 2**20:.1f} MiB")
+    try:
+        for engine in ENGINES:
+            handler = CountingParser()
+            begin = time.perf_counter()
+            parse_annotations(document, handler, engine)
+            elapsed = time.perf_counter() - begin
+            print(f"{engine:>8}: {elapsed:8.3f} s, {handler.words / elapsed:12.0f} tokens/s, {handler.entities} entities")
+    finally:
+        os.remove(document)
@@ -0,0 +1,103 @@
+"""Compares per-token rule lookups in DB with in-memory rule trie.
+
+Usage (database configured by the same environment variables as the app):
+
+    python -m benchmark.rule_matching [num_tokens] [num_rules]
+
+Rules are inserted in a transaction that is rolled back at the end.
+"""
+import random
+import sys
+import tempfile
+import time
+import xml.sax  # nosec - parse only internal XML
+
+from psan import app
+from psan.db import get_cursor, get_db
+from psan.tool.controller import Controller
+from psan.tool.model import Interval, Rule, RuleType
+from psan.tool.parser import AnnotationParser, LookupEvent
+from psan.tool.task.re_annotate import ReAnnotateParser
+
+VOCABULARY = [f"word{i}" for i in range(5000)]
+
+
+class CountingController(Controller):
+    """Controller which only counts annotations (no writes)"""
+
+    def __init__(self, cursor) -> None:
+        super().__init__(cursor, -1)
+        self.matches = 0
+
+    def annotate_from_rule(self, interval, rule, token_level_decision=None) -> None:
+        self.matches += 1
+
+
+class LegacyParser(AnnotationParser):
+    """Original implementation (queries of the removed `Controller.rule_lookup` and `find_rule`) - two SQL queries
+    per token"""
+
+    def __init__(self, ctl: Controller, cursor):
+        super().__init__()
+        self._ctl = ctl
+        self._cursor = cursor
+
+    def onWord(self, word):
+        self._cursor.execute("SELECT max(array_length(condition, 1)) AS length FROM rule WHERE condition[1] = %s",
+                             (word.token,))
+        length = self._cursor.fetchone()["length"]
+        if length:
+            self.registerLookup(LookupEvent(self._last_token_id + length - 1, self._last_token_id, None))
+
+    def onLookupEvent(self, event, words):
+        tokens = [word.token for word in words]
+        self._cursor.execute("SELECT id, condition FROM rule WHERE type = %s and condition[1] = %s",
+                             (RuleType.WORD_TYPE.value, tokens[0]))
+        for row in self._cursor:
+            if row["condition"] == tokens[:len(row["condition"])]:
+                self._ctl.annotate_from_rule(Interval(event.source_token_id, event.target_token_id), Rule(row["id"]))
+                break
+
+
+def make_document(num_tokens: int) -> str:
+    file = tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False)
+    with file:
+        file.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n")
+        for start in range(0, num_tokens, 20):
+            end = min(start + 20, num_tokens)
+            file.write(f"<sentence start=\"{start}\" end=\"{end}\">")
+            file.write(" ".join(f"<token id=\"{i}\">{random.choice(VOCABULARY)}</token>" for i in range(start, end)))
+            file.write("</sentence>\n")
+        file.write("</submission>")
+    return file.name
+
+
+def run(name: str, handler, ctl: CountingController) -> None:
+    begin = time.perf_counter()
+    xml.sax.parse(document, handler)  # nosec - parse only internal XML
+    elapsed = time.perf_counter() - begin
+    print(f"{name:>8}: {elapsed:8.3f} s, {ctl.matches} matches")
+
+
+if __name__ == "__main__":
+    num_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_rules = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    random.seed(0)
+    document = make_document(num_tokens)
+
+    with app.app_context():
+        with get_cursor() as cursor:
+            for _ in range(num_rules):
+                condition = random.sample(VOCABULARY, random.randint(1, 3))
+                cursor.execute("INSERT INTO rule (type, condition, confidence) VALUES (%s, %s, 0) ON CONFLICT DO NOTHING",
+                               (RuleType.WORD_TYPE.value, condition))
+
+            print(f"{num_tokens} tokens, {num_rules} rules")
+            legacy = CountingController(cursor)
+            run("per-token", LegacyParser(legacy, cursor), legacy)
+            trie = CountingController(cursor)
+            begin = time.perf_counter()
+            rules = trie.load_rules()
+            print(f"{'load':>8}: {time.perf_counter() - begin:8.3f} s, {len(rules)} rules")
+            run("trie", ReAnnotateParser(trie, rules), trie)
+        get_db().rollback()
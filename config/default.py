@@ -10,4 +10,19 @@ SECRET_KEY = os.environ["APP_SECRET_KEY"]
 TOKEN_SECRET = os.environ["APP_SECRET_KEY"]
 # PSAN tool
 DATA_FOLDER = os.environ.get("DATA_FOLDER", "./instance/")
-RULE_AUTOAPPLY_CONFIDENCE = 1
+# Rendered annotation windows shared by web workers (empty path disables the cache)
+WINDOW_CACHE = os.environ.get("WINDOW_CACHE", os.path.join(DATA_FOLDER, "window-cache.sqlite"))
+WINDOW_CACHE_SIZE = int(os.environ.get("WINDOW_CACHE_SIZE", str(64 << 20)))  # bytes of cached HTML
+# Generated output files (empty path disables the cache)
+OUTPUT_CACHE = os.environ.get("OUTPUT_CACHE", os.path.join(DATA_FOLDER, "output-cache"))
+OUTPUT_CACHE_SIZE = int(os.environ.get("OUTPUT_CACHE_SIZE", str(1 << 30)))  # bytes of cached files
+RULE_AUTOAPPLY_CONFIDENCE = 1  # written to the database by each process (change rebuilds the work queue)
+ANNOTATION_LEASE_TIMEOUT = 15 * 60  # seconds an annotation window stays reserved for its annotator
+RE_ANNOTATE_DELAY = int(os.environ.get("RE_ANNOTATE_DELAY", "5"))  # seconds to merge re-annotation requests
+RECONCILE_INTERVAL = int(os.environ.get("RECONCILE_INTERVAL", "60"))  # seconds between rule epoch reconciliations
+# Seconds between folds of logged document changes into revisions. Needs `celery beat`, without it every poll of
+# a document revision counts a growing log.
+REVISION_FOLD_INTERVAL = int(os.environ.get("REVISION_FOLD_INTERVAL", "60"))
+PRE_PROCESS_BATCH = int(os.environ.get("PRE_PROCESS_BATCH", "10000"))  # tokens committed at once by pre-processing
+RECONCILE_BATCH = int(os.environ.get("RECONCILE_BATCH", "100"))  # max documents scheduled by one reconciliation
+ANNOTATION_PARSER_ENGINE = os.environ.get("ANNOTATION_PARSER_ENGINE", "expat")  # sax, expat or lxml
@@ -1,9 +1,34 @@
 -- Initialize the PostgreSQL database.
 
 -- Table
+CREATE TABLE schema_version (
+    version     INT PRIMARY KEY,
+    name        TEXT                        NOT NULL,
+    applied     TIMESTAMP                   NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Migrations in `db/migrations` already included in this schema
+INSERT INTO schema_version (version, name) VALUES
+    (1, '0001_token_index'),
+    (2, '0002_rule_epoch'),
+    (3, '0003_statement_triggers'),
+    (4, '0004_hot_path_indexes'),
+    (5, '0005_annotation_work'),
+    (6, '0006_submission_revision'),
+    (7, '0007_export'),
+    (8, '0008_pipeline_status'),
+    (9, '0009_checkpoint'),
+    (10, '0010_revision_log'),
+    (11, '0011_rule_epoch_matches'),
+    (12, '0012_claim_indexes'),
+    (13, '0013_claim_order'),
+    (14, '0014_setting'),
+    (15, '0015_rule_epoch_table'),
+    (16, '0016_rule_epoch_change');
+
 CREATE TYPE account_type AS ENUM ('USER', 'ADMIN');
 
-CREATE TYPE submission_status AS ENUM ('NEW', 'RECOGNIZED', 'PRE_ANNOTATED', 'DONE'); 
+CREATE TYPE submission_status AS ENUM ('NEW', 'RECOGNIZED', 'NE_ANNOTATED', 'PRE_ANNOTATED', 'DONE'); 
 
 CREATE TYPE annotation_decision AS ENUM ('PUBLIC', 'SECRET', 'NESTED');
 
@@ -30,6 +55,8 @@ CREATE TABLE submission (
     status      submission_status           NOT NULL DEFAULT 'NEW',
     num_tokens  INT,
     created     TIMESTAMP                   NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    applied_rule_epoch BIGINT               NOT NULL DEFAULT 0,
+    revision    BIGINT                      NOT NULL DEFAULT 0,
     CHECK (0 <= num_tokens)
 );
 
@@ -70,79 +97,402 @@ CREATE TABLE annotation_rule (
     UNIQUE (annotation, rule)
 );
 
-CREATE PROCEDURE update_rule(rule_id integer, ammount integer)
-LANGUAGE SQL
-AS $$
-UPDATE 
-    annotation 
-SET 
-    rule_level = rule_level + ammount 
-FROM 
-    annotation_rule 
-WHERE 
-    annotation.id = annotation_rule.annotation 
-    and annotation_rule.rule = rule_id;
-$$;
-
-CREATE OR REPLACE PROCEDURE annotatation_cleanup()
-LANGUAGE SQL
-AS $$
-DELETE FROM annotation AS a WHERE (a.token_level IS NULL OR a.token_level = 'NESTED') AND a.rule_level = 0 AND NOT EXISTS (SELECT 1 FROM annotation_rule AS ar WHERE a.id = ar.annotation);
-$$;
-
-CREATE OR REPLACE FUNCTION before_rule_deletion_fnc() RETURNS trigger AS $emp_stamp$
+CREATE TABLE token (
+    submission      INT REFERENCES submission(id) ON DELETE CASCADE    NOT NULL,
+    id              INT                                                NOT NULL,
+    form            TEXT                                               NOT NULL,
+    PRIMARY KEY (submission, id)
+);
+
+CREATE INDEX token_form_idx ON token (form);
+
+-- Rule lookups by the first token of condition (rule_lookup, find_rule, load_rules_starting_with)
+CREATE INDEX rule_first_token_idx ON rule ((condition[1]), type);
+
+-- Links of a rule (rule deletion cascade and confidence update trigger)
+CREATE INDEX annotation_rule_rule_idx ON annotation_rule (rule);
+
+-- Undecided annotations of a submission (next annotation window)
+CREATE INDEX annotation_undecided_idx ON annotation (submission, abs(rule_level)) WHERE token_level IS NULL;
+
+-- Rule epoch increases with every committed change of word rules (see `submission.applied_rule_epoch`).
+-- It is committed data, so an epoch is never visible before its rules.
+CREATE TABLE rule_epoch (
+    epoch       BIGINT                      NOT NULL
+);
+
+INSERT INTO rule_epoch (epoch) VALUES (0);
+
+-- First tokens of rule changes by epoch. Propagation advances documents only over changes whose tokens it has
+-- propagated; rows older than every unfinished document are pruned by reconciliation.
+CREATE TABLE rule_epoch_change (
+    epoch       BIGINT                      NOT NULL,
+    first_token TEXT                        NOT NULL
+);
+
+CREATE INDEX rule_epoch_change_epoch_idx ON rule_epoch_change (epoch);
+
+-- Rule level of annotation is the sum of confidences of its rules. Triggers maintain it once per statement
+-- using transition tables.
+CREATE OR REPLACE FUNCTION annotation_rule_insert_fn() RETURNS trigger AS $emp_stamp$
     BEGIN
-        CALL update_rule(OLD.id, -OLD.confidence);
-        RETURN OLD;
-    END;
+        UPDATE
+            annotation
+        SET
+            rule_level = annotation.rule_level + added.confidence
+        FROM
+            (SELECT nl.annotation, sum(r.confidence) AS confidence
+             FROM new_links nl JOIN rule r ON r.id = nl.rule
+             GROUP BY nl.annotation) AS added
+        WHERE
+            annotation.id = added.annotation;
+        RETURN NULL;
+   END;
 $emp_stamp$ LANGUAGE plpgsql;
 
-CREATE OR REPLACE FUNCTION after_rule_deletion_fnc() RETURNS trigger AS $emp_stamp$
+-- Links are removed by deleted rules (or annotations), so rule level is computed from the remaining links
+-- and only the affected annotations without any decision are cleaned up
+CREATE OR REPLACE FUNCTION annotation_rule_delete_fn() RETURNS trigger AS $emp_stamp$
     BEGIN
-        CALL annotatation_cleanup();
+        UPDATE
+            annotation
+        SET
+            rule_level = COALESCE((SELECT sum(r.confidence)
+                                   FROM annotation_rule ar JOIN rule r ON r.id = ar.rule
+                                   WHERE ar.annotation = annotation.id), 0)
+        WHERE
+            annotation.id IN (SELECT annotation FROM old_links);
+        DELETE FROM
+            annotation AS a
+        WHERE
+            a.id IN (SELECT annotation FROM old_links)
+            AND (a.token_level IS NULL OR a.token_level = 'NESTED')
+            AND a.rule_level = 0
+            AND NOT EXISTS (SELECT 1 FROM annotation_rule AS ar WHERE a.id = ar.annotation);
         RETURN NULL;
-    END;
+   END;
 $emp_stamp$ LANGUAGE plpgsql;
 
 CREATE OR REPLACE FUNCTION rule_update_fn() RETURNS trigger AS $emp_stamp$
     BEGIN
-        CALL update_rule(NEW.id, -OLD.confidence + NEW.confidence);
+        UPDATE
+            annotation
+        SET
+            rule_level = annotation.rule_level + changed.delta
+        FROM
+            (SELECT ar.annotation, sum(n.confidence - o.confidence) AS delta
+             FROM new_rules n
+             JOIN old_rules o ON o.id = n.id AND o.confidence <> n.confidence
+             JOIN annotation_rule ar ON ar.rule = n.id
+             GROUP BY ar.annotation) AS changed
+        WHERE
+            annotation.id = changed.annotation;
         RETURN NULL;
     END;
 $emp_stamp$ LANGUAGE plpgsql;
 
+CREATE TRIGGER annotation_rule_insert_trigger AFTER INSERT
+    ON annotation_rule
+    REFERENCING NEW TABLE AS new_links
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_rule_insert_fn();
 
-CREATE OR REPLACE FUNCTION annotation_rule_insert_fn() RETURNS trigger AS $emp_stamp$
+CREATE TRIGGER annotation_rule_delete_trigger AFTER DELETE
+    ON annotation_rule
+    REFERENCING OLD TABLE AS old_links
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_rule_delete_fn();
+
+-- Transition tables cannot be combined with a column list (UPDATE OF confidence)
+CREATE TRIGGER rule_update_trigger AFTER UPDATE
+    ON rule
+    REFERENCING OLD TABLE AS old_rules NEW TABLE AS new_rules
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE rule_update_fn();
+
+-- Epoch is increased when the change commits (deferred triggers), not when the statement runs
+-- (the row is locked only while the changing transaction commits)
+CREATE OR REPLACE FUNCTION rule_epoch_fn() RETURNS trigger AS $emp_stamp$
     BEGIN
-        UPDATE 
-            annotation 
-        SET 
-            rule_level = rule_level + rule.confidence
-        FROM 
-            rule 
-        WHERE 
-            annotation.id = NEW.annotation
-            and rule.id = NEW.rule; 
+        UPDATE rule_epoch SET epoch = epoch + 1;
+        INSERT INTO rule_epoch_change (epoch, first_token) SELECT epoch, NEW.condition[1] FROM rule_epoch;
         RETURN NULL;
    END;
 $emp_stamp$ LANGUAGE plpgsql;
 
-CREATE TRIGGER before_rule_deletion_trigger BEFORE DELETE 
+CREATE CONSTRAINT TRIGGER rule_epoch_insert_trigger AFTER INSERT
     ON rule
+    DEFERRABLE INITIALLY DEFERRED
     FOR EACH ROW
-    EXECUTE PROCEDURE before_rule_deletion_fnc();
+    WHEN (NEW.type = 'WORD_TYPE')
+    EXECUTE PROCEDURE rule_epoch_fn();
 
-CREATE TRIGGER after_rule_deletion_trigger AFTER DELETE 
+-- Only changes of rule matches increase the epoch. Confidence changes and deletes update rule levels of existing
+-- annotations (statement triggers) and new rules are propagated to pre-annotated documents (propagation advances
+-- their applied epoch).
+CREATE CONSTRAINT TRIGGER rule_epoch_update_trigger AFTER UPDATE
     ON rule
+    DEFERRABLE INITIALLY DEFERRED
     FOR EACH ROW
-    EXECUTE PROCEDURE after_rule_deletion_fnc();
+    WHEN (NEW.type = 'WORD_TYPE' AND (OLD.type, OLD.condition) IS DISTINCT FROM (NEW.type, NEW.condition))
+    EXECUTE PROCEDURE rule_epoch_fn();
+
+-- Work queue of annotations waiting for annotators (undecided or secret without label) in pre-annotated submissions.
+-- Rows are maintained by triggers and leased to annotators for a limited time.
+CREATE TABLE annotation_work (
+    annotation      INT PRIMARY KEY REFERENCES annotation(id) ON DELETE CASCADE,
+    submission      INT REFERENCES submission(id) ON DELETE CASCADE    NOT NULL,
+    ref_start       INT                                                NOT NULL,
+    ref_end         INT                                                NOT NULL,
+    leased_by       INT REFERENCES account(id) ON DELETE SET NULL,
+    lease_until     TIMESTAMP
+);
+
+-- Work is claimed in the order of positions in documents (concurrent annotators get different submissions),
+-- windows are looked up per submission and leases by annotator
+CREATE INDEX annotation_work_claim_idx ON annotation_work (ref_start, submission);
+
+CREATE INDEX annotation_work_submission_idx ON annotation_work (submission, ref_start);
+
+CREATE INDEX annotation_work_leased_by_idx ON annotation_work (leased_by) WHERE leased_by IS NOT NULL;
+
+-- Settings of the application used by the database (written by the application, see `psan.db.sync_settings`)
+CREATE TABLE setting (
+    name        TEXT PRIMARY KEY,
+    value       INT                         NOT NULL
+);
+
+INSERT INTO setting (name, value) VALUES ('rule_autoapply_confidence', 1);
+
+-- RULE_AUTOAPPLY_CONFIDENCE of the application
+CREATE OR REPLACE FUNCTION rule_autoapply_confidence() RETURNS INT AS $$
+    SELECT value FROM setting WHERE name = 'rule_autoapply_confidence';
+$$ LANGUAGE SQL STABLE;
+
+CREATE OR REPLACE VIEW pending_annotation AS
+    SELECT
+        a.id, a.submission, a.ref_start, a.ref_end
+    FROM
+        annotation a
+        JOIN submission s ON s.id = a.submission AND s.status = 'PRE_ANNOTATED'
+    WHERE
+        -- not decided
+        (a.token_level IS NULL AND abs(a.rule_level) < rule_autoapply_confidence())
+        -- or secret without label
+        OR ((a.token_level = 'SECRET' OR (a.token_level IS NULL AND a.rule_level < rule_autoapply_confidence()))
+            AND a.label IS NULL
+            AND NOT EXISTS (SELECT 1 FROM annotation_rule ar
+                            JOIN rule r ON r.id = ar.rule AND r.label IS NOT NULL AND r.confidence < 0
+                            WHERE ar.annotation = a.id));
+
+CREATE OR REPLACE FUNCTION refresh_annotation_work(annotation_ids INT[]) RETURNS void AS $$
+    DELETE FROM annotation_work w
+    WHERE w.annotation = ANY(annotation_ids) AND NOT EXISTS (SELECT 1 FROM pending_annotation p WHERE p.id = w.annotation);
+    INSERT INTO annotation_work (annotation, submission, ref_start, ref_end)
+    SELECT id, submission, ref_start, ref_end FROM pending_annotation WHERE id = ANY(annotation_ids)
+    ON CONFLICT (annotation) DO NOTHING;
+$$ LANGUAGE SQL;
+
+-- Changes of annotations (including rule levels maintained by rule triggers)
+CREATE OR REPLACE FUNCTION annotation_work_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM refresh_annotation_work(ARRAY(SELECT id FROM changed_annotations));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+-- Rule labels decide whether secret annotations miss label
+CREATE OR REPLACE FUNCTION rule_work_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM refresh_annotation_work(ARRAY(
+            SELECT ar.annotation
+            FROM new_rules n
+            JOIN old_rules o ON o.id = n.id AND o.label IS DISTINCT FROM n.label
+            JOIN annotation_rule ar ON ar.rule = n.id));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+-- Only pre-annotated submissions are annotated
+CREATE OR REPLACE FUNCTION submission_work_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM refresh_annotation_work(ARRAY(
+            SELECT a.id
+            FROM new_submissions n
+            JOIN old_submissions o ON o.id = n.id AND o.status IS DISTINCT FROM n.status
+            JOIN annotation a ON a.submission = n.id));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE TRIGGER annotation_work_insert_trigger AFTER INSERT
+    ON annotation
+    REFERENCING NEW TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_work_fn();
+
+CREATE TRIGGER annotation_work_update_trigger AFTER UPDATE
+    ON annotation
+    REFERENCING NEW TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_work_fn();
+
+CREATE TRIGGER rule_work_trigger AFTER UPDATE
+    ON rule
+    REFERENCING OLD TABLE AS old_rules NEW TABLE AS new_rules
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE rule_work_fn();
+
+CREATE TRIGGER submission_work_trigger AFTER UPDATE
+    ON submission
+    REFERENCING OLD TABLE AS old_submissions NEW TABLE AS new_submissions
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE submission_work_fn();
 
-CREATE TRIGGER rule_update_trigger AFTER UPDATE 
-    OF confidence ON rule
+-- Work queue is rebuilt with the changed threshold
+CREATE OR REPLACE FUNCTION setting_work_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM refresh_annotation_work(ARRAY(SELECT id FROM annotation));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE TRIGGER setting_work_trigger AFTER UPDATE
+    ON setting
     FOR EACH ROW
-    EXECUTE PROCEDURE rule_update_fn();
+    WHEN (NEW.name = 'rule_autoapply_confidence' AND OLD.value IS DISTINCT FROM NEW.value)
+    EXECUTE PROCEDURE setting_work_fn();
+
+-- Revision of submission increases with every change of its annotation decisions (ETags of decisions and output)
+-- Changes are logged instead of updating rows of submissions (concurrent writers of a document don't block each other),
+-- revision of submission is its folded `revision` and the number of its logged changes
+CREATE TABLE submission_revision (
+    submission  INT REFERENCES submission(id) ON DELETE CASCADE    NOT NULL
+);
+
+CREATE INDEX submission_revision_idx ON submission_revision (submission);
+
+CREATE OR REPLACE FUNCTION bump_submission_revision(submission_ids INT[]) RETURNS void AS $$
+    -- Submissions deleted by the statement are skipped
+    INSERT INTO submission_revision (submission) SELECT id FROM submission WHERE id = ANY(submission_ids);
+$$ LANGUAGE SQL;
+
+-- Moves logged changes to revisions of submissions (periodically, keeps the log short)
+CREATE OR REPLACE FUNCTION fold_submission_revisions() RETURNS void AS $$
+    WITH folded AS (DELETE FROM submission_revision RETURNING submission)
+    UPDATE submission SET revision = submission.revision + changed.changes
+    FROM (SELECT submission, count(*) AS changes FROM folded GROUP BY submission) AS changed
+    WHERE submission.id = changed.submission;
+$$ LANGUAGE SQL;
+
+CREATE OR REPLACE FUNCTION annotation_revision_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM bump_submission_revision(ARRAY(SELECT DISTINCT submission FROM changed_annotations));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION annotation_rule_revision_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM bump_submission_revision(ARRAY(
+            SELECT DISTINCT a.submission FROM changed_links l JOIN annotation a ON a.id = l.annotation));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
 
-CREATE TRIGGER annotation_rule_insert_trigger AFTER INSERT 
+-- Labels of rules are shown for their annotations (confidence changes update rule levels of annotations)
+CREATE OR REPLACE FUNCTION rule_revision_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM bump_submission_revision(ARRAY(
+            SELECT DISTINCT a.submission
+            FROM new_rules n
+            JOIN old_rules o ON o.id = n.id AND o.label IS DISTINCT FROM n.label
+            JOIN annotation_rule ar ON ar.rule = n.id
+            JOIN annotation a ON a.id = ar.annotation));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION label_revision_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM bump_submission_revision(ARRAY(
+            WITH changed AS (
+                SELECT n.id
+                FROM new_labels n
+                JOIN old_labels o ON o.id = n.id AND (o.name, o.replacement) IS DISTINCT FROM (n.name, n.replacement))
+            SELECT a.submission FROM annotation a JOIN changed c ON c.id = a.label
+            UNION
+            SELECT a.submission
+            FROM rule r
+            JOIN changed c ON c.id = r.label
+            JOIN annotation_rule ar ON ar.rule = r.id
+            JOIN annotation a ON a.id = ar.annotation));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE TRIGGER annotation_revision_insert_trigger AFTER INSERT
+    ON annotation
+    REFERENCING NEW TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_revision_fn();
+
+CREATE TRIGGER annotation_revision_update_trigger AFTER UPDATE
+    ON annotation
+    REFERENCING NEW TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_revision_fn();
+
+CREATE TRIGGER annotation_revision_delete_trigger AFTER DELETE
+    ON annotation
+    REFERENCING OLD TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_revision_fn();
+
+CREATE TRIGGER annotation_rule_revision_insert_trigger AFTER INSERT
     ON annotation_rule
-    FOR EACH ROW
-    EXECUTE PROCEDURE annotation_rule_insert_fn(); 
+    REFERENCING NEW TABLE AS changed_links
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_rule_revision_fn();
+
+CREATE TRIGGER annotation_rule_revision_delete_trigger AFTER DELETE
+    ON annotation_rule
+    REFERENCING OLD TABLE AS changed_links
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_rule_revision_fn();
+
+CREATE TRIGGER rule_revision_trigger AFTER UPDATE
+    ON rule
+    REFERENCING OLD TABLE AS old_rules NEW TABLE AS new_rules
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE rule_revision_fn();
+
+CREATE TRIGGER label_revision_trigger AFTER UPDATE
+    ON label
+    REFERENCING OLD TABLE AS old_labels NEW TABLE AS new_labels
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE label_revision_fn();
+
+-- Bulk exports of pseudonymized submissions (archives are built by Celery workers)
+CREATE TYPE export_status AS ENUM ('RUNNING', 'DONE', 'FAILED');
+
+CREATE TABLE export (
+    id          INT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    uid         UUID                UNIQUE  NOT NULL,
+    status      export_status               NOT NULL DEFAULT 'RUNNING',
+    total       INT                         NOT NULL DEFAULT 0,
+    done        INT                         NOT NULL DEFAULT 0,
+    author      INT REFERENCES account(id) ON DELETE SET NULL,
+    created     TIMESTAMP                   NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished    TIMESTAMP,
+    CHECK (0 <= done AND done <= total)
+);
+
+-- Progress of pre-processing stages committed in batches (a retried stage resumes from the sentence starting at `token`)
+CREATE TABLE checkpoint (
+    submission      INT REFERENCES submission(id) ON DELETE CASCADE    NOT NULL,
+    stage           submission_status                                  NOT NULL,
+    token           INT                                                NOT NULL,
+    rule_epoch      BIGINT                                             NOT NULL DEFAULT 0,
+    PRIMARY KEY (submission, stage)
+);
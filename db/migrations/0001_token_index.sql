@@ -0,0 +1,9 @@
+-- Token occurrence index used by rule propagation
+CREATE TABLE IF NOT EXISTS token (
+    submission      INT REFERENCES submission(id) ON DELETE CASCADE    NOT NULL,
+    id              INT                                                NOT NULL,
+    form            TEXT                                               NOT NULL,
+    PRIMARY KEY (submission, id)
+);
+
+CREATE INDEX IF NOT EXISTS token_form_idx ON token (form);
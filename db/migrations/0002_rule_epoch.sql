@@ -0,0 +1,33 @@
+-- Rule epoch and applied epoch of submissions used by reconciliation
+ALTER TABLE submission ADD COLUMN IF NOT EXISTS applied_rule_epoch BIGINT NOT NULL DEFAULT 0;
+
+CREATE SEQUENCE IF NOT EXISTS rule_epoch AS BIGINT;
+
+-- Epoch is increased when the change commits (deferred triggers), not when the statement runs
+CREATE OR REPLACE FUNCTION rule_epoch_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM nextval('rule_epoch');
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE CONSTRAINT TRIGGER rule_epoch_insert_trigger AFTER INSERT
+    ON rule
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW
+    WHEN (NEW.type = 'WORD_TYPE')
+    EXECUTE PROCEDURE rule_epoch_fn();
+
+CREATE CONSTRAINT TRIGGER rule_epoch_update_trigger AFTER UPDATE
+    ON rule
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW
+    WHEN (NEW.type = 'WORD_TYPE' AND (OLD.type, OLD.condition, OLD.confidence) IS DISTINCT FROM (NEW.type, NEW.condition, NEW.confidence))
+    EXECUTE PROCEDURE rule_epoch_fn();
+
+CREATE CONSTRAINT TRIGGER rule_epoch_delete_trigger AFTER DELETE
+    ON rule
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW
+    WHEN (OLD.type = 'WORD_TYPE')
+    EXECUTE PROCEDURE rule_epoch_fn();
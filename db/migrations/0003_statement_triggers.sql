@@ -0,0 +1,87 @@
+-- Replace row-level rule triggers with statement-level ones (rule_level stays the sum of linked rule confidences)
+DROP TRIGGER IF EXISTS before_rule_deletion_trigger ON rule;
+DROP TRIGGER IF EXISTS after_rule_deletion_trigger ON rule;
+DROP TRIGGER IF EXISTS rule_update_trigger ON rule;
+DROP TRIGGER IF EXISTS annotation_rule_insert_trigger ON annotation_rule;
+DROP FUNCTION IF EXISTS before_rule_deletion_fnc();
+DROP FUNCTION IF EXISTS after_rule_deletion_fnc();
+DROP PROCEDURE IF EXISTS update_rule(integer, integer);
+DROP PROCEDURE IF EXISTS annotatation_cleanup();
+
+-- Rule level of annotation is the sum of confidences of its rules. Triggers maintain it once per statement
+-- using transition tables.
+CREATE OR REPLACE FUNCTION annotation_rule_insert_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        UPDATE
+            annotation
+        SET
+            rule_level = annotation.rule_level + added.confidence
+        FROM
+            (SELECT nl.annotation, sum(r.confidence) AS confidence
+             FROM new_links nl JOIN rule r ON r.id = nl.rule
+             GROUP BY nl.annotation) AS added
+        WHERE
+            annotation.id = added.annotation;
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+-- Links are removed by deleted rules (or annotations), so rule level is computed from the remaining links
+-- and only the affected annotations without any decision are cleaned up
+CREATE OR REPLACE FUNCTION annotation_rule_delete_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        UPDATE
+            annotation
+        SET
+            rule_level = COALESCE((SELECT sum(r.confidence)
+                                   FROM annotation_rule ar JOIN rule r ON r.id = ar.rule
+                                   WHERE ar.annotation = annotation.id), 0)
+        WHERE
+            annotation.id IN (SELECT annotation FROM old_links);
+        DELETE FROM
+            annotation AS a
+        WHERE
+            a.id IN (SELECT annotation FROM old_links)
+            AND (a.token_level IS NULL OR a.token_level = 'NESTED')
+            AND a.rule_level = 0
+            AND NOT EXISTS (SELECT 1 FROM annotation_rule AS ar WHERE a.id = ar.annotation);
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rule_update_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        UPDATE
+            annotation
+        SET
+            rule_level = annotation.rule_level + changed.delta
+        FROM
+            (SELECT ar.annotation, sum(n.confidence - o.confidence) AS delta
+             FROM new_rules n
+             JOIN old_rules o ON o.id = n.id AND o.confidence <> n.confidence
+             JOIN annotation_rule ar ON ar.rule = n.id
+             GROUP BY ar.annotation) AS changed
+        WHERE
+            annotation.id = changed.annotation;
+        RETURN NULL;
+    END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE TRIGGER annotation_rule_insert_trigger AFTER INSERT
+    ON annotation_rule
+    REFERENCING NEW TABLE AS new_links
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_rule_insert_fn();
+
+CREATE TRIGGER annotation_rule_delete_trigger AFTER DELETE
+    ON annotation_rule
+    REFERENCING OLD TABLE AS old_links
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_rule_delete_fn();
+
+-- Transition tables cannot be combined with a column list (UPDATE OF confidence)
+CREATE TRIGGER rule_update_trigger AFTER UPDATE
+    ON rule
+    REFERENCING OLD TABLE AS old_rules NEW TABLE AS new_rules
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE rule_update_fn();
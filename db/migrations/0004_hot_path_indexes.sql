@@ -0,0 +1,8 @@
+-- Rule lookups by the first token of condition (rule_lookup, find_rule, load_rules_starting_with)
+CREATE INDEX IF NOT EXISTS rule_first_token_idx ON rule ((condition[1]), type);
+
+-- Links of a rule (rule deletion cascade and confidence update trigger)
+CREATE INDEX IF NOT EXISTS annotation_rule_rule_idx ON annotation_rule (rule);
+
+-- Undecided annotations of a submission (next annotation window)
+CREATE INDEX IF NOT EXISTS annotation_undecided_idx ON annotation (submission, abs(rule_level)) WHERE token_level IS NULL;
@@ -0,0 +1,103 @@
+-- Work queue of annotations waiting for annotators (undecided or secret without label) in pre-annotated submissions.
+-- Rows are maintained by triggers and leased to annotators for a limited time.
+CREATE TABLE annotation_work (
+    annotation      INT PRIMARY KEY REFERENCES annotation(id) ON DELETE CASCADE,
+    submission      INT REFERENCES submission(id) ON DELETE CASCADE    NOT NULL,
+    ref_start       INT                                                NOT NULL,
+    ref_end         INT                                                NOT NULL,
+    leased_by       INT REFERENCES account(id) ON DELETE SET NULL,
+    lease_until     TIMESTAMP
+);
+
+-- Free work comes first (no lease, then expired leases)
+CREATE INDEX annotation_work_lease_idx ON annotation_work (lease_until NULLS FIRST, submission, ref_start);
+
+CREATE INDEX annotation_work_submission_idx ON annotation_work (submission, ref_start);
+
+-- Has to match RULE_AUTOAPPLY_CONFIDENCE of the application
+CREATE OR REPLACE FUNCTION rule_autoapply_confidence() RETURNS INT AS $$
+    SELECT 1;
+$$ LANGUAGE SQL IMMUTABLE;
+
+CREATE OR REPLACE VIEW pending_annotation AS
+    SELECT
+        a.id, a.submission, a.ref_start, a.ref_end
+    FROM
+        annotation a
+        JOIN submission s ON s.id = a.submission AND s.status = 'PRE_ANNOTATED'
+    WHERE
+        -- not decided
+        (a.token_level IS NULL AND abs(a.rule_level) < rule_autoapply_confidence())
+        -- or secret without label
+        OR ((a.token_level = 'SECRET' OR (a.token_level IS NULL AND a.rule_level < rule_autoapply_confidence()))
+            AND a.label IS NULL
+            AND NOT EXISTS (SELECT 1 FROM annotation_rule ar
+                            JOIN rule r ON r.id = ar.rule AND r.label IS NOT NULL AND r.confidence < 0
+                            WHERE ar.annotation = a.id));
+
+CREATE OR REPLACE FUNCTION refresh_annotation_work(annotation_ids INT[]) RETURNS void AS $$
+    DELETE FROM annotation_work w
+    WHERE w.annotation = ANY(annotation_ids) AND NOT EXISTS (SELECT 1 FROM pending_annotation p WHERE p.id = w.annotation);
+    INSERT INTO annotation_work (annotation, submission, ref_start, ref_end)
+    SELECT id, submission, ref_start, ref_end FROM pending_annotation WHERE id = ANY(annotation_ids)
+    ON CONFLICT (annotation) DO NOTHING;
+$$ LANGUAGE SQL;
+
+-- Changes of annotations (including rule levels maintained by rule triggers)
+CREATE OR REPLACE FUNCTION annotation_work_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM refresh_annotation_work(ARRAY(SELECT id FROM changed_annotations));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+-- Rule labels decide whether secret annotations miss label
+CREATE OR REPLACE FUNCTION rule_work_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM refresh_annotation_work(ARRAY(
+            SELECT ar.annotation
+            FROM new_rules n
+            JOIN old_rules o ON o.id = n.id AND o.label IS DISTINCT FROM n.label
+            JOIN annotation_rule ar ON ar.rule = n.id));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+-- Only pre-annotated submissions are annotated
+CREATE OR REPLACE FUNCTION submission_work_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM refresh_annotation_work(ARRAY(
+            SELECT a.id
+            FROM new_submissions n
+            JOIN old_submissions o ON o.id = n.id AND o.status IS DISTINCT FROM n.status
+            JOIN annotation a ON a.submission = n.id));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE TRIGGER annotation_work_insert_trigger AFTER INSERT
+    ON annotation
+    REFERENCING NEW TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_work_fn();
+
+CREATE TRIGGER annotation_work_update_trigger AFTER UPDATE
+    ON annotation
+    REFERENCING NEW TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_work_fn();
+
+CREATE TRIGGER rule_work_trigger AFTER UPDATE
+    ON rule
+    REFERENCING OLD TABLE AS old_rules NEW TABLE AS new_rules
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE rule_work_fn();
+
+CREATE TRIGGER submission_work_trigger AFTER UPDATE
+    ON submission
+    REFERENCING OLD TABLE AS old_submissions NEW TABLE AS new_submissions
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE submission_work_fn();
+
+INSERT INTO annotation_work (annotation, submission, ref_start, ref_end)
+SELECT id, submission, ref_start, ref_end FROM pending_annotation;
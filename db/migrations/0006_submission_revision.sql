@@ -0,0 +1,97 @@
+-- Revision of submission increases with every change of its annotation decisions (ETags of decisions and output)
+ALTER TABLE submission ADD COLUMN IF NOT EXISTS revision BIGINT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION bump_submission_revision(submission_ids INT[]) RETURNS void AS $$
+    -- Lock rows in a stable order (concurrent statements changing several submissions)
+    UPDATE submission SET revision = submission.revision + 1
+    FROM (SELECT id FROM submission WHERE id = ANY(submission_ids) ORDER BY id FOR UPDATE) AS changed
+    WHERE submission.id = changed.id;
+$$ LANGUAGE SQL;
+
+CREATE OR REPLACE FUNCTION annotation_revision_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM bump_submission_revision(ARRAY(SELECT DISTINCT submission FROM changed_annotations));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION annotation_rule_revision_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM bump_submission_revision(ARRAY(
+            SELECT DISTINCT a.submission FROM changed_links l JOIN annotation a ON a.id = l.annotation));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+-- Labels of rules are shown for their annotations (confidence changes update rule levels of annotations)
+CREATE OR REPLACE FUNCTION rule_revision_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM bump_submission_revision(ARRAY(
+            SELECT DISTINCT a.submission
+            FROM new_rules n
+            JOIN old_rules o ON o.id = n.id AND o.label IS DISTINCT FROM n.label
+            JOIN annotation_rule ar ON ar.rule = n.id
+            JOIN annotation a ON a.id = ar.annotation));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION label_revision_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM bump_submission_revision(ARRAY(
+            WITH changed AS (
+                SELECT n.id
+                FROM new_labels n
+                JOIN old_labels o ON o.id = n.id AND (o.name, o.replacement) IS DISTINCT FROM (n.name, n.replacement))
+            SELECT a.submission FROM annotation a JOIN changed c ON c.id = a.label
+            UNION
+            SELECT a.submission
+            FROM rule r
+            JOIN changed c ON c.id = r.label
+            JOIN annotation_rule ar ON ar.rule = r.id
+            JOIN annotation a ON a.id = ar.annotation));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE TRIGGER annotation_revision_insert_trigger AFTER INSERT
+    ON annotation
+    REFERENCING NEW TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_revision_fn();
+
+CREATE TRIGGER annotation_revision_update_trigger AFTER UPDATE
+    ON annotation
+    REFERENCING NEW TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_revision_fn();
+
+CREATE TRIGGER annotation_revision_delete_trigger AFTER DELETE
+    ON annotation
+    REFERENCING OLD TABLE AS changed_annotations
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_revision_fn();
+
+CREATE TRIGGER annotation_rule_revision_insert_trigger AFTER INSERT
+    ON annotation_rule
+    REFERENCING NEW TABLE AS changed_links
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_rule_revision_fn();
+
+CREATE TRIGGER annotation_rule_revision_delete_trigger AFTER DELETE
+    ON annotation_rule
+    REFERENCING OLD TABLE AS changed_links
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE annotation_rule_revision_fn();
+
+CREATE TRIGGER rule_revision_trigger AFTER UPDATE
+    ON rule
+    REFERENCING OLD TABLE AS old_rules NEW TABLE AS new_rules
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE rule_revision_fn();
+
+CREATE TRIGGER label_revision_trigger AFTER UPDATE
+    ON label
+    REFERENCING OLD TABLE AS old_labels NEW TABLE AS new_labels
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE label_revision_fn();
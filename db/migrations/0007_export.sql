@@ -0,0 +1,14 @@
+-- Bulk exports of pseudonymized submissions (archives are built by Celery workers)
+CREATE TYPE export_status AS ENUM ('RUNNING', 'DONE', 'FAILED');
+
+CREATE TABLE export (
+    id          INT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    uid         UUID                UNIQUE  NOT NULL,
+    status      export_status               NOT NULL DEFAULT 'RUNNING',
+    total       INT                         NOT NULL DEFAULT 0,
+    done        INT                         NOT NULL DEFAULT 0,
+    author      INT REFERENCES account(id) ON DELETE SET NULL,
+    created     TIMESTAMP                   NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished    TIMESTAMP,
+    CHECK (0 <= done AND done <= total)
+);
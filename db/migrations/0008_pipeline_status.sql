@@ -0,0 +1,2 @@
+-- Pre-processing runs in stages (recognition, named entities, rules), each completed stage is recorded in the status
+ALTER TYPE submission_status ADD VALUE IF NOT EXISTS 'NE_ANNOTATED' BEFORE 'PRE_ANNOTATED';
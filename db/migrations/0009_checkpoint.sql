@@ -0,0 +1,8 @@
+-- Progress of pre-processing stages committed in batches (a retried stage resumes from the sentence starting at `token`)
+CREATE TABLE checkpoint (
+    submission      INT REFERENCES submission(id) ON DELETE CASCADE    NOT NULL,
+    stage           submission_status                                  NOT NULL,
+    token           INT                                                NOT NULL,
+    rule_epoch      BIGINT                                             NOT NULL DEFAULT 0,
+    PRIMARY KEY (submission, stage)
+);
@@ -0,0 +1,20 @@
+-- Changes of submissions are logged instead of updating their rows (concurrent writers of a document don't block
+-- each other). Revision of submission is its folded `revision` and the number of its logged changes.
+CREATE TABLE IF NOT EXISTS submission_revision (
+    submission  INT REFERENCES submission(id) ON DELETE CASCADE    NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS submission_revision_idx ON submission_revision (submission);
+
+CREATE OR REPLACE FUNCTION bump_submission_revision(submission_ids INT[]) RETURNS void AS $$
+    -- Submissions deleted by the statement are skipped
+    INSERT INTO submission_revision (submission) SELECT id FROM submission WHERE id = ANY(submission_ids);
+$$ LANGUAGE SQL;
+
+-- Moves logged changes to revisions of submissions (periodically, keeps the log short)
+CREATE OR REPLACE FUNCTION fold_submission_revisions() RETURNS void AS $$
+    WITH folded AS (DELETE FROM submission_revision RETURNING submission)
+    UPDATE submission SET revision = submission.revision + changed.changes
+    FROM (SELECT submission, count(*) AS changes FROM folded GROUP BY submission) AS changed
+    WHERE submission.id = changed.submission;
+$$ LANGUAGE SQL;
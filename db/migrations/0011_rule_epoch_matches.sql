@@ -0,0 +1,13 @@
+-- Only changes of rule matches increase the rule epoch. Confidence changes and deletes update rule levels of existing
+-- annotations (statement triggers) and new rules are propagated to pre-annotated documents (propagation advances
+-- their applied epoch).
+DROP TRIGGER IF EXISTS rule_epoch_delete_trigger ON rule;
+
+DROP TRIGGER IF EXISTS rule_epoch_update_trigger ON rule;
+
+CREATE CONSTRAINT TRIGGER rule_epoch_update_trigger AFTER UPDATE
+    ON rule
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW
+    WHEN (NEW.type = 'WORD_TYPE' AND (OLD.type, OLD.condition) IS DISTINCT FROM (NEW.type, NEW.condition))
+    EXECUTE PROCEDURE rule_epoch_fn();
@@ -0,0 +1,4 @@
+-- Work is claimed per submission (annotation_work_submission_idx), leases are looked up by annotator
+DROP INDEX IF EXISTS annotation_work_lease_idx;
+
+CREATE INDEX IF NOT EXISTS annotation_work_leased_by_idx ON annotation_work (leased_by) WHERE leased_by IS NOT NULL;
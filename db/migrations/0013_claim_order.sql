@@ -0,0 +1,2 @@
+-- Work is claimed in the order of positions in documents (concurrent annotators get different submissions)
+CREATE INDEX IF NOT EXISTS annotation_work_claim_idx ON annotation_work (ref_start, submission);
@@ -0,0 +1,26 @@
+-- Settings of the application used by the database (written by the application, see `psan.db.sync_settings`)
+CREATE TABLE IF NOT EXISTS setting (
+    name        TEXT PRIMARY KEY,
+    value       INT                         NOT NULL
+);
+
+INSERT INTO setting (name, value) VALUES ('rule_autoapply_confidence', 1) ON CONFLICT DO NOTHING;
+
+-- RULE_AUTOAPPLY_CONFIDENCE of the application
+CREATE OR REPLACE FUNCTION rule_autoapply_confidence() RETURNS INT AS $$
+    SELECT value FROM setting WHERE name = 'rule_autoapply_confidence';
+$$ LANGUAGE SQL STABLE;
+
+-- Work queue is rebuilt with the changed threshold
+CREATE OR REPLACE FUNCTION setting_work_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        PERFORM refresh_annotation_work(ARRAY(SELECT id FROM annotation));
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
+
+CREATE TRIGGER setting_work_trigger AFTER UPDATE
+    ON setting
+    FOR EACH ROW
+    WHEN (NEW.name = 'rule_autoapply_confidence' AND OLD.value IS DISTINCT FROM NEW.value)
+    EXECUTE PROCEDURE setting_work_fn();
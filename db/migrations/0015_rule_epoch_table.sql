@@ -0,0 +1,19 @@
+-- Rule epoch is committed data instead of a sequence (values of a sequence are visible before their transaction
+-- commits, so an epoch could be read before its rules)
+ALTER SEQUENCE IF EXISTS rule_epoch RENAME TO rule_epoch_seq;
+
+CREATE TABLE IF NOT EXISTS rule_epoch (
+    epoch       BIGINT                      NOT NULL
+);
+
+INSERT INTO rule_epoch (epoch) SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM rule_epoch_seq;
+
+DROP SEQUENCE rule_epoch_seq;
+
+-- The row is locked only while the changing transaction commits (deferred triggers)
+CREATE OR REPLACE FUNCTION rule_epoch_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        UPDATE rule_epoch SET epoch = epoch + 1;
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
@@ -0,0 +1,15 @@
+-- First tokens of rule changes by epoch, so propagation advances documents only over changes it has propagated
+CREATE TABLE IF NOT EXISTS rule_epoch_change (
+    epoch       BIGINT                      NOT NULL,
+    first_token TEXT                        NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS rule_epoch_change_epoch_idx ON rule_epoch_change (epoch);
+
+CREATE OR REPLACE FUNCTION rule_epoch_fn() RETURNS trigger AS $emp_stamp$
+    BEGIN
+        UPDATE rule_epoch SET epoch = epoch + 1;
+        INSERT INTO rule_epoch_change (epoch, first_token) SELECT epoch, NEW.condition[1] FROM rule_epoch;
+        RETURN NULL;
+   END;
+$emp_stamp$ LANGUAGE plpgsql;
@@ -66,6 +66,10 @@ def build_app() -> Flask:
     app.register_blueprint(label.bp)
     from psan import generate
     app.register_blueprint(generate.bp)
+    from psan import export
+    app.register_blueprint(export.bp)
+    from psan import stats
+    app.register_blueprint(stats.bp)
 
     # Create register token
     if os.environ.get("ALLOW_TOKEN_REGISTRATION", default="0") == "1":
@@ -1,12 +1,12 @@
 import json
+import os
 import sys
 from io import StringIO
-from typing import Tuple
+from typing import List, Optional, Tuple
 from xml import sax  # nosec
 from xml.sax import make_parser  # nosec
 from xml.sax.saxutils import XMLFilterBase, XMLGenerator  # nosec
 
-from celery_once import AlreadyQueued
 from flask import (Blueprint, Response, current_app, flash, g, jsonify,
                    make_response, redirect, render_template, request, session,
                    url_for)
@@ -16,9 +16,11 @@ from werkzeug.exceptions import BadRequest
 from psan.auth import login_required
 from psan.db import commit, get_cursor
 from psan.model import AccountType, SubmissionStatus
-from psan.submission import get_submission_file
+from psan.submission import get_sentence_index, get_submission_file
 from psan.tool.controller import Controller
 from psan.tool.model import AnnotationDecision, Interval, RuleType
+from psan.tool.offsets import SentenceIndex
+from psan.window_cache import WindowCache, get_window_cache
 
 _ = gettext
 
@@ -36,15 +38,10 @@ def _check_permissinns(start: int, end: int, doc_id: int) -> None:
         raise BadRequest("Insufficient permissions for this window")
 
 
-def _call_re_annotate(doc_id: int) -> None:
-    # Annotate rest using background task
-    from psan.celery import re_annotate
-    re_annotate.re_annotate.delay(doc_id)
-    # Annotate other documents after 120
-    try:
-        re_annotate.re_annotate_all.apply_async((doc_id,), countdown=120)
-    except AlreadyQueued:
-        pass
+def _call_re_annotate(doc_id: int, first_tokens: List[str]) -> None:
+    # Annotate rest and other documents containing first tokens of new rules (bursts are merged by scheduler)
+    from psan.celery.scheduler import get_scheduler
+    get_scheduler().request(doc_id, first_tokens)
 
 
 @bp.route("/")
@@ -101,10 +98,14 @@ def next():
         missing = session['permitted_missing']
 
         if (missing < 3) or (done > 0):
+            with get_cursor() as cursor:
+                _release_work(cursor, g.account["id"])
+                commit()
             session.pop("permitted_doc_id")
             session.pop("permitted_win_start")
             session.pop("permitted_win_end")
             session.pop("permitted_missing")
+            session.pop("permitted_missing_etag", None)
         else:
             flash(_("You should annotate more to move to the next window."), category="error")
 
@@ -113,60 +114,54 @@ def next():
 
 
 def _next_window():
-    # Find longest submission from db
+    # Claim free work from the queue
     with get_cursor() as cursor:
-        min_confidence = current_app.config["RULE_AUTOAPPLY_CONFIDENCE"]
-        # Faster method
-        cursor.execute("SELECT submission.id as id FROM submission "
-                       " WHERE status = %s AND EXISTS ( SELECT 1 FROM"
-                       " annotation WHERE submission.id=annotation.submission and"
-                       " (token_level IS NULL and ABS(rule_level) < %s))"
-                       " ORDER BY random() LIMIT 1",
-                       (SubmissionStatus.PRE_ANNOTATED.value, min_confidence))
-        document = cursor.fetchone()
-        if not document:
-            # Much slower method for missing labels
-            cursor.execute("SELECT s.id as id FROM submission s "
-                           " WHERE s.status = %s AND EXISTS ("
-                           " SELECT 1 FROM annotation a"
-                           " LEFT JOIN (annotation_rule ar "
-                           " INNER JOIN rule r ON r.id = ar.rule AND r.label IS NOT NULL AND r.confidence < 0)"
-                           " ON ar.annotation = a.id"
-                           " WHERE a.submission = s.id and ((token_level IS NULL AND ABS(rule_level) < %s)"  # not decided
-                           " OR ((token_level = %s OR (token_level IS NULL AND rule_level < %s))"  # or (secret
-                           " and COALESCE(a.label, r.label) IS NULL)))"
-                           " ORDER BY random() LIMIT 1",
-                           (SubmissionStatus.PRE_ANNOTATED.value, min_confidence, AnnotationDecision.SECRET.value,
-                            min_confidence))
-            document = cursor.fetchone()
-        if document:
-            doc_id = document["id"]
-            # Show first candadate of submission
-            ref_start, ref_end = _next_annotation_for_window(cursor, doc_id)
-            return _show_window(doc_id, ref_start, ref_end)
-        else:
-            return render_template("annotate/empty.html")
+        work = _claim_work(cursor, g.account["id"], g.account["window_size"])
+        commit()
+    if work:
+        doc_id, ref_start, ref_end = work
+        return _show_window(doc_id, ref_start, ref_end)
+    else:
+        return render_template("annotate/empty.html")
+
+
+def _claim_work(cursor, account_id: int, window_size: int) -> Optional[Tuple[int, int, int]]:
+    """Leases the first free annotation from the work queue together with free work in its window.
+    Work is taken in the order of positions in documents (index `annotation_work_claim_idx`), so windows leased
+    or being claimed by other annotators move the next annotator to the same position of another submission.
+    Returns (submission ID, ref_start, ref_end) of the annotation or None when there is no free work."""
+    cursor.execute("SELECT annotation, submission, ref_start, ref_end FROM annotation_work"
+                   " WHERE lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP"
+                   " ORDER BY ref_start, submission LIMIT 1 FOR UPDATE SKIP LOCKED")
+    row = cursor.fetchone()
+    if not row:
+        return None
+    # Lease whole window, so other annotators get different windows (work being claimed by others is skipped)
+    cursor.execute("UPDATE annotation_work"
+                   " SET leased_by = %s, lease_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'"
+                   " WHERE annotation IN (SELECT annotation FROM annotation_work"
+                   "  WHERE submission = %s and %s <= ref_start and ref_start <= %s"
+                   "  and (annotation = %s or lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP)"
+                   "  FOR UPDATE SKIP LOCKED)",
+                   (account_id, current_app.config["ANNOTATION_LEASE_TIMEOUT"], row["submission"],
+                    max(row["ref_start"] - window_size, 0), row["ref_start"] + window_size, row["annotation"]))
+    return row["submission"], row["ref_start"], row["ref_end"]
+
+
+def _release_work(cursor, account_id: int) -> None:
+    """Returns work leased by the account to the queue"""
+    cursor.execute("UPDATE annotation_work SET leased_by = NULL, lease_until = NULL WHERE leased_by = %s", (account_id,))
 
 
 def _next_annotation_for_window(cursor, doc_id) -> Tuple[int, int]:
-    min_confidence = current_app.config["RULE_AUTOAPPLY_CONFIDENCE"]
     # Show first candadate of submission
-    cursor.execute("SELECT submission, ref_start, ref_end"
-                   " FROM annotation a"
-                   " LEFT JOIN (annotation_rule ar "
-                   " INNER JOIN rule r ON r.id = ar.rule AND r.label IS NOT NULL AND r.confidence < 0)"
-                   " ON ar.annotation = a.id"
-                   " WHERE submission=%s and ((token_level IS NULL AND ABS(rule_level) < %s)"  # not decided
-                   " OR ((token_level = %s OR (token_level IS NULL AND rule_level < %s))"  # or (secret
-                   " and COALESCE(a.label, r.label) IS NULL))"  # and missing label)
-                   " ORDER BY ref_start"
-                   " LIMIT 1",
-                   (doc_id, min_confidence, AnnotationDecision.SECRET.value, min_confidence))
+    cursor.execute("SELECT ref_start, ref_end FROM annotation_work WHERE submission = %s ORDER BY ref_start LIMIT 1",
+                   (doc_id,))
     row = cursor.fetchone()
     if row:
         return row["ref_start"], row["ref_end"]
     else:
-        return sys.maxint, sys.maxint
+        return sys.maxsize, sys.maxsize
 
 
 def _show_window(submission_id: int, ref_start: int, ref_end: int):
@@ -179,6 +174,7 @@ def _show_window(submission_id: int, ref_start: int, ref_end: int):
     session["permitted_win_end"] = win_end
     if "permitted_missing" in session:
         session.pop("permitted_missing")
+    session.pop("permitted_missing_etag", None)
 
     is_admin = (g.account["type"] == AccountType.ADMIN.value)
     return render_template("annotate/index.html", submission_id=submission_id,  win_start=win_start, win_end=win_end,
@@ -202,23 +198,66 @@ def window():
         with get_cursor() as cursor:
             cursor.execute("SELECT uid FROM submission WHERE id = %s", (submission_id,))
             submission_uid = cursor.fetchone()["uid"]
+            next_window = _next_window_after(cursor, submission_id, end)
         filename = get_submission_file(submission_uid, SubmissionStatus.RECOGNIZED)
 
-        # Transform line for UI
-        output = StringIO()
-        generator = XMLGenerator(output)
-        filter = RecognizedTagFilter(start, end, make_parser())
-        filter.setContentHandler(generator)
-        # Line has to be surrounded with XML tags
-        sax.parse(filename, filter)
-        filter.appendNeTypes()
+        # Rendered windows are shared by all workers
+        cache = get_window_cache()
+        if cache is None:
+            html = _render_window(filename, get_sentence_index(submission_uid), start, end)
+        else:
+            mtime = os.stat(filename).st_mtime_ns
+            key = WindowCache.key(submission_uid, start, end, mtime)
+            html = cache.get(key)
+            if html is None:
+                html = _render_window(filename, get_sentence_index(submission_uid), start, end)
+                cache.put(key, html)
         # Prepare response
-        response = make_response(output.getvalue())
+        response = make_response(html)
         # Enable browser cache
         response.set_etag(f"{submission_id}-{start}-{end}")
+        if cache is not None and next_window is not None:
+            # Render the following window after the response is sent
+            app = current_app._get_current_object()
+            response.call_on_close(lambda: _prefetch_window(app, submission_uid, *next_window, mtime))
         return response
 
 
+def _render_window(filename: str, index: SentenceIndex, start: int, end: int) -> str:
+    # Transform line for UI
+    output = StringIO()
+    generator = XMLGenerator(output)
+    filter = RecognizedTagFilter(start, end, make_parser())
+    filter.setContentHandler(generator)
+    # Parse only sentences intersecting with the window
+    sax.parse(index.read_window(filename, start, end), filter)
+    filter.appendNeTypes()
+    return output.getvalue()
+
+
+def _next_window_after(cursor, doc_id: int, end: int) -> Optional[Tuple[int, int]]:
+    # Window of the first waiting annotation behind the current one (as shown by `_show_window`)
+    cursor.execute("SELECT ref_start FROM annotation_work WHERE submission = %s and ref_start > %s"
+                   " ORDER BY ref_start LIMIT 1", (doc_id, end))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return max(row["ref_start"] - g.account["window_size"], 0), row["ref_start"] + g.account["window_size"]
+
+
+def _prefetch_window(app, submission_uid: str, start: int, end: int, mtime: int) -> None:
+    with app.app_context():
+        cache = get_window_cache()
+        key = WindowCache.key(submission_uid, start, end, mtime)
+        try:
+            if not cache.contains(key):
+                filename = get_submission_file(submission_uid, SubmissionStatus.RECOGNIZED)
+                cache.put(key, _render_window(filename, get_sentence_index(submission_uid), start, end), prefetch=True)
+        except Exception:
+            # Prefetch is only an optimization, the window is rendered on request otherwise
+            current_app.logger.exception(f"Prefetch of window {start}-{end} of {submission_uid} failed")
+
+
 @ bp.route("/decisions")
 @ login_required()
 def decisions():
@@ -230,17 +269,27 @@ def decisions():
 
     min_confidence = current_app.config["RULE_AUTOAPPLY_CONFIDENCE"]
 
-    # Returns decision in defined interval
-    decisions = []
     with get_cursor() as cursor:
         ctl = Controller(cursor, submission_id, g.account["id"])
+        # Decisions of the window don't change until the revision of the document changes
+        etag = f"{submission_id}-{ctl.revision()}-{window_start}-{window_end}"
+        # Missing annotations of the window are known only when they were computed for the same revision
+        if request.if_none_match.contains(etag) and session.get("permitted_missing_etag") == etag:
+            return Response(status=304)  # Return HTTP 304 (Not modified)
+
+        # Returns decision in defined interval
         decisions = ctl.get_decisions(Interval(window_start, window_end), min_confidence)
 
     # Window annotations missing
     session["permitted_missing"] = sum(1 for d in decisions if d["decision"] is None
                                        or (d["decision"] == AnnotationDecision.SECRET.value and d["label"] is None))
+    session["permitted_missing_etag"] = etag
 
-    return jsonify(decisions)
+    response = jsonify(decisions)
+    # Browser has to revalidate decisions on each poll
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 
 @ bp.route("/detail")
@@ -330,8 +379,9 @@ def decision():
         commit()
 
     if rule_type or candidate:
-        # Annotate rest using background task
-        _call_re_annotate(doc_id)
+        # Annotate rest using background task (word rules and candidates share selected tokens)
+        word_rule = rule_type != RuleType.NE_TYPE
+        _call_re_annotate(doc_id, json.loads(request.form["tokens"])[:1] if word_rule else [])
 
     # Send OK reply
     return jsonify({"status": "ok"})
@@ -365,7 +415,7 @@ def label():
         commit()
         # Annotate rest of file using new candidate
         if candidate:
-            _call_re_annotate()
+            _call_re_annotate(doc_id, types[:1])
 
     return jsonify({"status": "ok"})
 
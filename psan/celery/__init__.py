@@ -3,7 +3,9 @@ import os
 from flask import Flask
 
 from celery import Celery, Task
-from celery_once import QueueOnce
+from celery.signals import worker_process_init, worker_process_shutdown
+
+from psan.tool.parser import set_default_engine
 
 
 def init_celery(app: Flask) -> None:
@@ -12,16 +14,26 @@ def init_celery(app: Flask) -> None:
         app.name,
         backend=os.environ["CELERY_REDIS"],
         broker=os.environ["CELERY_REDIS"],
-        include=["psan.celery.pre_process", "psan.celery.re_annotate"]
+        include=["psan.celery.pre_process", "psan.celery.re_annotate", "psan.celery.export"]
     )
     celery.conf.update(app.config)
-    celery.conf.ONCE = {
-        'backend': 'celery_once.backends.Redis',
-        'settings': {
-            'url': os.environ["CELERY_REDIS"],
-            'default_timeout': 60 * 60
-        }
+    # Stages of pre-processing run on separate queues, so their workers can be scaled independently
+    # (CPU bound recognition does not delay database bound rule application)
+    celery.conf.task_routes = {
+        "psan.celery.pre_process.recognize": {"queue": "ner"},
+        "psan.celery.pre_process.pre_annotate": {"queue": "annotate"},
+        "psan.celery.pre_process.apply_rules": {"queue": "rules"},
+        "psan.celery.re_annotate.re_annotate": {"queue": "rules"},
+        "psan.celery.re_annotate.propagate": {"queue": "rules"},
+    }
+    # Periodic reconciliation of documents with outdated rules and folding of logged document changes
+    # (needs `celery beat` or worker with `-B`)
+    celery.conf.beat_schedule = {
+        "reconcile": {"task": "psan.celery.re_annotate.reconcile", "schedule": app.config["RECONCILE_INTERVAL"]},
+        "fold_revisions": {"task": "psan.celery.re_annotate.fold_revisions",
+                           "schedule": app.config["REVISION_FOLD_INTERVAL"]},
     }
+    set_default_engine(app.config["ANNOTATION_PARSER_ENGINE"])
 
     class ContextTask(Task):
         def __call__(self, *args, **kwargs):
@@ -30,10 +42,16 @@ def init_celery(app: Flask) -> None:
 
     celery.Task = ContextTask
 
-    # Make QueueOnce app context aware.
-    class ContextQueueOnce(QueueOnce):
-        def __call__(self, *args, **kwargs):
-            with app.app_context():
-                return super(ContextQueueOnce, self).__call__(*args, **kwargs)
 
-    celery.QueueOnce = ContextQueueOnce
+@worker_process_init.connect
+def preload_ner_models(**kwargs) -> None:
+    """Load NER models in each worker process before the first task arrives"""
+    from psan.tool.task.recognize import preload_models
+    preload_models()
+
+
+@worker_process_shutdown.connect
+def close_ner_models(**kwargs) -> None:
+    """Stop processes of loaded NER models (pools of parallel recognition) with the worker process"""
+    from psan.tool.task.recognize import close_models
+    close_models()
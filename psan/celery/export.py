@@ -0,0 +1,91 @@
+import os
+import shutil
+import zipfile
+from contextlib import ExitStack
+from typing import List, Tuple
+
+from celery import chord
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from psan.celery import celery
+from psan.db import commit, get_cursor
+from psan.export import get_export_file, get_export_folder
+from psan.generate import OUTPUT_FORMATS, secret_decisions, write_outputs
+from psan.model import ExportStatus, SubmissionStatus
+from psan.submission import get_submission_file
+from psan.tool import controller
+
+
+def _get_parts_folder(uid: str) -> str:
+    return os.path.join(get_export_folder(), uid)
+
+
+def start_export(export_id: int, doc_ids: List[int]) -> None:
+    """Pseudonymizes documents in parallel and joins them into a single archive"""
+    archive = build_archive.s(export_id).on_error(export_failed.si(export_id))
+    chord(export_document.s(export_id, doc_id) for doc_id in doc_ids)(archive)
+
+
+@celery.task()
+def export_document(export_id: int, doc_id: int) -> List[Tuple[str, str]]:
+    """Writes all output formats of the document into parts of the export (in a single pass over the document).
+    Returns part files and their names in the archive."""
+    with get_cursor() as cursor:
+        cursor.execute("SELECT uid FROM export WHERE id = %s", (export_id,))
+        export_uid = str(cursor.fetchone()["uid"])
+        cursor.execute("SELECT uid, name FROM submission WHERE id = %s", (doc_id,))
+        data = cursor.fetchone()
+        uid = str(data["uid"])
+        name = f"{secure_filename(data['name']) or uid}-{uid}"
+
+        # Same output as `generate.output`
+        folder = _get_parts_folder(export_uid)
+        os.makedirs(folder, exist_ok=True)
+        parts = [(os.path.join(folder, uid + output_format.suffix), name + output_format.suffix)
+                 for output_format in OUTPUT_FORMATS.values()]
+        ctl = controller.Controller(cursor, doc_id)
+        decisions = secret_decisions(ctl, current_app.config["RULE_AUTOAPPLY_CONFIDENCE"])
+        with ExitStack() as stack:
+            outputs = {format: stack.enter_context(open(part, mode="w", encoding="utf-8"))
+                       for format, (part, _) in zip(OUTPUT_FORMATS, parts)}
+            write_outputs(get_submission_file(uid, SubmissionStatus.RECOGNIZED), decisions, outputs)
+        # Close the server-side cursor before commit
+        decisions.close()
+
+        # Progress
+        cursor.execute("UPDATE export SET done = done + 1 WHERE id = %s", (export_id,))
+        commit()
+    return parts
+
+
+@celery.task()
+def build_archive(documents: List[List[Tuple[str, str]]], export_id: int) -> str:
+    """Joins exported documents into a zip archive (parts are streamed into the archive and removed)"""
+    with get_cursor() as cursor:
+        cursor.execute("SELECT uid FROM export WHERE id = %s", (export_id,))
+        export_uid = str(cursor.fetchone()["uid"])
+    archive = get_export_file(export_uid)
+    os.makedirs(os.path.dirname(archive), exist_ok=True)
+    # Archive appears only when it is complete
+    with zipfile.ZipFile(archive + ".tmp", mode="w", compression=zipfile.ZIP_DEFLATED) as zip:
+        for part, name in sorted((part for parts in documents for part in parts), key=lambda part: part[1]):
+            zip.write(part, name)
+    os.replace(archive + ".tmp", archive)
+    shutil.rmtree(_get_parts_folder(export_uid), ignore_errors=True)
+
+    with get_cursor() as cursor:
+        cursor.execute("UPDATE export SET status = %s, finished = CURRENT_TIMESTAMP WHERE id = %s",
+                       (ExportStatus.DONE.value, export_id))
+        commit()
+    return archive
+
+
+@celery.task()
+def export_failed(export_id: int) -> None:
+    with get_cursor() as cursor:
+        cursor.execute("UPDATE export SET status = %s, finished = CURRENT_TIMESTAMP WHERE id = %s RETURNING uid",
+                       (ExportStatus.FAILED.value, export_id))
+        export_uid = str(cursor.fetchone()["uid"])
+        commit()
+    shutil.rmtree(_get_parts_folder(export_uid), ignore_errors=True)
@@ -1,40 +1,124 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import psycopg2
+from celery import chain
+from celery.canvas import Signature
+from flask import current_app
+from psycopg2.pool import PoolError
+
 from psan.celery import celery
-from psan.db import commit, get_cursor
+from psan.db import commit, get_cursor, get_db
 from psan.model import SubmissionStatus
-from psan.submission import get_submission_file
+from psan.submission import (get_sentence_index, get_sentence_index_file,
+                             get_submission_file)
 from psan.tool import controller
-from psan.tool.task.pre_annotate import detect_recognized_name_entries
-from psan.tool.task.re_annotate import apply_rules
-from psan.tool.task.recognize import recognize_file
+from psan.tool.offsets import SentenceIndex
+from psan.tool.task.checkpoint import run_resumable
+from psan.tool.task.index_tokens import TokenIndexParser
+from psan.tool.task.pre_annotate import PreAnnotationParser
+from psan.tool.task.re_annotate import ReAnnotateParser
+from psan.tool.task.recognize import get_ner
 
+# Database failures are retried by each stage and tasks of lost workers are redelivered
+# (stages skip finished submissions and annotation stages resume from their last committed checkpoint)
+_RETRY_ERRORS = (psycopg2.OperationalError, PoolError)
+_RETRY_OPTIONS = {"autoretry_for": _RETRY_ERRORS, "retry_backoff": True, "max_retries": 5,
+                  "acks_late": True, "reject_on_worker_lost": True}
+# Class of advisory locks held by the worker pre-processing a submission
+_PRE_PROCESS_LOCK = 0x70726570
 
-@celery.task()
-def pre_process(document_id: int) -> None:
-    with get_cursor() as cursor:
-        cursor.execute("SELECT uid FROM submission WHERE id = %s", (document_id,))
-        uid = cursor.fetchone()["uid"]
 
-    # Input recognized file
-    input_file = get_submission_file(uid, SubmissionStatus.NEW)
-    recognized_file = get_submission_file(uid, SubmissionStatus.RECOGNIZED)
+def pre_process_chain(document_id: int, model: Optional[str] = None) -> Signature:
+    """Stages of pre-processing (each stage runs on its own queue, see `init_celery`)"""
+    return chain(recognize.si(document_id, model), pre_annotate.si(document_id), apply_rules.si(document_id))
+
 
-    # Run recognition
-    num_tokens = recognize_file(input_file, recognized_file)
+def pre_process(document_id: int, model: Optional[str] = None) -> None:
+    """Registers pre-processing of a new submission"""
+    pre_process_chain(document_id, model).delay()
 
+
+@contextmanager
+def _claim_submission(document_id: int, status: SubmissionStatus) -> Iterator[Optional[str]]:
+    """Claims the submission in `status` for the stage and yields its uid (None when the stage is already done or
+    another worker runs it, e.g. a redelivered task). The claim is a session-level advisory lock, so it is held
+    across checkpoint commits and released with the connection of a lost worker."""
     with get_cursor() as cursor:
-        cursor.execute("UPDATE submission SET status = %s, num_tokens = %s WHERE id = %s",
-                       (SubmissionStatus.RECOGNIZED.value, num_tokens, document_id))
-        commit()
+        cursor.execute("SELECT pg_try_advisory_lock(%s, %s) AS locked", (_PRE_PROCESS_LOCK, document_id))
+        if not cursor.fetchone()["locked"]:
+            commit()
+            yield None
+            return
+        try:
+            # Status committed by a previous holder of the lock
+            cursor.execute("SELECT uid, status FROM submission WHERE id = %s", (document_id,))
+            data = cursor.fetchone()
+            yield data["uid"] if data is not None and data["status"] == status.value else None
+        finally:
+            db = get_db()
+            try:
+                db.rollback()
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", (_PRE_PROCESS_LOCK, document_id))
+                db.commit()
+            except psycopg2.Error:
+                # Broken connection (the lock is released with the session)
+                pass
 
-        ctl = controller.Controller(cursor, document_id)
 
-        # Run pre-annotation
-        detect_recognized_name_entries(recognized_file, ctl)
+@celery.task(**_RETRY_OPTIONS)
+def recognize(document_id: int, model: Optional[str] = None) -> Dict[str, Any]:
+    """Recognizes named entities (CPU bound) and indexes sentence offsets for text windows"""
+    with _claim_submission(document_id, SubmissionStatus.NEW) as uid:
+        if uid is None:
+            return {}
+
+        # Run recognition
+        input_file = get_submission_file(uid, SubmissionStatus.NEW)
+        recognized_file = get_submission_file(uid, SubmissionStatus.RECOGNIZED)
+        ner = get_ner(model)
+        num_tokens = ner.recognize_file(input_file, recognized_file)
+        SentenceIndex.build(recognized_file).save(get_sentence_index_file(uid))
 
-        # Re-annotate
-        apply_rules(recognized_file, ctl)
+        with get_cursor() as cursor:
+            cursor.execute("UPDATE submission SET status = %s, num_tokens = %s WHERE id = %s",
+                           (SubmissionStatus.RECOGNIZED.value, num_tokens, document_id))
+            commit()
 
-        # Update document status
-        cursor.execute("UPDATE submission SET status = %s WHERE id = %s",
-                       (SubmissionStatus.PRE_ANNOTATED.value, document_id))
+    return {"num_tokens": num_tokens, "ner": ner.statistics}
+
+
+@celery.task(**_RETRY_OPTIONS)
+def pre_annotate(document_id: int) -> None:
+    """Indexes tokens and annotates named entities of the recognized file"""
+    with _claim_submission(document_id, SubmissionStatus.RECOGNIZED) as uid, get_cursor() as cursor:
+        if uid is None:
+            return
+        ctl = controller.Controller(cursor, document_id)
+        stage = SubmissionStatus.NE_ANNOTATED.value
+        run_resumable(get_submission_file(uid, SubmissionStatus.RECOGNIZED), get_sentence_index(uid), ctl, stage,
+                      [TokenIndexParser(ctl), PreAnnotationParser(ctl)], commit,
+                      batch_size=current_app.config["PRE_PROCESS_BATCH"])
+        ctl.clear_checkpoint(stage)
+        cursor.execute("UPDATE submission SET status = %s WHERE id = %s", (stage, document_id))
+        commit()
+
+
+@celery.task(**_RETRY_OPTIONS)
+def apply_rules(document_id: int) -> None:
+    """Applies known rules, the submission is ready for annotation afterwards"""
+    with _claim_submission(document_id, SubmissionStatus.NE_ANNOTATED) as uid, get_cursor() as cursor:
+        if uid is None:
+            return
+        ctl = controller.Controller(cursor, document_id)
+        stage = SubmissionStatus.PRE_ANNOTATED.value
+        # Changes committed after reading the epoch (of the first run) are applied by reconciliation
+        epoch = ctl.rule_epoch()
+        rules = ctl.load_rules()
+        epoch = run_resumable(get_submission_file(uid, SubmissionStatus.RECOGNIZED), get_sentence_index(uid), ctl,
+                              stage, [ReAnnotateParser(ctl, rules)], commit, epoch,
+                              batch_size=current_app.config["PRE_PROCESS_BATCH"])
+        ctl.set_applied_rule_epoch(epoch)
+        ctl.clear_checkpoint(stage)
+        cursor.execute("UPDATE submission SET status = %s WHERE id = %s", (stage, document_id))
         commit()
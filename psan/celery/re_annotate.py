@@ -1,13 +1,25 @@
+from typing import List, Optional
+
+from flask import current_app
+
 from psan.celery import celery
+from psan.celery.scheduler import get_scheduler
 from psan.db import commit, get_cursor
 from psan.model import SubmissionStatus
 from psan.submission import get_submission_file
 from psan.tool import controller
-from psan.tool.task.re_annotate import apply_rules
+from psan.tool.task.index_tokens import index_tokens
+from psan.tool.task.re_annotate import apply_rules, propagate_rules
 
 
 @celery.task()
 def re_annotate(doc_id: int) -> None:
+    """Applies rules to the document (runs scheduled by the coalescing scheduler)"""
+    scheduler = get_scheduler()
+    generation = scheduler.start_document(doc_id)
+    if generation is None:
+        # Changes were already applied by a newer run
+        return
     with get_cursor() as cursor:
         # Get submission file
         cursor.execute("SELECT uid FROM submission WHERE id = %s", (doc_id,))
@@ -16,27 +28,64 @@ def re_annotate(doc_id: int) -> None:
 
         ctl = controller.Controller(cursor, doc_id)
 
-        # Parse file and apply rules
+        # Index documents pre-processed before token index existed
+        if not ctl.is_indexed():
+            index_tokens(submission_file, ctl)
+
+        # Parse file and apply rules (changes committed after reading the epoch are applied by another run)
+        epoch = ctl.rule_epoch()
         apply_rules(submission_file, ctl)
+        ctl.set_applied_rule_epoch(epoch)
 
         commit()
+    scheduler.finish_document(doc_id, generation)
 
 
-@celery.task(base=celery.QueueOnce, once={'keys': []})
-def re_annotate_all(skip_doc_id: int) -> None:
+@celery.task()
+def propagate(first_tokens: Optional[List[str]] = None) -> None:
+    """Applies rules to indexed occurrences of their first tokens in all pre-annotated submissions.
+    Without `first_tokens` all tokens pending in the scheduler are propagated and documents pre-annotated before
+    the run are marked up to date with rules committed before it, as far as those rules start with the propagated
+    tokens. Documents behind a rule whose token was not propagated by this run are left to reconciliation."""
     with get_cursor() as cursor:
-        # Get submission file
-        cursor.execute("SELECT id,uid FROM submission WHERE status = %s", (SubmissionStatus.PRE_ANNOTATED.value,))
-        for row in cursor:
-            id = row["id"]
-            uid = row["uid"]
-            if skip_doc_id == id:
-                continue
-
-            submission_file = get_submission_file(uid, SubmissionStatus.RECOGNIZED)
-            with get_cursor() as cur:
-                ctl = controller.Controller(cur, id)
-
-                # Parse file and apply rules
-                apply_rules(submission_file, ctl)
-                commit()
+        ctl = controller.Controller(cursor, None)
+        doc_ids: List[int] = []
+        if first_tokens is None:
+            epoch = ctl.rule_epoch()
+            first_tokens = get_scheduler().start_propagation()
+            doc_ids = ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value, epoch, None)
+            commit()
+        for first_token in sorted(set(first_tokens)):
+            propagate_rules(first_token, ctl, SubmissionStatus.PRE_ANNOTATED.value)
+            commit()
+        if doc_ids:
+            ctl.set_propagated_rule_epoch(doc_ids, epoch, sorted(set(first_tokens)))
+            commit()
+
+
+@celery.task()
+def reconcile(limit: Optional[int] = None) -> int:
+    """Schedules re-annotation of pre-annotated submissions which have not seen the latest rule changes.
+    Runs periodically; documents are processed by independent `re_annotate` tasks and marked up to date only
+    when their run commits, so unfinished work is picked up again by the next reconciliation."""
+    if limit is None:
+        limit = current_app.config["RECONCILE_BATCH"]
+    with get_cursor() as cursor:
+        ctl = controller.Controller(cursor, None)
+        doc_ids = ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value, ctl.rule_epoch(), limit)
+        # Keep the log of rule changes short
+        ctl.prune_rule_epoch_changes(SubmissionStatus.DONE.value)
+        commit()
+    scheduler = get_scheduler()
+    for doc_id in doc_ids:
+        scheduler.request(doc_id)
+    return len(doc_ids)
+
+
+@celery.task()
+def fold_revisions() -> None:
+    """Moves logged changes of documents to their revisions.
+    Runs periodically, so reading a revision counts only the changes logged since the last run."""
+    with get_cursor() as cursor:
+        controller.Controller(cursor, None).fold_revisions()
+        commit()
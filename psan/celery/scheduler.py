@@ -0,0 +1,119 @@
+"""Coalescing scheduler of re-annotation tasks.
+
+Annotator decisions only record pending work in Redis. The first request schedules a delayed task and the following
+requests for the same document (or rule propagation) are merged into it until the task starts. Each document run
+covers all changes requested before its start, so queued runs that are already covered by a newer run are dropped.
+"""
+import os
+from typing import Callable, Dict, Iterable, Optional
+
+from redis import Redis
+
+_PREFIX = "psan:re-annotate:"
+_STATS_KEY = _PREFIX + "stats"
+_PROPAGATE_QUEUED_KEY = _PREFIX + "propagate:queued"
+_PROPAGATE_TOKENS_KEY = _PREFIX + "propagate:tokens"
+
+
+def _requested_key(doc_id: int) -> str:
+    return f"{_PREFIX}document:{doc_id}:requested"
+
+
+def _covered_key(doc_id: int) -> str:
+    return f"{_PREFIX}document:{doc_id}:covered"
+
+
+def _queued_key(doc_id: int) -> str:
+    return f"{_PREFIX}document:{doc_id}:queued"
+
+
+class ReAnnotationScheduler:
+    """Records pending rule changes and schedules at most one queued re-annotation per document.
+    `enqueue_document(doc_id, countdown)` and `enqueue_propagation(countdown)` submit the actual tasks."""
+
+    def __init__(self, redis: Redis, enqueue_document: Callable[[int, int], None],
+                 enqueue_propagation: Callable[[int], None], delay: int = 5, lock_timeout: int = 60 * 60) -> None:
+        self._redis = redis
+        self._enqueue_document = enqueue_document
+        self._enqueue_propagation = enqueue_propagation
+        self._delay = delay
+        self._lock_timeout = lock_timeout
+
+    def request(self, doc_id: Optional[int], first_tokens: Iterable[str] = ()) -> None:
+        """Records rule change of the document and first tokens of new rules (applied to other documents)"""
+        if doc_id is not None:
+            self._redis.incr(_requested_key(doc_id))
+            self._redis.hincrby(_STATS_KEY, "requested", 1)
+            # Only the first request of a burst schedules the task
+            if self._redis.set(_queued_key(doc_id), 1, nx=True, ex=self._lock_timeout):
+                self._redis.hincrby(_STATS_KEY, "scheduled", 1)
+                self._enqueue_document(doc_id, self._delay)
+            else:
+                self._redis.hincrby(_STATS_KEY, "coalesced", 1)
+        first_tokens = list(first_tokens)
+        if first_tokens:
+            self._redis.sadd(_PROPAGATE_TOKENS_KEY, *first_tokens)
+            self._redis.hincrby(_STATS_KEY, "propagation_requested", 1)
+            if self._redis.set(_PROPAGATE_QUEUED_KEY, 1, nx=True, ex=self._lock_timeout):
+                self._redis.hincrby(_STATS_KEY, "propagation_scheduled", 1)
+                self._enqueue_propagation(self._delay)
+
+    def start_document(self, doc_id: int) -> Optional[int]:
+        """Called by the task before re-annotation. Returns the generation of changes covered by this run
+        or None when the run is stale (all requested changes were covered by another run)."""
+        # Requests arriving from now on need a new run
+        self._redis.delete(_queued_key(doc_id))
+        requested = int(self._redis.get(_requested_key(doc_id)) or 0)
+        covered = int(self._redis.get(_covered_key(doc_id)) or 0)
+        if requested and requested <= covered:
+            self._redis.hincrby(_STATS_KEY, "dropped", 1)
+            return None
+        self._redis.hincrby(_STATS_KEY, "runs", 1)
+        return requested
+
+    def finish_document(self, doc_id: int, generation: int) -> None:
+        """Marks changes up to the generation as applied"""
+        covered = int(self._redis.get(_covered_key(doc_id)) or 0)
+        if generation > covered:
+            self._redis.set(_covered_key(doc_id), generation)
+
+    def start_propagation(self) -> Iterable[str]:
+        """Called by the propagation task. Returns all pending first tokens."""
+        self._redis.delete(_PROPAGATE_QUEUED_KEY)
+        pipeline = self._redis.pipeline()
+        pipeline.smembers(_PROPAGATE_TOKENS_KEY)
+        pipeline.delete(_PROPAGATE_TOKENS_KEY)
+        tokens, _ = pipeline.execute()
+        self._redis.hincrby(_STATS_KEY, "propagation_runs", 1)
+        return sorted(token.decode() if isinstance(token, bytes) else token for token in tokens)
+
+    def statistics(self) -> Dict[str, float]:
+        """Counters, queue depth (documents waiting for re-annotation) and coalescing ratio
+        (share of requests merged into an already queued run)"""
+        stats = {key.decode() if isinstance(key, bytes) else key: int(value)
+                 for key, value in self._redis.hgetall(_STATS_KEY).items()}
+        for name in ("requested", "scheduled", "coalesced", "dropped", "runs",
+                     "propagation_requested", "propagation_scheduled", "propagation_runs"):
+            stats.setdefault(name, 0)
+        stats["queue_depth"] = sum(1 for _ in self._redis.scan_iter(_queued_key("*")))
+        stats["pending_tokens"] = self._redis.scard(_PROPAGATE_TOKENS_KEY)
+        stats["coalescing_ratio"] = stats["coalesced"] / stats["requested"] if stats["requested"] else 0.0
+        return stats
+
+
+_scheduler: Optional[ReAnnotationScheduler] = None
+
+
+def get_scheduler() -> ReAnnotationScheduler:
+    """Scheduler using the Celery Redis instance and re-annotation tasks"""
+    global _scheduler
+    if _scheduler is None:
+        from flask import current_app
+
+        from psan.celery import re_annotate
+        _scheduler = ReAnnotationScheduler(
+            Redis.from_url(os.environ["CELERY_REDIS"]),
+            lambda doc_id, countdown: re_annotate.re_annotate.apply_async((doc_id,), countdown=countdown),
+            lambda countdown: re_annotate.propagate.apply_async((), countdown=countdown),
+            delay=current_app.config["RE_ANNOTATE_DELAY"])
+    return _scheduler
@@ -1,21 +1,63 @@
+import itertools
 import os
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import click
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
-from flask import Flask, g
+from flask import Flask, current_app, g
+from flask.cli import with_appcontext
+
+from psan.db_pool import ConnectionPool
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db", "migrations")
+_MIGRATION_PATTERN = re.compile(r"^(\d+)_\w+\.sql$")
+_MIGRATION_LOCK_ID = 0x7073616E  # advisory lock serializing concurrent migration runs
+
+_STREAM_ITERSIZE = int(os.environ.get("DB_STREAM_ITERSIZE", "2000"))
+_stream_ids = itertools.count()
+
+_pool: Optional[ConnectionPool] = None
+_pool_pid: Optional[int] = None
+# Pools inherited from the parent process must not be closed (their sockets are shared with the parent)
+_inherited_pools: List[ConnectionPool] = []
+# Process which wrote settings of the application to the database
+_settings_pid: Optional[int] = None
+
+
+def _connect():
+    return psycopg2.connect(database=os.environ["DB_NAME"],
+                            user=os.environ["DB_USER"],
+                            password=os.environ["DB_PASSWORD"],
+                            host=os.environ["DB_HOST"],
+                            port="5432")
+
+
+def get_pool() -> ConnectionPool:
+    """Returns connection pool of the current process (created on the first use after fork)"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        if _pool is not None:
+            _inherited_pools.append(_pool)
+        _pool = ConnectionPool(_connect,
+                               min_size=int(os.environ.get("DB_POOL_MIN", "1")),
+                               max_size=int(os.environ.get("DB_POOL_MAX", "10")),
+                               timeout=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+                               check_idle=float(os.environ.get("DB_POOL_CHECK_IDLE", "30")))
+        _pool_pid = os.getpid()
+    return _pool
 
 
 def get_db():
-    """Connect to the application's configured database. The connection
-    is unique for each request and will be reused if this is called
-    again.
+    """Get a connection to the application's configured database from the pool.
+    The connection is unique for each request and will be reused if this is
+    called again.
     """
     if "db" not in g:
-        g.db = psycopg2.connect(database=os.environ["DB_NAME"],
-                                user=os.environ["DB_USER"],
-                                password=os.environ["DB_PASSWORD"],
-                                host=os.environ["DB_HOST"],
-                                port="5432")
+        g.db = get_pool().getconn()
+        _sync_settings_once(g.db)
     return g.db
 
 
@@ -27,14 +69,112 @@ def commit():
     get_db().commit()
 
 
+def stream(query: str, args=None, itersize: Optional[int] = None,
+           connection=None) -> Iterator[psycopg2.extras.DictRow]:
+    """Iterates over query results using a named server-side cursor, so only `itersize` rows
+    (default `DB_STREAM_ITERSIZE`) are held in memory. The cursor lives in the current transaction
+    of `connection` (default connection of the app context), which must not be committed before
+    the iteration finishes.
+    """
+    if connection is None:
+        connection = get_db()
+    with connection.cursor(f"psan_stream_{next(_stream_ids)}", cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        cursor.itersize = itersize or _STREAM_ITERSIZE
+        cursor.execute(query, args)
+        yield from cursor
+
+
+def database_settings(config) -> Dict[str, int]:
+    """Settings of the application used by the database (queries of the database have to agree with the application)"""
+    return {"rule_autoapply_confidence": config["RULE_AUTOAPPLY_CONFIDENCE"]}
+
+
+def sync_settings(cursor, settings: Dict[str, int]) -> List[str]:
+    """Writes settings to the `setting` table (data derived from changed settings is rebuilt by triggers).
+    Returns names of changed settings."""
+    cursor.execute("UPDATE setting SET value = s.value FROM unnest(%s::text[], %s::int[]) AS s(name, value)"
+                   " WHERE setting.name = s.name and setting.value <> s.value RETURNING setting.name",
+                   (list(settings), list(settings.values())))
+    return [row[0] for row in cursor]
+
+
+def _sync_settings_once(connection) -> None:
+    """Writes settings of the application before the first query of the process"""
+    global _settings_pid
+    if _settings_pid == os.getpid():
+        return
+    try:
+        with connection.cursor() as cursor:
+            sync_settings(cursor, database_settings(current_app.config))
+        connection.commit()
+        _settings_pid = os.getpid()
+    except psycopg2.errors.UndefinedTable:
+        # Database is not migrated yet (settings are written after migration)
+        connection.rollback()
+
+
 def close_db(e=None):
-    """If this request connected to the database, close the
-    connection.
+    """If this request connected to the database, return the
+    connection into the pool.
     """
     db = g.pop("db", None)
 
     if db is not None:
-        db.close()
+        get_pool().putconn(db)
+
+
+def list_migrations(folder: str = MIGRATIONS_FOLDER) -> List[Tuple[int, str]]:
+    """Returns (version, name) of migration files `NNNN_name.sql` ordered by version"""
+    migrations = []
+    for filename in os.listdir(folder):
+        match = _MIGRATION_PATTERN.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), filename[:-len(".sql")]))
+    return sorted(migrations)
+
+
+def migrate(connection, folder: str = MIGRATIONS_FOLDER) -> List[str]:
+    """Applies migrations newer than the versions recorded in `schema_version` table.
+    Each migration runs in its own transaction. Returns names of applied migrations."""
+    applied = []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (_MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_version ("
+                           " version INT PRIMARY KEY, name TEXT NOT NULL,"
+                           " applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)")
+            cursor.execute("SELECT version FROM schema_version")
+            done = {row[0] for row in cursor}
+            connection.commit()
+            for version, name in list_migrations(folder):
+                if version in done:
+                    continue
+                with open(os.path.join(folder, f"{name}.sql")) as migration:
+                    cursor.execute(migration.read())
+                cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+                connection.commit()
+                applied.append(name)
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (_MIGRATION_LOCK_ID,))
+            connection.commit()
+    return applied
+
+
+@click.command("migrate-db")
+@with_appcontext
+def migrate_db_command():
+    """Apply new database migrations from `db/migrations`."""
+    applied = migrate(get_db())
+    with get_cursor() as cursor:
+        sync_settings(cursor, database_settings(current_app.config))
+    commit()
+    for name in applied:
+        click.echo(f"Applied {name}")
+    if not applied:
+        click.echo("Database is up to date")
 
 
 def init_app(app: Flask) -> None:
@@ -42,3 +182,4 @@ def init_app(app: Flask) -> None:
     the application factory.
     """
     app.teardown_appcontext(close_db)
+    app.cli.add_command(migrate_db_command)
@@ -0,0 +1,139 @@
+"""Process local pool of PostgreSQL connections."""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Tuple
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+
+class ConnectionPool:
+    """Thread-safe pool keeping between `min_size` and `max_size` open connections.
+    Checkout waits up to `timeout` seconds for a free connection. Connections idle for more than `check_idle`
+    seconds are tested by a query before they are handed out; broken connections are replaced."""
+
+    def __init__(self, connect: Callable[[], "psycopg2.extensions.connection"], min_size: int = 1, max_size: int = 10,
+                 timeout: float = 30, check_idle: float = 30) -> None:
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError(f"Invalid pool size {min_size}..{max_size}")
+        self._connect = connect
+        self._min_size = min_size
+        self._max_size = max_size
+        self._timeout = timeout
+        self._check_idle = check_idle
+        self._lock = threading.Lock()
+        # Free slots (idle connections or room for new ones)
+        self._slots = threading.BoundedSemaphore(max_size)
+        # Idle connections with time of return
+        self._idle: Deque[Tuple["psycopg2.extensions.connection", float]] = deque()
+        self._size = 0
+        self._in_use = 0
+        # Metrics
+        self._checkouts = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+        for _ in range(min_size):
+            self._idle.append((self._new_connection(), time.monotonic()))
+
+    def _new_connection(self) -> "psycopg2.extensions.connection":
+        connection = self._connect()
+        with self._lock:
+            self._size += 1
+        return connection
+
+    def _discard(self, connection: "psycopg2.extensions.connection") -> None:
+        with self._lock:
+            self._size -= 1
+            self._discarded += 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, connection: "psycopg2.extensions.connection", idle_since: float) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - idle_since < self._check_idle:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self) -> "psycopg2.extensions.connection":
+        """Checks out a healthy connection (waits for a free one when the pool is exhausted)"""
+        begin = time.perf_counter()
+        if not self._slots.acquire(timeout=self._timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolError(f"No database connection available in {self._timeout} s")
+        waited = time.perf_counter() - begin
+        try:
+            connection = None
+            while connection is None:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    connection = self._new_connection()
+                elif self._is_healthy(*idle):
+                    connection = idle[0]
+                else:
+                    self._discard(idle[0])
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_time += waited
+            self._max_wait_time = max(self._max_wait_time, waited)
+        return connection
+
+    def putconn(self, connection: "psycopg2.extensions.connection") -> None:
+        """Returns connection into the pool (uncommitted changes are rolled back)"""
+        keep = not connection.closed
+        if keep and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                keep = False
+        with self._lock:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((connection, time.monotonic()))
+        if not keep:
+            self._discard(connection)
+        self._slots.release()
+
+    def close(self) -> None:
+        """Closes idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def statistics(self) -> Dict[str, float]:
+        """Pool size, utilisation (share of `max_size` checked out) and checkout wait times"""
+        with self._lock:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "min_size": self._min_size,
+                "max_size": self._max_size,
+                "utilisation": self._in_use / self._max_size,
+                "checkouts": self._checkouts,
+                "wait_time_total": self._wait_time,
+                "wait_time_avg": self._wait_time / self._checkouts if self._checkouts else 0.0,
+                "wait_time_max": self._max_wait_time,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+            }
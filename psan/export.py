@@ -0,0 +1,84 @@
+import os
+import uuid
+
+from flask import (Blueprint, current_app, g, jsonify, redirect,
+                   render_template, request, send_file, url_for)
+from flask_babel import gettext
+from werkzeug.exceptions import NotFound
+
+from psan.auth import login_required
+from psan.db import commit, get_cursor
+from psan.model import AccountType, ExportForm, ExportStatus, SubmissionStatus
+
+_ = gettext
+
+bp = Blueprint("export", __name__, url_prefix="/export")
+
+
+def get_export_folder() -> str:
+    return os.path.join(current_app.config["DATA_FOLDER"], "exports")
+
+
+def get_export_file(uid: str) -> str:
+    return os.path.join(get_export_folder(), f"{uid}.zip")
+
+
+def _get_export(uid: str):
+    try:
+        uuid.UUID(uid)
+    except (TypeError, ValueError):
+        raise NotFound()
+    with get_cursor() as cursor:
+        cursor.execute("SELECT uid, status, total, done, created, finished FROM export WHERE uid = %s", (uid,))
+        export = cursor.fetchone()
+    if export is None:
+        raise NotFound()
+    return export
+
+
+@bp.route("/", methods=["GET", "POST"])
+@login_required(role=AccountType.ADMIN)
+def index():
+    form = ExportForm(request.form)
+    if form.validate_on_submit():
+        uid = str(uuid.uuid4())
+        with get_cursor() as cursor:
+            # Annotated submissions (same as output files of submissions)
+            cursor.execute("SELECT id FROM submission WHERE status IN (%s, %s) ORDER BY id",
+                           (SubmissionStatus.PRE_ANNOTATED.value, SubmissionStatus.DONE.value))
+            doc_ids = [row["id"] for row in cursor]
+            cursor.execute("INSERT INTO export (uid, total, author, status) VALUES (%s, %s, %s, %s) RETURNING id",
+                           (uid, len(doc_ids), g.account["id"],
+                            ExportStatus.RUNNING.value if doc_ids else ExportStatus.FAILED.value))
+            export_id = cursor.fetchone()["id"]
+            commit()
+        # Register background tasks
+        if doc_ids:
+            from psan.celery import export
+            export.start_export(export_id, doc_ids)
+        return redirect(url_for(".index"))
+
+    with get_cursor() as cursor:
+        cursor.execute("SELECT uid, status, total, done, created, finished FROM export ORDER BY id DESC")
+        exports = cursor.fetchall()
+    return render_template("export/index.html", exports=exports, form=form, ExportStatus=ExportStatus)
+
+
+@bp.route("/status")
+@login_required(role=AccountType.ADMIN)
+def status():
+    export = _get_export(request.args.get("uid", type=str))
+    return jsonify({"uid": export["uid"], "status": export["status"], "total": export["total"], "done": export["done"],
+                    "progress": export["done"] / export["total"] if export["total"] else 1.0})
+
+
+@bp.route("/download")
+@login_required(role=AccountType.ADMIN)
+def download():
+    export = _get_export(request.args.get("uid", type=str))
+    if export["status"] != ExportStatus.DONE.value:
+        raise NotFound()
+    # Conditional response supports resumed downloads (HTTP Range)
+    file = os.path.join(os.getcwd(), get_export_file(export["uid"]))
+    return send_file(file, as_attachment=True, download_name=f"export-{export['created']:%Y%m%d-%H%M%S}.zip",
+                     conditional=True)
@@ -1,14 +1,22 @@
+import csv
+import json
+import os
 import xml  # nosec - parse only internal XML
 import xml.sax  # nosec - parse only internal XML
 from io import StringIO
-from typing import Dict, List
+from itertools import tee
+from typing import (Callable, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, TextIO)
 
-from flask import Blueprint, current_app, g, make_response, request
+from flask import (Blueprint, Response, current_app, g, request, send_file,
+                   stream_with_context)
 from flask_babel import gettext
+from werkzeug.exceptions import BadRequest
 
 from psan.auth import login_required
 from psan.db import get_cursor
 from psan.model import AccountType, SubmissionStatus
+from psan.output_cache import get_output_cache
 from psan.submission import get_submission_file
 from psan.tool.controller import Controller
 from psan.tool.model import AnnotationDecision
@@ -17,12 +25,17 @@ _ = gettext
 
 bp = Blueprint("generate", __name__, url_prefix="/generate")
 
+_OUTPUT_CHUNK_SIZE = 1 << 16
+
 
 @ bp.route("/output")
 @ login_required(role=AccountType.ADMIN)
 def output():
     # Parse input params
     submission_uid = request.args.get("doc_uid", type=str)
+    format = request.args.get("format", default="text", type=str)
+    if format not in OUTPUT_FORMATS:
+        raise BadRequest("Unsupported format")
 
     min_confidence = current_app.config["RULE_AUTOAPPLY_CONFIDENCE"]
 
@@ -34,56 +47,115 @@ def output():
         submission_name = data["name"]
         submission_id = data["id"]
 
-        # Find decisions
+        # Output changes only with decisions (revision of the document) and the recognized file
         ctl = Controller(cursor, submission_id, g.account["id"])
-        decisions = ctl.get_decisions(None, min_confidence, True)
+        filename = get_submission_file(submission_uid, SubmissionStatus.RECOGNIZED)
+        revision = ctl.revision()
+        mtime = os.stat(filename).st_mtime_ns
+        etag = f"{submission_uid}-{revision}-{mtime}-{min_confidence}-{format}"
+        if request.if_none_match.contains(etag):
+            return Response(status=304)  # Return HTTP 304 (Not modified)
 
-    # Filter secret decisions
-    decisions = [dec for dec in decisions if dec["decision"] == AnnotationDecision.SECRET.value]
+    download_name = submission_name + OUTPUT_FORMATS[format].suffix
+    content_type = OUTPUT_FORMATS[format].content_type
+    cache = get_output_cache()
+    cached = cache.open(etag) if cache else None
+    if cached:
+        return send_file(cached, mimetype=content_type, as_attachment=True, download_name=download_name, etag=etag)
+
+    # Secret decisions are streamed in `ref_start` order while the file is parsed
+    def generate() -> Iterator[str]:
+        with get_cursor() as cursor:
+            ctl = Controller(cursor, submission_id, g.account["id"])
+            yield from generate_output(filename, secret_decisions(ctl, min_confidence), format)
+
+    def generate_cached() -> Iterator[str]:
+        # Copy of the output is cached only when nothing changed during generation (no stale output is cached)
+        file = cache.new_file()
+        try:
+            with file:
+                for chunk in generate():
+                    file.write(chunk.encode("utf-8"))
+                    yield chunk
+            with get_cursor() as cursor:
+                unchanged = Controller(cursor, submission_id).revision() == revision
+            if unchanged and os.stat(filename).st_mtime_ns == mtime:
+                cache.put(etag, file.name)
+            else:
+                cache.discard(file.name)
+        except BaseException:
+            cache.discard(file.name)
+            raise
+
+    # Prepare response
+    response = Response(stream_with_context(generate_cached() if cache else generate()), content_type=content_type)
+    response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+    response.set_etag(etag)
+    return response
+
+
+def secret_decisions(ctl: Controller, min_confidence: int) -> Iterator[Dict[str, str]]:
+    """Streams secret decisions of the document with their replacements"""
+    return (dec for dec in ctl.iter_decisions(min_confidence, True) if dec["decision"] == AnnotationDecision.SECRET.value)
 
-    # Transform output
-    output = StringIO()
 
+def _parse_chunks(filename: str, handler: xml.sax.ContentHandler) -> Iterator[None]:
+    """Feeds recognized file to the handler in chunks (yields after each chunk)"""
     parser = xml.sax.make_parser()  # nosec - parse only internal XML
     parser.setFeature(xml.sax.handler.feature_namespaces, 0)
-    handler = OutputTagFilter(decisions, output)
     parser.setContentHandler(handler)
-    filename = get_submission_file(submission_uid, SubmissionStatus.RECOGNIZED)
-    parser.parse(filename)
+    with open(filename, mode="rb") as input:
+        for chunk in iter(lambda: input.read(_OUTPUT_CHUNK_SIZE), b""):
+            parser.feed(chunk)
+            yield
+    parser.close()
+    yield
 
-    # Prepare response
-    response = make_response(output.getvalue())
-    response.headers["Content-Disposition"] = f"attachment; filename={submission_name}.out.txt"
-    response.headers["Content-type"] = "text/plain"
-    return response
+
+def _output_handler(decisions: Iterable[Dict[str, str]], outputs: Dict[str, TextIO]) -> xml.sax.ContentHandler:
+    """Handler writing all requested formats (decisions are shared by handlers of one pass)"""
+    handlers = [OUTPUT_FORMATS[format].handler(format_decisions, outputs[format])
+                for format, format_decisions in zip(outputs, tee(decisions, len(outputs)))]
+    return handlers[0] if len(handlers) == 1 else OutputPipeline(handlers)
+
+
+def generate_output(filename: str, decisions: Iterable[Dict[str, str]], format: str = "text") -> Iterator[str]:
+    """Parses recognized file incrementally and yields output in the format with secret decisions applied"""
+    output = StringIO()
+    for _ in _parse_chunks(filename, _output_handler(decisions, {format: output})):
+        if output.tell() > 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+
+def write_outputs(filename: str, decisions: Iterable[Dict[str, str]], outputs: Dict[str, TextIO]) -> None:
+    """Writes several output formats in a single pass over the recognized file"""
+    for _ in _parse_chunks(filename, _output_handler(decisions, outputs)):
+        pass
 
 
 class OutputTagFilter(xml.sax.ContentHandler):
     """Replace private tokens with replacement"""
 
-    def __init__(self, decisions: List[Dict[str, str]], output: StringIO):
+    def __init__(self, decisions: Iterable[Dict[str, str]], output: TextIO):
         super().__init__()
 
         # State of parser
         self._token_id = -1
         self._in_token = False
-        self._decision_index = 0
-        if len(decisions) > 0:
-            self._current_decision = decisions[self._decision_index]
-        else:
-            self._current_decision = None
         self._replacement_printed = False
-        # External data
-        self._decisions = decisions
+        # External data (decisions ordered by `start`)
+        self._decisions = iter(decisions)
+        self._current_decision = next(self._decisions, None)
         self._output = output
 
     def startElement(self, name, attrs):
         if name == "token":
             self._in_token = True
             self._token_id = int(attrs.get("id"))
-            while self._decision_index < len(self._decisions)-1 and self._decisions[self._decision_index]["end"] < self._token_id:
-                self._decision_index += 1
-                self._current_decision = self._decisions[self._decision_index]
+            while self._current_decision and self._current_decision["end"] < self._token_id:
+                self._current_decision = next(self._decisions, None)
                 self._replacement_printed = False
 
     def endElement(self, name):
@@ -103,3 +175,164 @@ class OutputTagFilter(xml.sax.ContentHandler):
                     self._replacement_printed = True
             else:
                 self._output.write(content)
+
+
+class OffsetTagFilter(xml.sax.ContentHandler):
+    """Tracks character offsets of tokens in the input text and secret decisions covering them.
+    Recognized files keep all input text (newlines normalized) and add a newline after `<submission>` tag."""
+
+    def __init__(self, decisions: Iterable[Dict[str, str]]):
+        super().__init__()
+
+        # State of parser
+        self._offset = -1  # newline after `<submission>`
+        self._in_token = False
+        self._token_id = -1
+        self._token_text: List[str] = []
+        self._token_start = 0
+        # External data (decisions ordered by `start`)
+        self._decisions = iter(decisions)
+        self._current_decision = next(self._decisions, None)
+
+    def startElement(self, name, attrs):
+        if name == "token":
+            self._in_token = True
+            self._token_text = []
+            self._token_start = self._offset
+            self._token_id = int(attrs.get("id"))
+            while self._current_decision and self._current_decision["end"] < self._token_id:
+                self._current_decision = next(self._decisions, None)
+
+    def endElement(self, name):
+        if name == "token":
+            self._in_token = False
+            decision = self._current_decision
+            if not (decision and decision["start"] <= self._token_id <= decision["end"]):
+                decision = None
+            self.onToken(self._token_id, self._token_start, self._offset, "".join(self._token_text), decision)
+        elif name == "sentence":
+            self.onSentenceEnd()
+
+    def characters(self, content):
+        self.onText(content)
+        if self._in_token:
+            self._token_text.append(content)
+        self._offset += len(content)
+
+    def endDocument(self):
+        self.onDocumentEnd()
+
+    def onText(self, content: str) -> None:
+        pass
+
+    def onToken(self, token_id: int, start: int, end: int, text: str, decision: Optional[Dict[str, str]]) -> None:
+        pass
+
+    def onSentenceEnd(self) -> None:
+        pass
+
+    def onDocumentEnd(self) -> None:
+        pass
+
+
+class JsonlTagFilter(OffsetTagFilter):
+    """Writes one JSON record per sentence with its tokens, their offsets and secret decisions"""
+
+    def __init__(self, decisions: Iterable[Dict[str, str]], output: TextIO):
+        super().__init__(decisions)
+        self._output = output
+        self._sentence_start = -1
+        self._sentence_text: List[str] = []
+        self._tokens: List[Dict] = []
+
+    def startElement(self, name, attrs):
+        super().startElement(name, attrs)
+        if name == "sentence":
+            self._sentence_start = self._offset
+            self._sentence_text = []
+            self._tokens = []
+
+    def onText(self, content: str) -> None:
+        if self._sentence_start >= 0:
+            self._sentence_text.append(content)
+
+    def onToken(self, token_id: int, start: int, end: int, text: str, decision: Optional[Dict[str, str]]) -> None:
+        self._tokens.append({"id": token_id, "start": start, "end": end, "text": text,
+                             "decision": AnnotationDecision.SECRET.value if decision else None,
+                             "label": decision["label"] if decision else None,
+                             "replacement": (decision["replacement"] or "[xxx]") if decision else None})
+
+    def onSentenceEnd(self) -> None:
+        record = {"start": self._sentence_start, "end": self._offset, "text": "".join(self._sentence_text),
+                  "tokens": self._tokens}
+        self._output.write(json.dumps(record, ensure_ascii=False))
+        self._output.write("\n")
+        self._sentence_start = -1
+
+
+class StandoffTagFilter(OffsetTagFilter):
+    """Writes tab separated spans of secret decisions (character offsets into the input text)"""
+
+    def __init__(self, decisions: Iterable[Dict[str, str]], output: TextIO):
+        super().__init__(decisions)
+        self._writer = csv.writer(output, dialect="excel-tab", lineterminator="\n")
+        self._writer.writerow(["start", "end", "label", "replacement"])
+        self._span_decision: Optional[Dict[str, str]] = None
+        self._span_start = 0
+        self._span_end = 0
+
+    def _flush(self) -> None:
+        if self._span_decision:
+            decision = self._span_decision
+            self._writer.writerow([self._span_start, self._span_end, decision["label"] or "",
+                                   decision["replacement"] or "[xxx]"])
+            self._span_decision = None
+
+    def onToken(self, token_id: int, start: int, end: int, text: str, decision: Optional[Dict[str, str]]) -> None:
+        if decision is not self._span_decision:
+            self._flush()
+            if decision:
+                self._span_decision = decision
+                self._span_start = start
+        if decision:
+            self._span_end = end
+
+    def onDocumentEnd(self) -> None:
+        self._flush()
+
+
+class OutputPipeline(xml.sax.ContentHandler):
+    """Forwards events of a single parse to handlers of several output formats"""
+
+    def __init__(self, handlers: List[xml.sax.ContentHandler]) -> None:
+        super().__init__()
+        self._handlers = handlers
+
+    def startElement(self, name, attrs):
+        for handler in self._handlers:
+            handler.startElement(name, attrs)
+
+    def endElement(self, name):
+        for handler in self._handlers:
+            handler.endElement(name)
+
+    def characters(self, content):
+        for handler in self._handlers:
+            handler.characters(content)
+
+    def endDocument(self):
+        for handler in self._handlers:
+            handler.endDocument()
+
+
+class OutputFormat(NamedTuple):
+    handler: Callable[[Iterable[Dict[str, str]], TextIO], xml.sax.ContentHandler]
+    suffix: str
+    content_type: str
+
+
+OUTPUT_FORMATS: Dict[str, OutputFormat] = {
+    "text": OutputFormat(OutputTagFilter, ".out.txt", "text/plain"),
+    "jsonl": OutputFormat(JsonlTagFilter, ".out.jsonl", "application/x-ndjson"),
+    "standoff": OutputFormat(StandoffTagFilter, ".out.tsv", "text/tab-separated-values"),
+}
@@ -1,18 +1,20 @@
 import csv
 from io import StringIO
 
-from flask import (Blueprint, g, jsonify, make_response,
-                   render_template, request)
+from flask import (Blueprint, Response, g, jsonify,
+                   render_template, request, stream_with_context)
 from flask_babel import lazy_gettext
 
 from psan.auth import login_required
-from psan.db import commit, get_cursor
+from psan.db import commit, get_cursor, stream
 from psan.model import AccountType
 
 _ = lazy_gettext
 
 bp = Blueprint("label", __name__, url_prefix="/label")
 
+_EXPORT_CHUNK_SIZE = 1 << 16
+
 
 @bp.route("/")
 @login_required(role=AccountType.ADMIN)
@@ -26,24 +28,25 @@ def data():
     # GET params
     search = request.args.get("search", type=str)
 
-    with get_cursor() as cursor:
-        if search:
+    if search:
+        with get_cursor() as cursor:
             cursor.execute("SELECT count(*) FROM label")
             not_filtered = cursor.fetchone()[0]
-            cursor.execute("SELECT * FROM label WHERE name LIKE %s OR replacement LIKE %s", (search, search))
-        else:
-            cursor.execute("SELECT * FROM label")
-            not_filtered = cursor.rowcount
-        # Prepare data
-        rows = []
-        for row in cursor:
-            # Prepare output
-            data = {"id": row["id"], "label": row["name"]}
-            if g.account["type"] == AccountType.ADMIN.value:
-                data["replacement"] = row["replacement"]
-            rows.append(data)
-        # Return output
-        return jsonify({"total": cursor.rowcount, "totalNotFiltered": not_filtered, "rows": rows})
+        labels = stream("SELECT * FROM label WHERE name LIKE %s OR replacement LIKE %s", (search, search))
+    else:
+        not_filtered = None
+        labels = stream("SELECT * FROM label")
+    # Prepare data
+    rows = []
+    for row in labels:
+        # Prepare output
+        data = {"id": row["id"], "label": row["name"]}
+        if g.account["type"] == AccountType.ADMIN.value:
+            data["replacement"] = row["replacement"]
+        rows.append(data)
+    # Return output
+    return jsonify({"total": len(rows), "totalNotFiltered": len(rows) if not_filtered is None else not_filtered,
+                    "rows": rows})
 
 
 @bp.route("/new",  methods=['POST'])
@@ -94,18 +97,20 @@ def remove(label_id: int):
 @bp.route('/export')
 @login_required(role=AccountType.ADMIN)
 def export():
-    si = StringIO()
-    cw = csv.DictWriter(si, fieldnames=["label", "replacement"])
-    cw.writeheader()
-
-    # Prepare data
-    with get_cursor() as cursor:
-        cursor.execute("SELECT * FROM label")
-        for row in cursor:
+    def generate():
+        si = StringIO()
+        cw = csv.DictWriter(si, fieldnames=["label", "replacement"])
+        cw.writeheader()
+        # Stream data
+        for row in stream("SELECT name, replacement FROM label"):
             cw.writerow({"label": row["name"], "replacement": row["replacement"]})
+            if si.tell() > _EXPORT_CHUNK_SIZE:
+                yield si.getvalue()
+                si.seek(0)
+                si.truncate()
+        yield si.getvalue()
 
     # Prepare output
-    output = make_response(si.getvalue())
+    output = Response(stream_with_context(generate()), content_type="text/csv")
     output.headers["Content-Disposition"] = "attachment; filename=export.csv"
-    output.headers["Content-type"] = "text/csv"
     return output
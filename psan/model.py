@@ -19,10 +19,17 @@ class AccountType(Enum):
 class SubmissionStatus(Enum):
     NEW = "NEW"
     RECOGNIZED = "RECOGNIZED"
+    NE_ANNOTATED = "NE_ANNOTATED"
     PRE_ANNOTATED = "PRE_ANNOTATED"
     DONE = "DONE"
 
 
+class ExportStatus(Enum):
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
 def strip_whitespace(text: str):
     return text.strip()
 
@@ -94,3 +101,7 @@ class UploadForm(FlaskForm):
 class RemoveSubmissionForm(FlaskForm):
     uid = HiddenField(validators=[validators.UUID()])
     submit = SubmitField(_("Remove"))
+
+
+class ExportForm(FlaskForm):
+    submit = SubmitField(_("Export all submissions"))
@@ -0,0 +1,95 @@
+"""Cache of generated output files on local disk."""
+
+import os
+import re
+import tempfile
+import time
+from typing import IO, Optional
+
+from flask import current_app
+
+_KEY_PATTERN = re.compile(r"^[\w-][\w.-]*$")
+# Temporary files of interrupted writes are removed after a day
+_TEMP_MAX_AGE = 24 * 60 * 60
+
+
+class OutputCache:
+    """Stores generated files in a folder. Least recently used files are removed when the folder grows
+    over `max_bytes`. Keys have to identify the exact content (e.g. document revision), files are never updated."""
+
+    def __init__(self, folder: str, max_bytes: int = 1 << 30) -> None:
+        self._folder = folder
+        self._max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if not _KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid cache key {key}")
+        return os.path.join(self._folder, key)
+
+    def open(self, key: str) -> Optional[IO[bytes]]:
+        """Opens cached file (stays readable even when evicted meanwhile) or returns None"""
+        path = self._path(key)
+        try:
+            file = open(path, mode="rb")
+        except FileNotFoundError:
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return file
+
+    def new_file(self) -> IO[bytes]:
+        """Temporary file in the cache folder (see `put`)"""
+        return tempfile.NamedTemporaryFile(dir=self._folder, prefix=".", suffix=".tmp", delete=False)
+
+    def put(self, key: str, temp_path: str) -> None:
+        """Moves complete temporary file into the cache and evicts least recently used files over the size limit"""
+        os.replace(temp_path, self._path(key))
+        self._evict()
+
+    def discard(self, temp_path: str) -> None:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        files = []
+        now = time.time()
+        for entry in os.scandir(self._folder):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            # Skip files being written
+            if entry.name.startswith("."):
+                if now - stat.st_mtime > _TEMP_MAX_AGE:
+                    self.discard(entry.path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+
+_cache: Optional[OutputCache] = None
+
+
+def get_output_cache() -> Optional[OutputCache]:
+    """Output cache configured by `OUTPUT_CACHE` and `OUTPUT_CACHE_SIZE` (None when disabled)"""
+    global _cache
+    folder = current_app.config["OUTPUT_CACHE"]
+    if not folder or current_app.config["OUTPUT_CACHE_SIZE"] <= 0:
+        return None
+    if _cache is None or _cache._folder != folder:
+        _cache = OutputCache(folder, current_app.config["OUTPUT_CACHE_SIZE"])
+    return _cache
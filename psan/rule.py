@@ -1,9 +1,9 @@
 import csv
 from io import StringIO, TextIOWrapper
+from typing import Dict, List, Optional
 
-from celery_once import AlreadyQueued
-from flask import (Blueprint, flash, jsonify, make_response, redirect,
-                   render_template, request, url_for)
+from flask import (Blueprint, Response, flash, jsonify, redirect,
+                   render_template, request, stream_with_context, url_for)
 from flask_babel import lazy_gettext
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileAllowed, FileField
@@ -12,7 +12,7 @@ from wtforms import SubmitField
 from wtforms.fields.simple import TextAreaField
 
 from psan.auth import login_required
-from psan.db import commit, get_cursor
+from psan.db import commit, get_cursor, stream
 from psan.model import AccountType
 from psan.tool.model import RuleType
 
@@ -20,6 +20,8 @@ _ = lazy_gettext
 
 bp = Blueprint("rule", __name__, url_prefix="/rule")
 
+_EXPORT_CHUNK_SIZE = 1 << 16
+
 
 @bp.route("/")
 @login_required(role=AccountType.ADMIN)
@@ -33,26 +35,27 @@ def data():
     # GET params
     search = request.args.get("search", type=str)
 
-    with get_cursor() as cursor:
-        if search:
+    if search:
+        with get_cursor() as cursor:
             cursor.execute("SELECT count(*) FROM rule")
             not_filtered = cursor.fetchone()[0]
-            cursor.execute("SELECT * FROM rule WHERE array_to_string(condition, ' ') LIKE %s", (search,))
+        rules = stream("SELECT * FROM rule WHERE array_to_string(condition, ' ') LIKE %s", (search,))
+    else:
+        not_filtered = None
+        rules = stream("SELECT * FROM rule")
+    # Prepare data
+    rows = []
+    for row in rules:
+        # Prepare condition string
+        if row["type"] == RuleType.NE_TYPE.value:
+            condition_str = "NE_TYPE:" + ' '.join(row["condition"])
         else:
-            cursor.execute("SELECT * FROM rule")
-            not_filtered = cursor.rowcount
-        # Prepare data
-        rows = []
-        for row in cursor:
-            # Prepare condition string
-            if row["type"] == RuleType.NE_TYPE.value:
-                condition_str = "NE_TYPE:" + ' '.join(row["condition"])
-            else:
-                condition_str = ' '.join(row["condition"])
-            # Prepare output
-            rows.append({"id": row["id"], "type": row["type"], "condition": condition_str, "decision": row["confidence"]})
-        # Return output
-        return jsonify({"total": cursor.rowcount, "totalNotFiltered": not_filtered, "rows": rows})
+            condition_str = ' '.join(row["condition"])
+        # Prepare output
+        rows.append({"id": row["id"], "type": row["type"], "condition": condition_str, "decision": row["confidence"]})
+    # Return output
+    return jsonify({"total": len(rows), "totalNotFiltered": len(rows) if not_filtered is None else not_filtered,
+                    "rows": rows})
 
 
 @bp.route("/remove/<int:rule_id>",  methods=['POST'])
@@ -70,22 +73,24 @@ def remove(rule_id: int):
 @bp.route('/export')
 @login_required(role=AccountType.ADMIN)
 def export():
-    si = StringIO()
-    cw = csv.DictWriter(si, fieldnames=["type", "condition", "decision", "author"])
-    cw.writeheader()
-
-    # Prepare data
-    with get_cursor() as cursor:
-        cursor.execute("SELECT rule.type, rule.condition, rule.confidence, account.full_name FROM rule"
-                       " LEFT JOIN account ON rule.author = account.id")
-        for row in cursor:
+    def generate():
+        si = StringIO()
+        cw = csv.DictWriter(si, fieldnames=["type", "condition", "decision", "author"])
+        cw.writeheader()
+        # Stream data
+        for row in stream("SELECT rule.type, rule.condition, rule.confidence, account.full_name FROM rule"
+                          " LEFT JOIN account ON rule.author = account.id"):
             cw.writerow({"type": row["type"], "condition": '='.join(row["condition"]),
                          "decision": row["confidence"], "author": row["full_name"]})
+            if si.tell() > _EXPORT_CHUNK_SIZE:
+                yield si.getvalue()
+                si.seek(0)
+                si.truncate()
+        yield si.getvalue()
 
     # Prepare output
-    output = make_response(si.getvalue())
+    output = Response(stream_with_context(generate()), content_type="text/csv")
     output.headers["Content-Disposition"] = "attachment; filename=export.csv"
-    output.headers["Content-type"] = "text/csv"
     return output
 
 
@@ -117,6 +122,7 @@ def upload():
                 flash(_("Rule authors were ignored in import"), category="warning")
             # Parse input
             line_num = 0
+            first_tokens = set()
             with get_cursor() as cursor:
                 for row in csv_input:
                     # Line numbering
@@ -127,9 +133,7 @@ def upload():
                         if row["type"] is None or row["condition"] is None or row["decision"] is None:
                             raise IndexError
                         # Import data
-                        cursor.execute("INSERT INTO rule (type, condition, confidence) VALUES(%s, %s, %s)"
-                                       " ON CONFLICT (type, condition) DO UPDATE SET confidence = EXCLUDED.confidence",
-                                       (row["type"], row["condition"].split('='), row["decision"]))
+                        first_tokens.add(_import_rule(cursor, row))
                     except (IndexError, DataError):
                         flash(_("Illegal format on line %(line_num)s.", line_num=line_num), category="error")
                         return render_template("rule/import.html", form=form)
@@ -137,7 +141,8 @@ def upload():
 
             flash(_("%(num)s rules imported", num=csv_input.line_num), category="message")
 
-            _call_re_annotate()
+            first_tokens.discard(None)
+            _call_re_annotate(list(first_tokens))
 
             return redirect(url_for(".index"))
 
@@ -145,9 +150,17 @@ def upload():
     return render_template("rule/import.html", form=form)
 
 
-def _call_re_annotate() -> None:
-    try:
-        from psan.celery import re_annotate
-        re_annotate.re_annotate_all.apply_async((-1,))
-    except AlreadyQueued:
-        pass
+def _import_rule(cursor, row: Dict[str, str]) -> Optional[str]:
+    """Inserts or updates rule from CSV row. Returns first token of word rules."""
+    condition = row["condition"].split('=')
+    cursor.execute("INSERT INTO rule (type, condition, confidence) VALUES(%s, %s, %s)"
+                   " ON CONFLICT (type, condition) DO UPDATE SET confidence = EXCLUDED.confidence",
+                   (row["type"], condition, row["decision"]))
+    return condition[0] if row["type"] == RuleType.WORD_TYPE.value else None
+
+
+def _call_re_annotate(first_tokens: List[str]) -> None:
+    # Annotate documents containing first tokens of imported rules
+    if first_tokens:
+        from psan.celery.scheduler import get_scheduler
+        get_scheduler().request(None, first_tokens)
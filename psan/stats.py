@@ -0,0 +1,33 @@
+import os
+
+from flask import Blueprint, jsonify
+
+from psan.auth import login_required
+from psan.db import get_pool
+from psan.model import AccountType
+from psan.window_cache import get_window_cache
+
+bp = Blueprint("stats", __name__, url_prefix="/stats")
+
+
+@bp.route("/re-annotation")
+@login_required(role=AccountType.ADMIN)
+def re_annotation():
+    # Counters of coalescing re-annotation scheduler
+    from psan.celery.scheduler import get_scheduler
+    return jsonify(get_scheduler().statistics())
+
+
+@bp.route("/db-pool")
+@login_required(role=AccountType.ADMIN)
+def db_pool():
+    # Connection pool of the worker process serving this request
+    return jsonify({"pid": os.getpid(), **get_pool().statistics()})
+
+
+@bp.route("/window-cache")
+@login_required(role=AccountType.ADMIN)
+def window_cache():
+    # Rendered windows shared by all workers on this machine
+    cache = get_window_cache()
+    return jsonify(cache.statistics() if cache else {"enabled": False})
@@ -16,11 +16,13 @@ from psan.auth import login_required
 from psan.db import commit, get_cursor
 from psan.model import (AccountType, RemoveSubmissionForm, SubmissionStatus,
                         UploadForm)
+from psan.tool.offsets import SentenceIndex
 
 _ = gettext
 
 _INPUT_FILENAME = "01-input.txt"
 _RECOGNIZED_FILENAME = "02-recognized.txt"
+_SENTENCE_INDEX_FILENAME = "02-recognized.idx"
 
 bp = Blueprint("submission", __name__, url_prefix="/submission")
 
@@ -38,6 +40,20 @@ def get_submission_file(uid: str, status: SubmissionStatus) -> str:
         raise NotImplementedError(f"Unsupported status {status}")
 
 
+def get_sentence_index_file(uid: str) -> str:
+    return os.path.join(current_app.config["DATA_FOLDER"], uid, _SENTENCE_INDEX_FILENAME)
+
+
+def get_sentence_index(uid: str) -> SentenceIndex:
+    """Loads sentence index of recognized file (builds missing index for older submissions)"""
+    index_file = get_sentence_index_file(uid)
+    if os.path.exists(index_file):
+        return SentenceIndex.load(index_file)
+    index = SentenceIndex.build(get_submission_file(uid, SubmissionStatus.RECOGNIZED))
+    index.save(index_file)
+    return index
+
+
 @bp.route("/")
 @login_required(role=AccountType.ADMIN)
 def index():
@@ -92,7 +108,7 @@ def new():
                     file.write(form.text.data)
             # Register background task
             from psan.celery import pre_process
-            pre_process.pre_process.delay(doc_id)
+            pre_process.pre_process(doc_id)
 
             return redirect(url_for(".index"))
     else:
@@ -1,16 +1,26 @@
-from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+from psycopg2.extras import execute_values
 
+from psan.db import stream
+from psan.tool.matcher import RuleTrie
 from psan.tool.model import (AnnotationDecision, AnnotationSource, Confidence,
-                             Evidence, EvidenceType, Interval, Rule, RuleType,
-                             Word)
+                             Interval, Rule, RuleType)
 
 
 class Controller:
+    # Rows fetched at once by server-side cursors of corpus-wide scans (default `DB_STREAM_ITERSIZE`)
+    stream_itersize: Optional[int] = None
+
     def __init__(self, cursor, document_id: int, user_id: int = None) -> None:
         self._cursor = cursor
         self._document_id = document_id
         self._user_id = user_id
+        # Batched writes (see `batch`)
+        self._batch_size = 0
+        self._pending_annotations: Dict[Interval, Optional[str]] = {}
+        self._pending_links: Set[Tuple[Interval, int]] = set()
 
     def set_rule(self, rule_type: Rule, condition: List[str], confidence: int) -> Rule:
         """Adds new rule into db or update existing and returns it's ID"""
@@ -76,6 +86,13 @@ class Controller:
                            token_level_decision: Optional[AnnotationDecision] = None) -> None:
         """ Annotate text interval with rule """
         token_decision_str = token_level_decision.value if token_level_decision else None
+        if self._batch_size:
+            # Postpone write until flush (first decision for interval wins as in direct mode)
+            self._pending_annotations.setdefault(interval, token_decision_str)
+            self._pending_links.add((interval, rule.id))
+            if len(self._pending_links) >= self._batch_size:
+                self.flush()
+            return
         self._cursor.execute("SELECT id FROM annotation WHERE submission = %s and ref_start = %s and ref_end = %s",
                              (self._document_id, interval.start, interval.end))
         data = self._cursor.fetchone()
@@ -88,6 +105,46 @@ class Controller:
         annotation_id = data["id"]
         self.connect(annotation_id, rule)
 
+    @contextmanager
+    def batch(self, size: int = 1000) -> Iterator["Controller"]:
+        """Collects `annotate_from_rule` calls and writes them with multi-row statements.
+        Pending writes are flushed after `size` links and at the end of the block."""
+        self._batch_size = size
+        try:
+            yield self
+            self.flush()
+        finally:
+            self._batch_size = 0
+            self._pending_annotations = {}
+            self._pending_links = set()
+
+    def flush(self) -> None:
+        """Writes pending annotations and their rule links"""
+        if not self._pending_links:
+            return
+        # Insert missing annotations
+        execute_values(self._cursor,
+                       "INSERT INTO annotation (submission, ref_start, ref_end, token_level, author) VALUES %s"
+                       " ON CONFLICT (submission, ref_start, ref_end) DO NOTHING",
+                       [(self._document_id, interval.start, interval.end, decision, self._user_id)
+                        for interval, decision in self._pending_annotations.items()],
+                       template="(%s, %s, %s, %s::annotation_decision, %s)", page_size=self._batch_size)
+        # Find IDs of all pending annotations
+        rows = execute_values(self._cursor,
+                              "SELECT a.id, a.ref_start, a.ref_end FROM annotation a"
+                              " JOIN (VALUES %s) AS i (submission, ref_start, ref_end)"
+                              " ON a.submission = i.submission and a.ref_start = i.ref_start and a.ref_end = i.ref_end",
+                              [(self._document_id, interval.start, interval.end) for interval in self._pending_annotations],
+                              page_size=self._batch_size, fetch=True)
+        ids = {Interval(row["ref_start"], row["ref_end"]): row["id"] for row in rows}
+        # Connect annotations with rules
+        execute_values(self._cursor,
+                       "INSERT INTO annotation_rule (annotation, rule) VALUES %s ON CONFLICT DO NOTHING",
+                       [(ids[interval], rule_id) for interval, rule_id in self._pending_links],
+                       page_size=self._batch_size)
+        self._pending_annotations = {}
+        self._pending_links = set()
+
     def connect(self, annotation_id, rule: Rule) -> None:
         """ Adds connection from annotation to rule """
         self._cursor.execute("INSERT INTO annotation_rule (annotation, rule) VALUES (%s, %s) ON CONFLICT DO NOTHING",
@@ -105,43 +162,121 @@ class Controller:
                              " WHERE type = %s and condition = %s",
                              (label_id, self._user_id, RuleType.WORD_TYPE.value, types))
 
-    def find_rule(self, evidence: Evidence) -> Optional[Rule]:
-        """Finds rule in DB according to evidence"""
-        if evidence.type == EvidenceType.NE_TYPE:
-            self._cursor.execute("SELECT id FROM rule WHERE type = %s and condition = %s",
-                                 (RuleType.NE_TYPE.value, evidence.value))
-            row = self._cursor.fetchone()
-            rule = Rule(row["id"]) if row else None
-        elif evidence.type == EvidenceType.WORD_TYPE:
-            self._cursor.execute("SELECT id, condition FROM rule WHERE type = %s and condition[1] = %s",
-                                 (RuleType.WORD_TYPE.value, evidence.value[0]))
-            # Find rule where condition match evidence
-            rule = None
-            for row in self._cursor:
-                condition = row["condition"]
-                if condition == evidence.value[:len(condition)]:
-                    rule = Rule(row["id"])
-                    break
-        else:
-            # Every evidence type should be supported
-            raise RuntimeError(f"Unknown evidence type {evidence.type} for evidence {evidence}")
-
-        # Returns rule or None
-        return rule
-
-    def rule_lookup(self, word: Word) -> Tuple[EvidenceType, int]:
-        """ Decides how many words following `word` should be captured for next evidence."""
-        self._cursor.execute("SELECT condition[1] AS first_word, max(array_length(condition, 1)) as length FROM rule"
-                             " WHERE condition[1] = %s GROUP BY first_word", (word.token,))
-        row = self._cursor.fetchone()
-        if row:
-            return EvidenceType.WORD_TYPE, row["length"] - 1
-        else:
-            return EvidenceType.NONE, 0
+    def _stream(self, query: str, args) -> Iterator:
+        """Iterates over query results using a server-side cursor in the transaction of the controller"""
+        return stream(query, args, self.stream_itersize, connection=self._cursor.connection)
+
+    def load_rules(self) -> RuleTrie:
+        """Loads all WORD_TYPE rules into in-memory trie"""
+        rows = self._stream("SELECT id, condition FROM rule WHERE type = %s", (RuleType.WORD_TYPE.value,))
+        return RuleTrie((row["condition"], Rule(row["id"])) for row in rows)
+
+    def load_rules_starting_with(self, first_token: str) -> RuleTrie:
+        """Loads WORD_TYPE rules with condition starting with `first_token` into in-memory trie"""
+        self._cursor.execute("SELECT id, condition FROM rule WHERE type = %s and condition[1] = %s",
+                             (RuleType.WORD_TYPE.value, first_token))
+        return RuleTrie((row["condition"], Rule(row["id"])) for row in self._cursor)
+
+    def index_tokens(self, tokens: List[Tuple[int, str]]) -> None:
+        """Adds (token ID, token) pairs of the document into token occurrence index"""
+        execute_values(self._cursor,
+                       "INSERT INTO token (submission, id, form) VALUES %s ON CONFLICT DO NOTHING",
+                       [(self._document_id, token_id, form) for token_id, form in tokens],
+                       page_size=max(len(tokens), 1))
+
+    def is_indexed(self) -> bool:
+        """Checks if the document has tokens in the token occurrence index"""
+        self._cursor.execute("SELECT EXISTS (SELECT 1 FROM token WHERE submission = %s) AS indexed", (self._document_id,))
+        return self._cursor.fetchone()["indexed"]
+
+    def find_occurrences(self, first_token: str, length: int, status: str) -> Iterator[Tuple[int, int, List[str]]]:
+        """Streams all occurrences of `first_token` in submissions with `status` (across the whole corpus).
+        Yields (submission ID, token ID, tokens) where tokens are up to `length` tokens starting at the occurrence."""
+        rows = self._stream("SELECT t.submission, t.id, array_agg(n.form ORDER BY n.id) AS forms"
+                            " FROM token t"
+                            " JOIN submission s ON s.id = t.submission and s.status = %s"
+                            " JOIN token n ON n.submission = t.submission and t.id <= n.id and n.id < t.id + %s"
+                            " WHERE t.form = %s"
+                            " GROUP BY t.submission, t.id"
+                            " ORDER BY t.submission, t.id",
+                            (status, length, first_token))
+        return ((row["submission"], row["id"], row["forms"]) for row in rows)
+
+    def rule_epoch(self) -> int:
+        """Returns epoch of the latest committed change of WORD_TYPE rules"""
+        self._cursor.execute("SELECT epoch FROM rule_epoch")
+        return self._cursor.fetchone()["epoch"]
+
+    def revision(self) -> int:
+        """Returns revision of the document (increases with every change of its decisions and labels)"""
+        self._cursor.execute("SELECT revision + (SELECT count(*) FROM submission_revision WHERE submission = s.id)"
+                             " AS revision FROM submission s WHERE id = %s", (self._document_id,))
+        return self._cursor.fetchone()["revision"]
+
+    def fold_revisions(self) -> None:
+        """Moves logged changes of all documents to their revisions (revisions stay the same)"""
+        self._cursor.execute("SELECT fold_submission_revisions()")
+
+    def set_applied_rule_epoch(self, epoch: int) -> None:
+        """Records that rules up to `epoch` were applied to the document"""
+        self._cursor.execute("UPDATE submission SET applied_rule_epoch = GREATEST(applied_rule_epoch, %s) WHERE id = %s",
+                             (epoch, self._document_id))
+
+    def checkpoint(self, stage: str) -> Optional[Tuple[int, int]]:
+        """Returns (first unprocessed token, rule epoch) recorded by an interrupted run of the stage or None"""
+        self._cursor.execute("SELECT token, rule_epoch FROM checkpoint WHERE submission = %s and stage = %s",
+                             (self._document_id, stage))
+        data = self._cursor.fetchone()
+        return (data["token"], data["rule_epoch"]) if data else None
+
+    def save_checkpoint(self, stage: str, token: int, rule_epoch: int) -> None:
+        """Writes pending annotations and records that the stage processed all tokens before `token`
+        (rule epoch of the first run is kept)"""
+        self.flush()
+        self._cursor.execute("INSERT INTO checkpoint (submission, stage, token, rule_epoch) VALUES (%s, %s, %s, %s)"
+                             " ON CONFLICT (submission, stage) DO UPDATE SET token = EXCLUDED.token",
+                             (self._document_id, stage, token, rule_epoch))
+
+    def clear_checkpoint(self, stage: str) -> None:
+        """Removes checkpoint of the finished stage"""
+        self._cursor.execute("DELETE FROM checkpoint WHERE submission = %s and stage = %s", (self._document_id, stage))
+
+    def find_stale_documents(self, status: str, epoch: int, limit: Optional[int]) -> List[int]:
+        """Finds documents with `status` which have not seen rules up to `epoch`.
+        The most outdated documents come first and the newest ones are preferred among equally outdated."""
+        self._cursor.execute("SELECT id FROM submission WHERE status = %s and applied_rule_epoch < %s"
+                             " ORDER BY applied_rule_epoch, created DESC, id DESC LIMIT %s",
+                             (status, epoch, limit))
+        return [row["id"] for row in self._cursor]
+
+    def set_propagated_rule_epoch(self, document_ids: List[int], epoch: int, first_tokens: List[str]) -> None:
+        """Records that rules starting with `first_tokens` were propagated to the documents. A document advances up
+        to `epoch` but not past the first newer change of rules starting with another token (only indexed
+        documents are reached by propagation)."""
+        self._cursor.execute("UPDATE submission s SET applied_rule_epoch = GREATEST(applied_rule_epoch, COALESCE("
+                             "(SELECT min(c.epoch) - 1 FROM rule_epoch_change c WHERE c.epoch > s.applied_rule_epoch"
+                             " AND c.epoch <= %(epoch)s AND c.first_token <> ALL(%(first_tokens)s)), %(epoch)s))"
+                             " WHERE id = ANY(%(document_ids)s)"
+                             " and EXISTS (SELECT 1 FROM token t WHERE t.submission = s.id)",
+                             {"epoch": epoch, "first_tokens": first_tokens, "document_ids": document_ids})
+
+    def prune_rule_epoch_changes(self, finished_status: str) -> None:
+        """Forgets rule changes which all documents without `finished_status` have seen"""
+        self._cursor.execute("DELETE FROM rule_epoch_change WHERE epoch <= (SELECT min(applied_rule_epoch)"
+                             " FROM submission WHERE status <> %s)", (finished_status,))
+
+    def for_document(self, document_id: int) -> "Controller":
+        """Returns controller for another document sharing the cursor and the user"""
+        return Controller(self._cursor, document_id, self._user_id)
+
+    _DECISIONS_QUERY = ("SELECT ref_start, ref_end, token_level, rule_level, l.name as label, l.replacement as replacement"
+                        " FROM annotation a"
+                        " LEFT JOIN (annotation_rule ar"
+                        " INNER JOIN rule r ON r.id = ar.rule AND r.label IS NOT NULL) ON ar.annotation = a.id"
+                        " LEFT JOIN label l ON COALESCE(a.label, r.label) = l.id")
 
     def get_decisions(self, interval: Optional[Interval], min_confidence, with_replacement=False) -> List[Dict[str, str]]:
         """Return list of annotation decisions and labels withing selected interval"""
-        decisions = []
         # Query - where part
         if interval:
             where_cls = " WHERE submission = %s and %s<=ref_start and ref_start<=%s"
@@ -149,16 +284,16 @@ class Controller:
         else:
             where_cls = " WHERE submission = %s"
             where_args = (self._document_id,)
-        self._cursor.execute("SELECT ref_start, ref_end, token_level, rule_level, l.name as label, l.replacement as replacement"
-                             " FROM annotation a"
-                             " LEFT JOIN (annotation_rule ar"
-                             " INNER JOIN rule r ON r.id = ar.rule AND r.label IS NOT NULL) ON ar.annotation = a.id"
-                             " LEFT JOIN label l ON COALESCE(a.label, r.label) = l.id"
-                             + where_cls +  # nosec
-                             " ORDER BY ref_start",
-                             where_args)
-        # Prepare decisions
-        for row in self._cursor:
+        self._cursor.execute(self._DECISIONS_QUERY + where_cls + " ORDER BY ref_start", where_args)  # nosec
+        return list(self._decisions(self._cursor, min_confidence, with_replacement))
+
+    def iter_decisions(self, min_confidence, with_replacement=False) -> Iterator[Dict[str, str]]:
+        """Streams annotation decisions and labels of the whole document"""
+        rows = self._stream(self._DECISIONS_QUERY + " WHERE submission = %s ORDER BY ref_start", (self._document_id,))
+        return self._decisions(rows, min_confidence, with_replacement)
+
+    def _decisions(self, rows: Iterable, min_confidence, with_replacement: bool) -> Iterator[Dict[str, str]]:
+        for row in rows:
             # Decision sum-up
             if row["token_level"]:
                 # Token level decision
@@ -179,6 +314,4 @@ class Controller:
             decision = {"start": row["ref_start"], "end": row["ref_end"], "decision": decision, "label": row["label"]}
             if with_replacement:
                 decision["replacement"] = row["replacement"]
-            decisions.append(decision)
-
-        return decisions
+            yield decision
@@ -0,0 +1,109 @@
+"""In-memory rule matching engine."""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from psan.tool.model import Rule
+
+
+class _Node:
+    """Single node of the rule trie"""
+
+    __slots__ = ("children", "rule")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        self.rule: Optional[Rule] = None
+
+
+class RuleTrie:
+    """Prefix tree of rule conditions keyed on token sequences"""
+
+    def __init__(self, rules: Iterable[Tuple[List[str], Rule]] = ()) -> None:
+        self._root = _Node()
+        self._size = 0
+        self._depth = 0
+        for condition, rule in rules:
+            self.add(condition, rule)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def depth(self) -> int:
+        """Length of the longest condition in the trie"""
+        return self._depth
+
+    def add(self, condition: List[str], rule: Rule) -> None:
+        """Adds rule with condition (sequence of tokens) into the trie"""
+        if not condition:
+            return
+        node = self._root
+        for token in condition:
+            child = node.children.get(token)
+            if child is None:
+                child = node.children[token] = _Node()
+            node = child
+        if node.rule is None:
+            self._size += 1
+        node.rule = rule
+        self._depth = max(self._depth, len(condition))
+
+    def longest_match(self, tokens: List[str], start: int = 0) -> Optional[Tuple[int, Rule]]:
+        """Finds the longest rule matching tokens from `start`. Returns its length and the rule or None."""
+        node = self._root
+        best = None
+        for index in range(start, len(tokens)):
+            node = node.children.get(tokens[index])
+            if node is None:
+                break
+            if node.rule is not None:
+                best = (index - start + 1, node.rule)
+        return best
+
+    def matcher(self) -> "RuleMatcher":
+        """Returns new streaming matcher over this trie"""
+        return RuleMatcher(self._root)
+
+
+class RuleMatcher:
+    """Streaming longest-prefix matcher. Tokens are fed one by one in document order."""
+
+    def __init__(self, root: _Node) -> None:
+        self._root = root
+        # Partial matches: [start token id, current node, best length, best rule]
+        self._active: List[list] = []
+
+    def feed(self, token_id: int, token: str) -> List[Tuple[int, int, Rule]]:
+        """Advances all partial matches by the token and returns finished matches as (start, end, rule)"""
+        finished = []
+        active = []
+        # New match may start at every token
+        self._active.append([token_id, self._root, 0, None])
+        for state in self._active:
+            node = state[1].children.get(token)
+            if node is None:
+                if state[3] is not None:
+                    finished.append((state[0], state[0] + state[2] - 1, state[3]))
+                continue
+            state[1] = node
+            if node.rule is not None:
+                state[2] = token_id - state[0] + 1
+                state[3] = node.rule
+            if node.children:
+                active.append(state)
+            else:
+                # Leaf node - nothing longer can match
+                finished.append((state[0], state[0] + state[2] - 1, state[3]))
+        self._active = active
+        return finished
+
+    @property
+    def idle(self) -> bool:
+        """No partial match is in progress (following tokens can be fed to a new matcher)"""
+        return not self._active
+
+    def close(self) -> List[Tuple[int, int, Rule]]:
+        """Finishes all partial matches at the end of the document"""
+        finished = [(state[0], state[0] + state[2] - 1, state[3]) for state in self._active if state[3] is not None]
+        self._active = []
+        return finished
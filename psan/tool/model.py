@@ -1,5 +1,5 @@
-from enum import Enum, IntFlag
-from typing import List, NamedTuple
+from enum import Enum
+from typing import NamedTuple
 
 
 class AnnotationDecision(Enum):
@@ -28,20 +28,6 @@ class Interval(NamedTuple):
     end: int
 
 
-class EvidenceType(IntFlag):
-    NONE = 0
-    NE_TYPE = 1
-    LEMMA = 2
-    WORD_TYPE = 3
-    CONTEXT = 4
-
-
-class Evidence(NamedTuple):
-    type: EvidenceType
-    interval: Interval
-    value: List[str]
-
-
 class Word(NamedTuple):
     token: str
 
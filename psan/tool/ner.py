@@ -1,23 +1,39 @@
 """Named entity recognizer module."""
 
 import functools
+import os
+import queue
 import re
 import subprocess  # nosec
+import threading
+import time
 from abc import ABC, abstractclassmethod
-from typing import List, Match
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from itertools import islice
+from typing import Dict, Iterable, List, Match, Optional, TextIO, Tuple, Type
 
 from ufal.nametag import Forms, NamedEntities, Ner, TokenRanges
 
+from psan.tool.ner_cache import Entity, SentenceCache
+
 
 class NerInterface(ABC):
     """Named entity recognizer abstract class."""
 
+    # Statistics of the last `recognize_file` call
+    statistics: Dict[str, int] = {}
+
     @abstractclassmethod
     def recognize_file(self, input_filename: str, output_filename: str,  next_id=0) -> int:
         """Finds named entities in the input file and save the results to the output file.
         Each entity has an ID that starts with next_id."""
         pass
 
+    def close(self) -> None:
+        """Stops processes started by the recognizer (nothing by default)"""
+        pass
+
 
 class RegexNer(NerInterface):
     """Named entity recognizer using regular expressions."""
@@ -50,15 +66,32 @@ class RegexNer(NerInterface):
 
 
 class BinaryNer(NerInterface):
-    """Named entity recognizer using external tool."""
+    """Named entity recognizer using external tool.
+
+    By default the tool is started for each file as `binary model input:output`. With `workers > 0` the tool is
+    started once as `binary model` and documents are streamed through its stdin/stdout. Each document is followed by
+    a separator line, the tool has to copy it to the output and flush the output after each line."""
 
     XML_TAG_PATTERN = re.compile(r"<ne", re.IGNORECASE)
+    DOCUMENT_SEPARATOR = "psan-end-of-document-0c8d6b1f"
 
-    def __init__(self, binary_location: str, model_location: str) -> None:
+    def __init__(self, binary_location: str, model_location: str, workers: int = 0, timeout: float = None) -> None:
         self._bin_loc = binary_location
         self._model_loc = model_location
+        self._timeout = timeout
+        self._workers: "queue.Queue[_BinaryWorker]" = queue.Queue()
+        for _ in range(workers):
+            self._workers.put(_BinaryWorker([self._bin_loc, self._model_loc]))
+        self._persistent = workers > 0
 
     def recognize_file(self, input_filename: str, output_filename: str, next_id=0) -> int:
+        if self._persistent:
+            worker = self._workers.get()
+            try:
+                return worker.recognize_file(input_filename, output_filename, self._timeout)
+            finally:
+                self._workers.put(worker)
+
         # Call binary
         subprocess.call([self._bin_loc, self._model_loc,  # nosec
                          f"{input_filename}:{output_filename}"])
@@ -70,11 +103,94 @@ class BinaryNer(NerInterface):
 
         return N
 
+    def close(self) -> None:
+        """Stops all running workers"""
+        while not self._workers.empty():
+            self._workers.get().stop()
+
+
+class _BinaryWorker:
+    """Long-lived process of external recognizer. Restarted after crash or timeout."""
+
+    def __init__(self, args: List[str]) -> None:
+        self._args = args
+        self._process: Optional[subprocess.Popen] = None
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+
+    def _start(self) -> None:
+        self._process = subprocess.Popen(self._args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,  # nosec
+                                         text=True, bufsize=1)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_output, args=(self._process.stdout, self._lines), daemon=True).start()
+
+    @staticmethod
+    def _read_output(stdout: TextIO, lines: "queue.Queue[Optional[str]]") -> None:
+        for line in stdout:
+            lines.put(line)
+        # End of output (process exited)
+        lines.put(None)
+
+    def _write_input(self, input_filename: str) -> None:
+        try:
+            with open(input_filename, mode="r") as input:
+                for line in input:
+                    self._process.stdin.write(line if line.endswith("\n") else line + "\n")
+            self._process.stdin.write(BinaryNer.DOCUMENT_SEPARATOR + "\n")
+            self._process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            # Process died, reported by reader
+            pass
+
+    def stop(self) -> None:
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def recognize_file(self, input_filename: str, output_filename: str, timeout: Optional[float]) -> int:
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+        # Feed input in background, so the process never blocks on full output pipe
+        threading.Thread(target=self._write_input, args=(input_filename,), daemon=True).start()
+        deadline = time.monotonic() + timeout if timeout else None
+        N = 0
+        with open(output_filename, mode="w") as output:
+            while True:
+                try:
+                    line = self._lines.get(timeout=max(0, deadline - time.monotonic()) if deadline else None)
+                except queue.Empty:
+                    self.stop()
+                    raise TimeoutError(f"Recognizer timed out on {input_filename}")
+                if line is None:
+                    self.stop()
+                    raise RuntimeError(f"Recognizer exited while processing {input_filename}")
+                if BinaryNer.DOCUMENT_SEPARATOR in line:
+                    break
+                output.write(line)
+                # Count found entries
+                N += len(BinaryNer.XML_TAG_PATTERN.findall(line))
+
+        return N
+
 
 class NameTag(NerInterface):
     """Named entity recognizer using NameTag2 from UFAL MFF UK"""
 
-    def __init__(self, model_location) -> None:
+    # Token IDs and ranges in generated XML
+    ID_ATTRIBUTE_PATTERN = re.compile(r"\b(id|start|end)=\"(\d+)\"")
+
+    def __init__(self, model_location, workers: int = 1, chunk_lines: int = 1000,
+                 cache: Optional[SentenceCache] = None) -> None:
+        self._model_location = model_location
+        self._workers = workers
+        self._chunk_lines = chunk_lines
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache = cache
+        self._model_id = f"{os.path.abspath(model_location)}:{os.path.getmtime(model_location)}" if cache else None
+        self.statistics: Dict[str, int] = {}
+        self._load(model_location)
+
+    def _load(self, model_location) -> None:
         # Load model
         self._ner = Ner.load(model_location)
         if not self._ner:
@@ -93,65 +209,130 @@ class NameTag(NerInterface):
         return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
 
     def recognize_file(self, input_filename: str, output_filename: str, token_id=0) -> int:
-        forms = Forms()
-        tokens = TokenRanges()
-        entities = NamedEntities()
-
+        self.statistics = {"cache_hits": 0, "cache_misses": 0}
         with open(input_filename, mode="r") as input, open(output_filename, mode="w") as output:
             # Write document header
             output.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
             output.write("<submission>\n")
-            for line in input:
-                # Tokenize line
-                self._tokenizer.setText(line)
-
-                text_position = 0
-                while self._tokenizer.nextSentence(forms, tokens):
-                    # Recognize named entities
-                    self._ner.recognize(forms, entities)
-                    sortedEntities = sorted(entities,
-                                            key=lambda entity: (entity.start, -entity.length))
-                    openEntities: List[int] = []
-
-                    # Write entities to output
-                    ne_index = 0
-                    for token_index in range(len(tokens)):
-                        output.write(NameTag.encode_entities(
-                            line[text_position:tokens[token_index].start]))
-                        if (token_index == 0):
-                            output.write(f"<sentence start=\"{token_id}\" end=\"{token_id+len(tokens)}\">")
-
-                        # Open entities starting at current token
-                        while (ne_index < len(sortedEntities) and sortedEntities[ne_index].start == token_index):
-                            # Count name entry tokens index range
-                            start_token_index = sortedEntities[ne_index].start
-                            end_token_index = sortedEntities[ne_index].start + sortedEntities[ne_index].length - 1
-                            # Count name entry tokens id range
-                            start_token_id = token_id - token_index + start_token_index
-                            end_token_id = token_id - token_index + end_token_index
-                            # Write XML entry
-                            output.write(
-                                f"<ne type=\"{NameTag.encode_entities(sortedEntities[ne_index].type)}\""
-                                f" start=\"{start_token_id}\" end=\"{end_token_id}\">")
-                            openEntities.append(end_token_index)
-                            ne_index = ne_index + 1
-
-                        # The token itself
-                        output.write(f"<token id=\"{token_id}\">")
-                        token_id += 1
-                        output.write(NameTag.encode_entities(
-                            line[tokens[token_index].start: tokens[token_index].start + tokens[token_index].length]))
-                        output.write("</token>")
-
-                        # Close entities ending after current token
-                        while openEntities and openEntities[-1] == token_index:
-                            output.write("</ne>")
-                            openEntities.pop()
-                        if (token_index + 1 == len(tokens)):
-                            output.write("</sentence>")
-                        text_position = tokens[token_index].start + tokens[token_index].length
-                # Write rest of the text
-                output.write(NameTag.encode_entities(line[text_position:]))
+            if self._workers > 1:
+                token_id = self._recognize_parallel(input, output, token_id)
+            else:
+                token_id = self._recognize_lines(input, output, token_id)
             output.write("\n</submission>")
 
         return token_id
+
+    def _recognize_sentence(self, forms: Forms, entities: NamedEntities) -> List[Entity]:
+        """Returns entities of the sentence sorted by start and length (from cache if possible)"""
+        key = None
+        if self._cache:
+            key = SentenceCache.key(self._model_id, list(forms))
+            cached = self._cache.get(key)
+            if cached is not None:
+                self.statistics["cache_hits"] += 1
+                return cached
+            self.statistics["cache_misses"] += 1
+        # Recognize named entities
+        self._ner.recognize(forms, entities)
+        found = sorted((Entity(entity.start, entity.length, entity.type) for entity in entities),
+                       key=lambda entity: (entity.start, -entity.length))
+        if key:
+            self._cache.put(key, found)
+        return found
+
+    def _recognize_lines(self, lines: Iterable[str], output: TextIO, token_id: int) -> int:
+        forms = Forms()
+        tokens = TokenRanges()
+        entities = NamedEntities()
+
+        for line in lines:
+            # Tokenize line
+            self._tokenizer.setText(line)
+
+            text_position = 0
+            while self._tokenizer.nextSentence(forms, tokens):
+                # Recognize named entities
+                sortedEntities = self._recognize_sentence(forms, entities)
+                openEntities: List[int] = []
+
+                # Write entities to output
+                ne_index = 0
+                for token_index in range(len(tokens)):
+                    output.write(NameTag.encode_entities(
+                        line[text_position:tokens[token_index].start]))
+                    if (token_index == 0):
+                        output.write(f"<sentence start=\"{token_id}\" end=\"{token_id+len(tokens)}\">")
+
+                    # Open entities starting at current token
+                    while (ne_index < len(sortedEntities) and sortedEntities[ne_index].start == token_index):
+                        # Count name entry tokens index range
+                        start_token_index = sortedEntities[ne_index].start
+                        end_token_index = sortedEntities[ne_index].start + sortedEntities[ne_index].length - 1
+                        # Count name entry tokens id range
+                        start_token_id = token_id - token_index + start_token_index
+                        end_token_id = token_id - token_index + end_token_index
+                        # Write XML entry
+                        output.write(
+                            f"<ne type=\"{NameTag.encode_entities(sortedEntities[ne_index].type)}\""
+                            f" start=\"{start_token_id}\" end=\"{end_token_id}\">")
+                        openEntities.append(end_token_index)
+                        ne_index = ne_index + 1
+
+                    # The token itself
+                    output.write(f"<token id=\"{token_id}\">")
+                    token_id += 1
+                    output.write(NameTag.encode_entities(
+                        line[tokens[token_index].start: tokens[token_index].start + tokens[token_index].length]))
+                    output.write("</token>")
+
+                    # Close entities ending after current token
+                    while openEntities and openEntities[-1] == token_index:
+                        output.write("</ne>")
+                        openEntities.pop()
+                    if (token_index + 1 == len(tokens)):
+                        output.write("</sentence>")
+                    text_position = tokens[token_index].start + tokens[token_index].length
+            # Write rest of the text
+            output.write(NameTag.encode_entities(line[text_position:]))
+
+        if self._cache:
+            self._cache.flush()
+        return token_id
+
+    def close(self) -> None:
+        """Shuts down the process pool of parallel recognition (started again by the next parallel recognition)"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _recognize_parallel(self, input: TextIO, output: TextIO, token_id: int) -> int:
+        """Recognizes chunks of lines in process pool and renumbers tokens of each chunk to follow previous ones"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self._workers, initializer=_init_worker,
+                                             initargs=(type(self), self._model_location, self._cache))
+        chunks = iter(lambda: list(islice(input, self._chunk_lines)), [])
+        for xml, num_tokens, statistics in self._pool.map(_recognize_chunk, chunks):
+            offset = token_id
+            output.write(NameTag.ID_ATTRIBUTE_PATTERN.sub(
+                lambda match: f"{match.group(1)}=\"{int(match.group(2)) + offset}\"", xml))
+            token_id += num_tokens
+            for name, value in statistics.items():
+                self.statistics[name] += value
+        return token_id
+
+
+# Recognizer of process pool worker
+_worker_ner: Optional[NameTag] = None
+
+
+def _init_worker(ner_class: Type[NameTag], model_location: str, cache: Optional[SentenceCache]) -> None:
+    global _worker_ner
+    _worker_ner = ner_class(model_location, cache=cache)
+
+
+def _recognize_chunk(lines: List[str]) -> Tuple[str, int, Dict[str, int]]:
+    """Recognizes lines with token IDs starting at 0. Returns XML, number of tokens and statistics."""
+    output = StringIO()
+    _worker_ner.statistics = {"cache_hits": 0, "cache_misses": 0}
+    num_tokens = _worker_ner._recognize_lines(lines, output, 0)
+    return output.getvalue(), num_tokens, _worker_ner.statistics
@@ -0,0 +1,80 @@
+"""Sentence level cache of recognized named entities."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+
+class Entity(NamedTuple):
+    start: int
+    length: int
+    type: str
+
+
+class SentenceCache:
+    """Stores named entities of tokenized sentences in SQLite database on local disk.
+    The database can be shared by all workers on the same machine. Least recently used sentences are evicted
+    when the cache grows over `max_entries`."""
+
+    def __init__(self, path: str, max_entries: int = 100000) -> None:
+        self._path = path
+        self._max_entries = max_entries
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._pending_uses: Dict[bytes, int] = {}
+        self._pending_entries: Dict[bytes, List[Entity]] = {}
+
+    def __getstate__(self) -> dict:
+        # Connection is opened in each process separately
+        return {"_path": self._path, "_max_entries": self._max_entries}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["_path"], state["_max_entries"])
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS sentence"
+                                     " (key BLOB PRIMARY KEY, entities TEXT NOT NULL, used INTEGER NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS sentence_used_idx ON sentence (used)")
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def key(model_id: str, forms: List[str]) -> bytes:
+        """Hash of model and normalized sentence (tokens separated by single space)"""
+        return hashlib.sha256(f"{model_id}\0{' '.join(forms)}".encode()).digest()
+
+    def get(self, key: bytes) -> Optional[List[Entity]]:
+        if key in self._pending_entries:
+            return self._pending_entries[key]
+        row = self._db().execute("SELECT entities FROM sentence WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._pending_uses[key] = int(time.time())
+        return [Entity(*entity) for entity in json.loads(row[0])]
+
+    def put(self, key: bytes, entities: List[Entity]) -> None:
+        """Adds sentence into cache (written by `flush`)"""
+        self._pending_entries[key] = entities
+
+    def flush(self) -> None:
+        """Saves new and used sentences and evicts least recently used ones over the size limit"""
+        db = self._db()
+        now = int(time.time())
+        with db:
+            db.execute("BEGIN")
+            db.executemany("INSERT OR REPLACE INTO sentence (key, entities, used) VALUES (?, ?, ?)",
+                           [(key, json.dumps(entities), now) for key, entities in self._pending_entries.items()])
+            self._pending_entries = {}
+            db.executemany("UPDATE sentence SET used = ? WHERE key = ?",
+                           [(used, key) for key, used in self._pending_uses.items()])
+            self._pending_uses = {}
+            size = db.execute("SELECT count(*) FROM sentence").fetchone()[0]
+            if size > self._max_entries:
+                db.execute("DELETE FROM sentence WHERE key IN (SELECT key FROM sentence ORDER BY used LIMIT ?)",
+                           (size - self._max_entries,))
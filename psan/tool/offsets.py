@@ -0,0 +1,125 @@
+"""Byte offsets of sentences in recognized files."""
+
+import os
+import re
+from array import array
+from bisect import bisect_left
+from io import BufferedReader, BytesIO, RawIOBase
+from typing import IO, Optional, Tuple
+
+
+class SentenceIndex:
+    """Maps sentence start token IDs to byte offsets of `<sentence>` tags in recognized file.
+    Sentences are numbered contiguously, so end of each sentence is the start of the following one."""
+
+    SENTENCE_PATTERN = re.compile(rb"<sentence start=\"(\d+)\"")
+    _CHUNK_SIZE = 1 << 20
+    _MAX_TAG_LENGTH = 64
+
+    def __init__(self, starts: array, offsets: array) -> None:
+        self._starts = starts
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    @classmethod
+    def build(cls, recognized_file: str) -> "SentenceIndex":
+        """Scans recognized file for sentence tags"""
+        starts = array("q")
+        offsets = array("q")
+        with open(recognized_file, mode="rb") as input:
+            position = 0
+            tail = b""
+            while True:
+                chunk = input.read(cls._CHUNK_SIZE)
+                if not chunk:
+                    break
+                data = tail + chunk
+                data_position = position - len(tail)
+                last_end = 0
+                for match in cls.SENTENCE_PATTERN.finditer(data):
+                    starts.append(int(match.group(1)))
+                    offsets.append(data_position + match.start())
+                    last_end = match.end()
+                # Keep possibly incomplete tag for the next chunk
+                tail = data[max(last_end, len(data) - cls._MAX_TAG_LENGTH):]
+                position += len(chunk)
+        return cls(starts, offsets)
+
+    @classmethod
+    def load(cls, index_file: str) -> "SentenceIndex":
+        """Loads index saved by `save`"""
+        data = array("q")
+        with open(index_file, mode="rb") as input:
+            data.frombytes(input.read())
+        half = len(data) // 2
+        return cls(data[:half], data[half:])
+
+    def save(self, index_file: str) -> None:
+        """Atomically saves index to the file"""
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, mode="wb") as output:
+            self._starts.tofile(output)
+            self._offsets.tofile(output)
+        os.replace(tmp_file, index_file)
+
+    def window_range(self, window_start: int, window_end: int) -> Optional[Tuple[int, Optional[int]]]:
+        """Returns byte range [begin, end) of sentences needed to show text window (`end` is None for end of file).
+        The range starts with the first sentence starting in the window and ends with the first sentence
+        reaching the window end. Returns None when no sentence starts in the window."""
+        first = bisect_left(self._starts, max(0, window_start))
+        if first == len(self._starts) or self._starts[first] > window_end:
+            return None
+        # Sentence following the one that reaches window end
+        following = bisect_left(self._starts, window_end, lo=first + 1)
+        if following < len(self._starts):
+            return self._offsets[first], self._offsets[following]
+        else:
+            return self._offsets[first], None
+
+    def read_window(self, recognized_file: str, window_start: int, window_end: int) -> BytesIO:
+        """Returns XML document with sentences needed to show text window"""
+        byte_range = self.window_range(window_start, window_end)
+        if byte_range is None:
+            return BytesIO(b"<submission></submission>")
+        begin, end = byte_range
+        with open(recognized_file, mode="rb") as input:
+            input.seek(begin)
+            if end is None:
+                # Rest of the file including closing tag
+                return BytesIO(b"<submission>" + input.read())
+            return BytesIO(b"<submission>" + input.read(end - begin) + b"</submission>")
+
+    def open_from(self, recognized_file: str, token_id: int) -> IO[bytes]:
+        """Opens XML document with sentences starting at `token_id` or later till the end of file
+        (parsing resumed from a sentence boundary)"""
+        first = bisect_left(self._starts, token_id)
+        if first == len(self._starts):
+            return BytesIO(b"<submission></submission>")
+        input = open(recognized_file, mode="rb")
+        input.seek(self._offsets[first])
+        return BufferedReader(_PrefixedReader(b"<submission>", input))
+
+
+class _PrefixedReader(RawIOBase):
+    """Binary stream of `prefix` followed by the rest of `file`"""
+
+    def __init__(self, prefix: bytes, file: IO[bytes]) -> None:
+        self._prefix = prefix
+        self._file = file
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        return self._file.readinto(buffer)
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
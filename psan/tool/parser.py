@@ -1,9 +1,18 @@
+import warnings
 import xml
+import xml.sax  # nosec - parse only internal XML
+import xml.sax.handler  # nosec - parse only internal XML
 from heapq import heappop, heappush
-from typing import Any, List, NamedTuple
+from typing import IO, Any, Callable, Dict, List, NamedTuple, Union
+from xml.parsers import expat  # nosec - parse only internal XML
 
 from psan.tool.model import Word
 
+try:
+    from lxml import etree  # nosec - parse only internal XML
+except ImportError:  # pragma: no cover - optional dependency
+    etree = None
+
 
 class LookupEvent(NamedTuple):
     target_token_id: int
@@ -11,6 +20,111 @@ class LookupEvent(NamedTuple):
     data: Any
 
 
+Source = Union[str, IO[bytes]]
+
+
+def _parse_sax(source: Source, handler: "AnnotationParser") -> None:
+    """ Parses the text with `xml.sax` (callbacks of AnnotationParser) """
+    parser = xml.sax.make_parser()  # nosec - parse only internal XML
+    parser.setFeature(xml.sax.handler.feature_namespaces, 0)
+    parser.setContentHandler(handler)
+    parser.parse(source)
+
+
+def _parse_expat(source: Source, handler: "AnnotationParser") -> None:
+    """ Parses the text with raw pyexpat parser with buffered character data """
+    parser = expat.ParserCreate()  # nosec - parse only internal XML
+    parser.buffer_text = True
+    parser.buffer_size = 1 << 16
+    token_id = -1
+    text: List[str] = []
+    in_token = False
+
+    def start_element(tag: str, attrs: Dict[str, str]) -> None:
+        nonlocal token_id, in_token
+        if tag == "token":
+            token_id = int(attrs["id"])
+            in_token = True
+            text.clear()
+        elif tag == "ne":
+            handler.feedNameEntityStart(int(attrs["start"]), int(attrs["end"]), attrs["type"])
+        elif tag == "sentence":
+            handler.feedSentenceStart(int(attrs["start"]))
+
+    def character_data(data: str) -> None:
+        if in_token:
+            text.append(data)
+
+    def end_element(tag: str) -> None:
+        nonlocal in_token
+        if tag == "token":
+            in_token = False
+            handler.feedToken(token_id, "".join(text).strip())
+        elif tag == "ne":
+            handler.feedNameEntityEnd()
+
+    parser.StartElementHandler = start_element
+    parser.CharacterDataHandler = character_data
+    parser.EndElementHandler = end_element
+    _parse_file(parser, source)
+    handler.feedDocumentEnd()
+
+
+def _parse_file(parser: "expat.XMLParserType", source: Source) -> None:
+    if isinstance(source, str):
+        with open(source, mode="rb") as input:
+            parser.ParseFile(input)
+    else:
+        parser.ParseFile(source)
+
+
+def _parse_lxml(source: Source, handler: "AnnotationParser") -> None:
+    """ Parses the text with `lxml.etree.iterparse` and clears processed elements """
+    for event, element in etree.iterparse(source, events=("start", "end"), tag=("sentence", "ne", "token")):
+        if event == "start" and element.tag == "sentence":
+            handler.feedSentenceStart(int(element.get("start")))
+        elif element.tag == "token":
+            if event == "end":
+                handler.feedToken(int(element.get("id")), (element.text or "").strip())
+        elif element.tag == "ne":
+            if event == "start":
+                handler.feedNameEntityStart(int(element.get("start")), int(element.get("end")), element.get("type"))
+            else:
+                handler.feedNameEntityEnd()
+        elif event == "end":
+            # Free processed sentences
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    handler.feedDocumentEnd()
+
+
+ENGINES: Dict[str, Callable[[Source, "AnnotationParser"], None]] = {
+    "sax": _parse_sax,
+    "expat": _parse_expat,
+}
+if etree is not None:
+    ENGINES["lxml"] = _parse_lxml
+
+_default_engine = "expat"
+
+
+def set_default_engine(engine: str) -> None:
+    """ Selects engine used by `parse_annotations` (falls back to `expat` when `lxml` is not installed) """
+    global _default_engine
+    if engine == "lxml" and etree is None:
+        warnings.warn("lxml is not installed, using expat parser instead")
+        engine = "expat"
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown parser engine {engine}")
+    _default_engine = engine
+
+
+def parse_annotations(source: Source, handler: "AnnotationParser", engine: str = None) -> None:
+    """ Parses psan's XML formated text (file name or binary file) and forwards its events to the handler """
+    ENGINES[engine or _default_engine](source, handler)
+
+
 class AnnotationParser(xml.sax.ContentHandler):
     """ Provides event driven API for psan's XML formated texts"""
 
@@ -22,39 +136,67 @@ class AnnotationParser(xml.sax.ContentHandler):
         self._lookup_events: List[LookupEvent] = []
         # Current state
         self._last_token_id = -1
-        self._last_token: str
+        self._token_text: List[str] = []
+        self._in_token = False
         self._ne_depth = 0
 
     def startElement(self, tag, attrs):
         if tag == "ne":
-            self._ne_depth += 1
             # Get params from XML
             start = int(attrs.get("start"))
             end = int(attrs.get("end"))
             ne_type = attrs.get("type")
-            # Forward event
-            self.onNameEntity(start, end, ne_type, self._ne_depth)
+            self.feedNameEntityStart(start, end, ne_type)
         elif tag == "token":
             self._last_token_id = int(attrs.get("id"))
+            self._in_token = True
+            self._token_text = []
+        elif tag == "sentence":
+            self.feedSentenceStart(int(attrs.get("start")))
 
     def characters(self, content):
-        # Save token context
-        self._last_token = content.strip()
+        # Save token context (may come in several chunks)
+        if self._in_token:
+            self._token_text.append(content)
 
     def endElement(self, tag):
         if tag == "token":
-            # Save last word info
-            last_word = Word(self._last_token)
-            # Forward event
-            self.onWord(last_word)
-            # Current lookup event
-            if len(self._lookup_events) > 0:
-                if len(self._word_list) == 0:
-                    self._word_list_first_token_id = self._last_token_id
-                self._word_list.append(last_word)
-                self._handleLookups(self._last_token_id)
+            self._in_token = False
+            self.feedToken(self._last_token_id, "".join(self._token_text).strip())
         elif tag == "ne":
-            self._ne_depth -= 1
+            self.feedNameEntityEnd()
+
+    def endDocument(self):
+        self.feedDocumentEnd()
+
+    def feedNameEntityStart(self, start: int, end: int, ne_type: str) -> None:
+        self._ne_depth += 1
+        # Forward event
+        self.onNameEntity(start, end, ne_type, self._ne_depth)
+
+    def feedNameEntityEnd(self) -> None:
+        self._ne_depth -= 1
+
+    def feedSentenceStart(self, start: int) -> None:
+        # Forward event
+        self.onSentenceStart(start)
+
+    def feedToken(self, token_id: int, token: str) -> None:
+        self._last_token_id = token_id
+        # Save last word info
+        last_word = Word(token)
+        # Forward event
+        self.onWord(last_word)
+        # Current lookup event
+        if len(self._lookup_events) > 0:
+            if len(self._word_list) == 0:
+                self._word_list_first_token_id = self._last_token_id
+            self._word_list.append(last_word)
+            self._handleLookups(self._last_token_id)
+
+    def feedDocumentEnd(self) -> None:
+        # Forward event
+        self.onDocumentEnd()
 
     def registerLookup(self, event: LookupEvent) -> None:
         heappush(self._lookup_events, event)
@@ -77,5 +219,55 @@ class AnnotationParser(xml.sax.ContentHandler):
     def onNameEntity(self, start: int, end: int, ne_type: str, depth: int) -> None:
         pass
 
+    def onSentenceStart(self, start: int) -> None:
+        pass
+
+    def isResumable(self) -> bool:
+        """Checks that no pending work spans the current position (e.g. lookups), so parsing can be resumed
+        from the following sentence with a new handler"""
+        return len(self._lookup_events) == 0
+
+    def onCheckpoint(self) -> None:
+        """Writes buffered work before it is committed at a checkpoint"""
+        pass
+
     def onWord(self, word: Word) -> None:
         pass
+
+    def onDocumentEnd(self) -> None:
+        pass
+
+
+class AnnotationPipeline(AnnotationParser):
+    """ Forwards events of a single parse to several handlers (each keeps its own state and lookups) """
+
+    def __init__(self, handlers: List[AnnotationParser]) -> None:
+        super().__init__()
+        self._handlers = handlers
+
+    def feedNameEntityStart(self, start: int, end: int, ne_type: str) -> None:
+        for handler in self._handlers:
+            handler.feedNameEntityStart(start, end, ne_type)
+
+    def feedNameEntityEnd(self) -> None:
+        for handler in self._handlers:
+            handler.feedNameEntityEnd()
+
+    def feedSentenceStart(self, start: int) -> None:
+        for handler in self._handlers:
+            handler.feedSentenceStart(start)
+
+    def isResumable(self) -> bool:
+        return all(handler.isResumable() for handler in self._handlers)
+
+    def onCheckpoint(self) -> None:
+        for handler in self._handlers:
+            handler.onCheckpoint()
+
+    def feedToken(self, token_id: int, token: str) -> None:
+        for handler in self._handlers:
+            handler.feedToken(token_id, token)
+
+    def feedDocumentEnd(self) -> None:
+        for handler in self._handlers:
+            handler.feedDocumentEnd()
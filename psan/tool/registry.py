@@ -0,0 +1,66 @@
+"""Process-wide registry of loaded NER models."""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+
+from psan.tool.ner import NerInterface
+
+
+class ModelRegistry:
+    """Loads each named model once per process and keeps the most recently used ones within memory budget.
+    Memory usage of a model is estimated by the size of its file times the number of processes loading it
+    (`processes`, e.g. the recognizer and workers of its pool). Evicted models are closed."""
+
+    def __init__(self, models: Dict[str, str], memory_budget: Optional[int] = None,
+                 loader: Callable[[str], NerInterface] = None, processes: int = 1) -> None:
+        self._models = dict(models)
+        self._memory_budget = memory_budget
+        self._loader = loader
+        self._processes = processes
+        self._loaded: "OrderedDict[str, NerInterface]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> Iterable[str]:
+        return self._models.keys()
+
+    @property
+    def loaded(self) -> Iterable[str]:
+        return list(self._loaded.keys())
+
+    def get(self, name: str) -> NerInterface:
+        """Returns loaded model, loads it (and evicts least recently used models) if necessary"""
+        if name not in self._models:
+            raise ValueError(f"Unknown NER model {name}")
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+            # Make space for new model
+            size = os.path.getsize(self._models[name]) * self._processes
+            if self._memory_budget is not None:
+                while self._loaded and sum(self._sizes.values()) + size > self._memory_budget:
+                    evicted, evicted_model = self._loaded.popitem(last=False)
+                    self._sizes.pop(evicted)
+                    evicted_model.close()
+            # Load model
+            model = self._loader(self._models[name])
+            self._loaded[name] = model
+            self._sizes[name] = size
+            return model
+
+    def preload(self, names: Iterable[str]) -> None:
+        """Loads models in advance (e.g. at worker start)"""
+        for name in names:
+            self.get(name)
+
+    def close(self) -> None:
+        """Closes all loaded models (e.g. at worker shutdown)"""
+        with self._lock:
+            while self._loaded:
+                _, model = self._loaded.popitem(last=False)
+                model.close()
+            self._sizes.clear()
@@ -0,0 +1,48 @@
+from typing import Callable, List
+
+from psan.tool.controller import Controller
+from psan.tool.offsets import SentenceIndex
+from psan.tool.parser import (AnnotationParser, AnnotationPipeline,
+                              parse_annotations)
+
+
+def run_resumable(recognized_file: str, index: SentenceIndex, controller: Controller, stage: str,
+                  handlers: List[AnnotationParser], commit: Callable[[], None], rule_epoch: int = 0,
+                  batch_size: int = 10000) -> int:
+    """Parses the file by handlers and commits their work in batches of about `batch_size` tokens.
+    A run interrupted by a failure is resumed from its last checkpoint. Work after the last checkpoint is left
+    uncommitted (the caller commits it with the end of the stage).
+    Returns rule epoch of the first run of the stage (`rule_epoch` unless the stage is resumed)."""
+    checkpoint = controller.checkpoint(stage)
+    start, rule_epoch = checkpoint if checkpoint else (0, rule_epoch)
+    pipeline = CheckpointPipeline(handlers, controller, stage, commit, start, rule_epoch, batch_size)
+    with controller.batch():
+        if start:
+            with index.open_from(recognized_file, start) as source:
+                parse_annotations(source, pipeline)
+        else:
+            parse_annotations(recognized_file, pipeline)
+    return rule_epoch
+
+
+class CheckpointPipeline(AnnotationPipeline):
+    """Forwards events to handlers and commits their work at the first sentence start after `batch_size` tokens
+    where all handlers are resumable. The sentence start is recorded as checkpoint of the stage."""
+
+    def __init__(self, handlers: List[AnnotationParser], controller: Controller, stage: str, commit: Callable[[], None],
+                 start: int, rule_epoch: int, batch_size: int) -> None:
+        super().__init__(handlers)
+        self._ctl = controller
+        self._stage = stage
+        self._commit = commit
+        self._checkpoint = start
+        self._rule_epoch = rule_epoch
+        self._batch_size = batch_size
+
+    def feedSentenceStart(self, start: int) -> None:
+        if start - self._checkpoint >= self._batch_size and self.isResumable():
+            self.onCheckpoint()
+            self._ctl.save_checkpoint(self._stage, start, self._rule_epoch)
+            self._commit()
+            self._checkpoint = start
+        super().feedSentenceStart(start)
@@ -0,0 +1,36 @@
+from typing import List, Tuple
+
+from psan.tool.controller import Controller
+from psan.tool.model import Word
+from psan.tool.parser import AnnotationParser, parse_annotations
+
+
+def index_tokens(recognized_file: str, controller: Controller, batch_size: int = 1000) -> None:
+    # Parse recognized XML
+    parse_annotations(recognized_file, TokenIndexParser(controller, batch_size))
+
+
+class TokenIndexParser(AnnotationParser):
+    """Saves position of each token in provided XML into token occurrence index"""
+
+    def __init__(self, controller: Controller, batch_size: int = 1000) -> None:
+        super().__init__()
+        self._ctl = controller
+        self._batch_size = batch_size
+        self._tokens: List[Tuple[int, str]] = []
+
+    def onWord(self, word: Word) -> None:
+        self._tokens.append((self._last_token_id, word.token))
+        if len(self._tokens) >= self._batch_size:
+            self._flush()
+
+    def onDocumentEnd(self) -> None:
+        self._flush()
+
+    def onCheckpoint(self) -> None:
+        self._flush()
+
+    def _flush(self) -> None:
+        if self._tokens:
+            self._ctl.index_tokens(self._tokens)
+            self._tokens = []
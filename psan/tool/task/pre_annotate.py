@@ -1,5 +1,3 @@
-import xml.sax  # nosec - parse only internal XML
-import xml.sax.handler  # nosec - parse only internal XML
 from typing import Dict, List
 
 from psan.tool.controller import Controller
@@ -7,15 +5,6 @@ from psan.tool.model import AnnotationDecision, Interval, Rule, Word
 from psan.tool.parser import AnnotationParser, LookupEvent
 
 
-def detect_recognized_name_entries(recognized_file: str, controller: Controller) -> None:
-    # Parse pre-annotated XML
-    parser = xml.sax.make_parser()  # nosec - parse only internal XML
-    parser.setFeature(xml.sax.handler.feature_namespaces, 0)
-    handler = PreAnnotationParser(controller)
-    parser.setContentHandler(handler)
-    parser.parse(recognized_file)
-
-
 class PreAnnotationParser(AnnotationParser):
     """Make rules from named entities in provided XML file"""
 
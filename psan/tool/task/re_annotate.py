@@ -1,47 +1,56 @@
-import xml.sax  # nosec - parse only internal XML
-import xml.sax.handler  # nosec - parse only internal XML
-from typing import List
+from itertools import groupby
+from typing import List, Optional, Tuple
 
 from psan.tool.controller import Controller
-from psan.tool.model import Evidence, EvidenceType, Interval, Word
-from psan.tool.parser import AnnotationParser, LookupEvent
+from psan.tool.matcher import RuleTrie
+from psan.tool.model import Interval, Rule, Word
+from psan.tool.parser import AnnotationParser, parse_annotations
 
 
-def apply_rules(filename: str, ctl: Controller) -> None:
+def apply_rules(filename: str, ctl: Controller, rules: Optional[RuleTrie] = None) -> None:
+    # Load rules once for whole document
+    if rules is None:
+        rules = ctl.load_rules()
     # Find evidences in provided XML
-    parser = xml.sax.make_parser()  # nosec - parse only internal XML
-    parser.setFeature(xml.sax.handler.feature_namespaces, 0)
-    handler = ReAnnotateParser(ctl)
-    parser.setContentHandler(handler)
-    parser.parse(filename)
+    with ctl.batch():
+        parse_annotations(filename, ReAnnotateParser(ctl, rules))
+
+
+def propagate_rules(first_token: str, ctl: Controller, status: str) -> None:
+    """Applies rules starting with `first_token` to its indexed occurrences in all submissions with `status`"""
+    rules = ctl.load_rules_starting_with(first_token)
+    if not len(rules):
+        return
+    occurrences = ctl.find_occurrences(first_token, rules.depth, status)
+    for document_id, document_occurrences in groupby(occurrences, key=lambda occurrence: occurrence[0]):
+        document_ctl = ctl.for_document(document_id)
+        with document_ctl.batch():
+            for _, token_id, tokens in document_occurrences:
+                match = rules.longest_match(tokens)
+                if match:
+                    length, rule = match
+                    document_ctl.annotate_from_rule(Interval(token_id, token_id + length - 1), rule)
 
 
 class ReAnnotateParser(AnnotationParser):
-    """ Finds name entity type and tokens for each open candidate in provided XML """
+    """ Finds the longest known rule starting at each token in provided XML """
 
-    def __init__(self, ctl: Controller):
+    def __init__(self, ctl: Controller, rules: RuleTrie):
         super().__init__()
         self._ctl = ctl
+        self._matcher = rules.matcher()
 
     def onWord(self, word: Word) -> None:
         super().onWord(word)
+        self._annotate(self._matcher.feed(self._last_token_id, word.token))
 
-        # Future lookup length (for following words)
-        type, lookup = self._ctl.rule_lookup(word)
-        if type != EvidenceType.NONE:
-            target_id = self._last_token_id + lookup
-            event = LookupEvent(target_id, self._last_token_id, type)
-            self.registerLookup(event)
-
-    def onLookupEvent(self, event: LookupEvent, words: List[Word]) -> None:
-        super().onLookupEvent(event, words)
-        # Prepare evidence
-        interval = Interval(event.source_token_id, event.target_token_id)
-        if event.data == EvidenceType.WORD_TYPE:
-            tokens = [word.token for word in words]
-            evidence = Evidence(EvidenceType.WORD_TYPE, interval, tokens)
-            # Find rule for current evidence
-            rule = self._ctl.find_rule(evidence)
-            # Pass updated rule
-            if rule:
-                self._ctl.annotate_from_rule(evidence.interval, rule)
+    def onDocumentEnd(self) -> None:
+        super().onDocumentEnd()
+        self._annotate(self._matcher.close())
+
+    def isResumable(self) -> bool:
+        return super().isResumable() and self._matcher.idle
+
+    def _annotate(self, matches: List[Tuple[int, int, Rule]]) -> None:
+        for start, end, rule in matches:
+            self._ctl.annotate_from_rule(Interval(start, end), rule)
@@ -1,15 +1,69 @@
+import functools
 import os
+from typing import Dict, Optional
 
-from psan.tool.ner import NameTag, RegexNer
+from psan.tool.ner import NameTag, NerInterface, RegexNer
+from psan.tool.ner_cache import SentenceCache
+from psan.tool.registry import ModelRegistry
+
+DEFAULT_MODEL = "default"
 
 default_ner = RegexNer(RegexNer.TWO_UPPERCASE_WORDS)
 
 
-def recognize_file(input_filename: str, output_filename: str) -> int:
-    """ Tokenize file and recognize name entities. Return number of tokens in file. """
+def _configured_models() -> Dict[str, str]:
+    """Models from `NER_MODEL` (default model) and `NER_MODELS` (comma separated `name=path` pairs)"""
+    models = {}
     if os.environ.get("NER_MODEL"):
-        ner = NameTag(os.environ.get("NER_MODEL"))
-    else:
-        ner = default_ner
+        models[DEFAULT_MODEL] = os.environ["NER_MODEL"]
+    for item in os.environ.get("NER_MODELS", "").split(","):
+        if "=" in item:
+            name, path = item.split("=", 1)
+            models[name.strip()] = path.strip()
+    return models
+
+
+def _memory_budget() -> Optional[int]:
+    budget = os.environ.get("NER_MEMORY_BUDGET_MB")
+    return int(budget) * 1024 * 1024 if budget else None
+
+
+# Sentence-sharded parallel recognition (number of processes per model)
+_workers = int(os.environ.get("NER_WORKERS", "1"))
+
+# Sentence cache shared by workers on the same machine
+_cache = SentenceCache(os.environ["NER_CACHE"], int(os.environ.get("NER_CACHE_SIZE", "100000"))) \
+    if os.environ.get("NER_CACHE") else None
+
+# Parallel recognition loads the model in the worker and in each process of its pool
+registry = ModelRegistry(_configured_models(), _memory_budget(),
+                         functools.partial(NameTag, workers=_workers, cache=_cache),
+                         _workers + 1 if _workers > 1 else 1)
 
-    return ner.recognize_file(input_filename, output_filename)
+
+def get_ner(model: Optional[str] = None) -> NerInterface:
+    """ Returns loaded recognizer by model name (default model or regex recognizer when no model is configured). """
+    if model is None:
+        if DEFAULT_MODEL not in registry.names:
+            return default_ner
+        model = DEFAULT_MODEL
+    return registry.get(model)
+
+
+def preload_models() -> None:
+    """ Loads default model (or all models from `NER_PRELOAD`) into the current process. """
+    names = os.environ.get("NER_PRELOAD")
+    if names:
+        registry.preload(name.strip() for name in names.split(",") if name.strip())
+    elif DEFAULT_MODEL in registry.names:
+        registry.preload([DEFAULT_MODEL])
+
+
+def close_models() -> None:
+    """ Stops processes of models loaded into the current process. """
+    registry.close()
+
+
+def recognize_file(input_filename: str, output_filename: str, model: Optional[str] = None) -> int:
+    """ Tokenize file and recognize name entities. Return number of tokens in file. """
+    return get_ner(model).recognize_file(input_filename, output_filename)
@@ -0,0 +1,104 @@
+"""Cache of rendered annotation windows shared by all web workers on the same machine."""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from flask import current_app
+
+_COUNTERS = ("hits", "misses", "prefetches", "evictions")
+
+
+class WindowCache:
+    """Stores rendered HTML of text windows in SQLite database on local disk.
+    Least recently used windows are evicted when the stored HTML grows over `max_bytes`.
+    Hit and miss counters are kept in the database, so they cover all workers."""
+
+    def __init__(self, path: str, max_bytes: int = 64 << 20) -> None:
+        self._path = path
+        self._max_bytes = max_bytes
+        # Connection of each process and thread
+        self._local = threading.local()
+
+    def _db(self) -> sqlite3.Connection:
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS window"
+                               " (key BLOB PRIMARY KEY, html TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS window_used_idx ON window (used)")
+            connection.execute("CREATE TABLE IF NOT EXISTS counter (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    @staticmethod
+    def key(submission_uid: str, start: int, end: int, mtime: int) -> bytes:
+        """Hash of window and modification time of the recognized file (new file invalidates its windows)"""
+        return hashlib.sha256(f"{submission_uid}\0{start}\0{end}\0{mtime}".encode()).digest()
+
+    @staticmethod
+    def _count(db: sqlite3.Connection, name: str, value: int = 1) -> None:
+        db.execute("INSERT INTO counter (name, value) VALUES (?, ?)"
+                   " ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", (name, value))
+
+    def get(self, key: bytes) -> Optional[str]:
+        """Returns cached HTML (and counts hit or miss)"""
+        db = self._db()
+        with db:
+            db.execute("BEGIN")
+            row = db.execute("SELECT html FROM window WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(db, "misses")
+                return None
+            db.execute("UPDATE window SET used = ? WHERE key = ?", (time.time(), key))
+            self._count(db, "hits")
+        return row[0]
+
+    def contains(self, key: bytes) -> bool:
+        """Checks presence of the window without affecting counters and eviction order"""
+        return self._db().execute("SELECT 1 FROM window WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: bytes, html: str, prefetch: bool = False) -> None:
+        """Stores rendered window and evicts least recently used ones over the byte budget"""
+        db = self._db()
+        size = len(html.encode())
+        with db:
+            db.execute("BEGIN")
+            db.execute("INSERT OR REPLACE INTO window (key, html, size, used) VALUES (?, ?, ?, ?)",
+                       (key, html, size, time.time()))
+            if prefetch:
+                self._count(db, "prefetches")
+            evicted = db.execute("DELETE FROM window WHERE key IN"
+                                 " (SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY used DESC, rowid DESC) AS total"
+                                 " FROM window) WHERE total > ?)", (self._max_bytes,)).rowcount
+            if evicted:
+                self._count(db, "evictions", evicted)
+
+    def statistics(self) -> Dict[str, float]:
+        """Counters, number of cached windows, their size and hit ratio"""
+        db = self._db()
+        stats = {name: 0 for name in _COUNTERS}
+        stats.update(db.execute("SELECT name, value FROM counter").fetchall())
+        stats["entries"], stats["bytes"] = db.execute("SELECT count(*), COALESCE(SUM(size), 0) FROM window").fetchone()
+        stats["max_bytes"] = self._max_bytes
+        requests = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / requests if requests else 0.0
+        return stats
+
+
+_cache: Optional[WindowCache] = None
+
+
+def get_window_cache() -> Optional[WindowCache]:
+    """Window cache configured by `WINDOW_CACHE` and `WINDOW_CACHE_SIZE` (None when disabled)"""
+    global _cache
+    path = current_app.config["WINDOW_CACHE"]
+    if not path or current_app.config["WINDOW_CACHE_SIZE"] <= 0:
+        return None
+    if _cache is None or _cache._path != path:
+        _cache = WindowCache(path, current_app.config["WINDOW_CACHE_SIZE"])
+    return _cache
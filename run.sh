@@ -7,13 +7,16 @@ if [ $status -ne 0 ]; then
   exit $status
 fi
 
-# Start background worker
-(su -c ". venv/bin/activate; celery -A psan.celery.celery worker" psan_user)&
-status=$?
-if [ $status -ne 0 ]; then
-  echo "Failed to start celery worker. EXIT $status" >&2
-  exit $status
-fi
+# Start background workers (default queue with periodic tasks and one worker per pre-processing stage)
+for worker in "celery -B" "ner -c ${NER_CONCURRENCY:-2}" "annotate -c ${ANNOTATE_CONCURRENCY:-2}" \
+              "rules -c ${RULES_CONCURRENCY:-4}"; do
+  (su -c ". venv/bin/activate; celery -A psan.celery.celery worker -n ${worker%% *}@%h -Q $worker" psan_user)&
+  status=$?
+  if [ $status -ne 0 ]; then
+    echo "Failed to start celery worker. EXIT $status" >&2
+    exit $status
+  fi
+done
 
 # Naive check runs checks once a minute to see if either of the processes exited.
 # This illustrates part of the heavy lifting you need to do if you want to run
@@ -0,0 +1,24 @@
+import uuid
+
+import pytest
+from flask.testing import FlaskClient
+from psan import app
+from psan.db import commit, get_cursor
+
+
+@pytest.fixture
+def admin(client: FlaskClient):
+    """Logged in admin account (committed, deleted after test)"""
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("INSERT INTO account (full_name, type, window_size, email, password)"
+                           " VALUES ('Test Admin', 'ADMIN', 50, %s, '-') RETURNING id", (f"{uuid.uuid4()}@example.com",))
+            account_id = cursor.fetchone()["id"]
+            commit()
+    with client.session_transaction() as session:
+        session["account_id"] = account_id
+    yield account_id
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("DELETE FROM account WHERE id = %s", (account_id,))
+            commit()
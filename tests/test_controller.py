@@ -0,0 +1,254 @@
+import uuid
+
+import pytest
+from flask.testing import FlaskClient
+from psan import app
+from psan.db import _connect, commit, get_cursor, get_db
+from psan.model import SubmissionStatus
+from psan.tool.controller import Controller
+from psan.tool.model import AnnotationDecision, Interval, RuleType
+from psan.tool.task.index_tokens import index_tokens
+from psan.tool.task.re_annotate import apply_rules, propagate_rules
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        app.config["SERVER_NAME"] = "example.com"
+        yield client
+
+
+def _new_submission(cursor) -> int:
+    cursor.execute("INSERT INTO submission (name, uid) VALUES (%s, %s) RETURNING id", ("test", str(uuid.uuid4())))
+    return cursor.fetchone()["id"]
+
+
+def _annotations(cursor, doc_id: int):
+    cursor.execute("SELECT ref_start, ref_end, token_level, rule_level, array_agg(ar.rule ORDER BY ar.rule) AS rules"
+                   " FROM annotation a LEFT JOIN annotation_rule ar ON ar.annotation = a.id"
+                   " WHERE submission = %s GROUP BY a.id ORDER BY ref_start, ref_end", (doc_id,))
+    return [tuple(row) for row in cursor]
+
+
+def _annotate(ctl: Controller, rules) -> None:
+    ctl.annotate_from_rule(Interval(0, 1), rules[0], AnnotationDecision.NESTED)
+    ctl.annotate_from_rule(Interval(0, 1), rules[1])
+    ctl.annotate_from_rule(Interval(3, 3), rules[0])
+    ctl.annotate_from_rule(Interval(3, 3), rules[0])
+    ctl.annotate_from_rule(Interval(5, 7), rules[1])
+
+
+def test_batch_matches_direct_writes(client: FlaskClient) -> None:
+    """
+    Test that batched annotation writes produce same annotations as direct writes
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            rules = []
+            for word, confidence in [("batch_test_a", 2), ("batch_test_b", -5)]:
+                ctl = Controller(cursor, None)
+                rules.append(ctl.set_rule(RuleType.WORD_TYPE, [word], confidence))
+
+            direct = Controller(cursor, _new_submission(cursor))
+            _annotate(direct, rules)
+
+            batched = Controller(cursor, _new_submission(cursor))
+            with batched.batch(size=2):
+                _annotate(batched, rules)
+
+            assert _annotations(cursor, direct._document_id) == _annotations(cursor, batched._document_id)
+            # Streamed decisions
+            batched.stream_itersize = 1
+            assert list(batched.iter_decisions(1, True)) == batched.get_decisions(None, 1, True)
+        get_db().rollback()
+
+
+_RECOGNIZED = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n"
+               "<sentence start=\"0\" end=\"4\"><token id=\"0\">Hi</token> <token id=\"1\">idx_test_john</token>"
+               " <token id=\"2\">idx_test_smith</token><token id=\"3\">.</token></sentence>\n"
+               "<sentence start=\"4\" end=\"6\"><ne type=\"P\" start=\"4\" end=\"5\">"
+               "<ne type=\"PF\" start=\"4\" end=\"4\"><token id=\"4\">idx_test_john</token></ne>"
+               " <token id=\"5\">idx_test_doe</token></ne></sentence>"
+               "\n</submission>")
+
+
+def test_propagation_matches_re_annotation(client: FlaskClient, tmp_path) -> None:
+    """
+    Test that rule propagation through token index annotates same intervals as full re-annotation
+    """
+    recognized_file = tmp_path / "recognized.xml"
+    recognized_file.write_text(_RECOGNIZED)
+    with app.app_context():
+        with get_cursor() as cursor:
+            ctl = Controller(cursor, None)
+            ctl.set_rule(RuleType.WORD_TYPE, ["idx_test_john"], 1)
+            ctl.set_rule(RuleType.WORD_TYPE, ["idx_test_john", "idx_test_smith"], -1)
+
+            re_annotated = ctl.for_document(_new_submission(cursor))
+            apply_rules(str(recognized_file), re_annotated)
+
+            propagated = ctl.for_document(_new_submission(cursor))
+            cursor.execute("UPDATE submission SET status = %s WHERE id = %s",
+                           (SubmissionStatus.PRE_ANNOTATED.value, propagated._document_id))
+            index_tokens(str(recognized_file), propagated)
+            propagate_rules("idx_test_john", ctl, SubmissionStatus.PRE_ANNOTATED.value)
+
+            expected = _annotations(cursor, re_annotated._document_id)
+            assert [(start, end) for start, end, *_ in expected] == [(1, 2), (4, 4)]
+            assert _annotations(cursor, propagated._document_id) == expected
+        get_db().rollback()
+
+
+def test_rule_epoch(client: FlaskClient) -> None:
+    """
+    Test that new word rules increase rule epoch and make pre-annotated documents stale until rules are propagated
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            ctl = Controller(cursor, _new_submission(cursor))
+            cursor.execute("UPDATE submission SET status = %s WHERE id = %s",
+                           (SubmissionStatus.PRE_ANNOTATED.value, ctl._document_id))
+            ctl.set_applied_rule_epoch(ctl.rule_epoch())
+            # Fire deferred epoch triggers without commit
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            epoch = ctl.rule_epoch()
+            ctl.add_ne_type("epoch_test_type")
+            assert ctl.rule_epoch() == epoch
+            assert ctl._document_id not in ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value, epoch, 1000)
+            ctl.set_rule(RuleType.WORD_TYPE, ["epoch_test_word"], 1)
+            assert ctl.rule_epoch() > epoch
+            # Unchanged rule, confidence changes (annotator decisions) and deletes don't change matches of rules
+            epoch = ctl.rule_epoch()
+            ctl.set_rule_label(["epoch_test_word"], None)
+            ctl.set_rule(RuleType.WORD_TYPE, ["epoch_test_word"], -1)
+            cursor.execute("DELETE FROM rule WHERE condition = %s", (["epoch_test_word"],))
+            assert ctl.rule_epoch() == epoch
+            assert ctl._document_id in ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value, epoch, 1000)
+            # Propagation reaches indexed documents only
+            ctl.set_propagated_rule_epoch([ctl._document_id], epoch, ["epoch_test_word"])
+            assert ctl._document_id in ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value, epoch, 1000)
+            ctl.index_tokens([(0, "epoch_test_word")])
+            # Propagation of other tokens does not cover the new rule
+            ctl.set_propagated_rule_epoch([ctl._document_id], epoch, ["epoch_test_other"])
+            assert ctl._document_id in ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value, epoch, 1000)
+            ctl.set_propagated_rule_epoch([ctl._document_id], epoch, ["epoch_test_word"])
+            assert ctl._document_id not in ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value, epoch, None)
+            # The document advances only up to the first change which was not propagated
+            ctl.set_rule(RuleType.WORD_TYPE, ["epoch_test_next"], 1)
+            ctl.set_rule(RuleType.WORD_TYPE, ["epoch_test_last"], 1)
+            ctl.set_propagated_rule_epoch([ctl._document_id], ctl.rule_epoch(), ["epoch_test_next"])
+            assert ctl._document_id not in ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value, epoch + 1,
+                                                                    None)
+            assert ctl._document_id in ctl.find_stale_documents(SubmissionStatus.PRE_ANNOTATED.value,
+                                                                ctl.rule_epoch(), None)
+        get_db().rollback()
+
+
+def test_rule_epoch_is_committed(client: FlaskClient) -> None:
+    """
+    Test that other transactions see a new rule epoch only together with its rules
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            ctl = Controller(cursor, None)
+            other = _connect()
+            try:
+                with other.cursor(cursor_factory=type(cursor)) as other_cursor:
+                    other_ctl = Controller(other_cursor, None)
+                    epoch = other_ctl.rule_epoch()
+                    ctl.set_rule(RuleType.WORD_TYPE, ["epoch_test_committed"], 1)
+                    # Epoch is increased but not committed yet
+                    cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                    assert ctl.rule_epoch() > epoch
+                    assert other_ctl.rule_epoch() == epoch
+                    commit()
+                    assert other_ctl.rule_epoch() > epoch
+                    assert len(other_ctl.load_rules_starting_with("epoch_test_committed")) == 1
+                    other.rollback()
+            finally:
+                other.close()
+                cursor.execute("DELETE FROM rule WHERE condition = %s", (["epoch_test_committed"],))
+                commit()
+
+
+def test_revision(client: FlaskClient) -> None:
+    """
+    Test that every change of decisions increases revision of the affected document only
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            ctl = Controller(cursor, _new_submission(cursor))
+            other = Controller(cursor, _new_submission(cursor))
+            cursor.execute("INSERT INTO label (name, replacement) VALUES ('revision_test', 'X') RETURNING id")
+            label = cursor.fetchone()["id"]
+            rule = ctl.set_rule(RuleType.WORD_TYPE, ["revision_test_word"], 0)
+            other.annotate_from_rule(Interval(0, 0), rule)
+
+            changes = [
+                lambda: ctl.annotate_from_rule(Interval(0, 1), rule),
+                lambda: ctl.token_annotation(Interval(0, 1), AnnotationDecision.SECRET),
+                lambda: ctl.set_label(Interval(0, 1), label),
+                lambda: cursor.execute("UPDATE label SET replacement = 'Y' WHERE id = %s", (label,)),
+                lambda: cursor.execute("UPDATE rule SET confidence = -1 WHERE id = %s", (rule.id,)),
+                lambda: ctl.set_rule_label(["revision_test_word"], label),
+                lambda: cursor.execute("DELETE FROM rule WHERE id = %s", (rule.id,)),
+            ]
+            other_revision = other.revision()
+            for i, change in enumerate(changes):
+                revision = ctl.revision()
+                change()
+                assert ctl.revision() > revision
+                if i == 3:
+                    # Changes of annotations and labels of the document only
+                    assert other.revision() == other_revision
+            # Other document changed with the shared rule
+            assert other.revision() > other_revision
+            # Unrelated changes keep the revision
+            revision = ctl.revision()
+            cursor.execute("UPDATE label SET name = name WHERE id = %s", (label,))
+            ctl.set_rule(RuleType.WORD_TYPE, ["revision_test_other"], 1)
+            assert ctl.revision() == revision
+            # Deleted documents don't break triggers
+            cursor.execute("DELETE FROM submission WHERE id = %s", (other._document_id,))
+        get_db().rollback()
+
+
+def test_concurrent_revision(client: FlaskClient) -> None:
+    """
+    Test that concurrent writers of a document don't block each other and revision counts changes of both
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            ctl = Controller(cursor, _new_submission(cursor))
+            rule = ctl.set_rule(RuleType.WORD_TYPE, ["revision_test_concurrent"], 0)
+            commit()
+            other = _connect()
+            try:
+                revision = ctl.revision()
+                ctl.annotate_from_rule(Interval(0, 0), rule)
+                # Other writer changes the document while the first transaction is open
+                with other.cursor(cursor_factory=type(cursor)) as other_cursor:
+                    other_cursor.execute("SET lock_timeout = '1s'")
+                    other_ctl = Controller(other_cursor, ctl._document_id)
+                    other_ctl.annotate_from_rule(Interval(2, 2), rule)
+                    other.commit()
+                    other_revision = other_ctl.revision()
+                    assert other_revision > revision
+                    commit()
+                    assert ctl.revision() > other_revision
+                    assert other_ctl.revision() == ctl.revision()
+                    other.rollback()
+                # Folding keeps the revision
+                revision = ctl.revision()
+                ctl.fold_revisions()
+                commit()
+                assert ctl.revision() == revision
+                cursor.execute("SELECT count(*) AS changes FROM submission_revision WHERE submission = %s",
+                               (ctl._document_id,))
+                assert cursor.fetchone()["changes"] == 0
+            finally:
+                other.close()
+                get_db().rollback()
+                cursor.execute("DELETE FROM submission WHERE id = %s", (ctl._document_id,))
+                cursor.execute("DELETE FROM rule WHERE id = %s", (rule.id,))
+                commit()
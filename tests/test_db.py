@@ -1,8 +1,11 @@
+import os
 import random
+import uuid
 
 import pytest
 from psan.tool.model import RuleType
-from psan.db import commit, get_cursor
+from psan.db import (commit, database_settings, get_cursor, get_db,
+                     list_migrations, migrate, stream, sync_settings)
 from flask.testing import FlaskClient
 from psan import app
 
@@ -38,3 +41,180 @@ def test_rule_db(client: FlaskClient) -> None:
             cursor.execute("DELETE FROM rule WHERE type = %s and condition = %s",
                            (RuleType.WORD_TYPE.value, condition))
             commit()
+
+
+# Scratch schema with tables and row-level triggers of the first release
+_BASELINE_SCHEMA = "row_level_baseline"
+
+
+def _execute_both(cursor, query: str, params=()) -> None:
+    """Executes the statement in the current schema and in the baseline schema"""
+    for schema in ("public", _BASELINE_SCHEMA):
+        cursor.execute(f"SET LOCAL search_path TO {schema}")
+        cursor.execute(query, params)
+    cursor.execute("SET LOCAL search_path TO public")
+
+
+def _rule_levels(cursor, schema: str, uid: str):
+    cursor.execute(f"SELECT ref_start, rule_level FROM {schema}.annotation"
+                   f" WHERE submission = (SELECT id FROM {schema}.submission WHERE uid = %s)", (uid,))
+    return {row["ref_start"]: row["rule_level"] for row in cursor}
+
+
+def test_rule_level_triggers(client: FlaskClient) -> None:
+    """
+    Test that statement-level triggers keep rule levels as row-level triggers of the first release did
+    """
+    rng = random.Random(13)
+    uid = str(uuid.uuid4())
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA {_BASELINE_SCHEMA}")
+            cursor.execute(f"SET LOCAL search_path TO {_BASELINE_SCHEMA}")
+            with open(os.path.join(os.path.dirname(__file__), "row-level-triggers.sql")) as baseline:
+                cursor.execute(baseline.read())
+
+            _execute_both(cursor, "INSERT INTO submission (name, uid) VALUES ('trigger_test', %s)", (uid,))
+            # Annotations without decision, nested and decided ones
+            token_levels = [rng.choice([None, None, "NESTED", "SECRET"]) for _ in range(30)]
+            _execute_both(cursor, "INSERT INTO annotation (submission, ref_start, ref_end, token_level)"
+                          " SELECT (SELECT id FROM submission WHERE uid = %s), ref, ref, token_level::annotation_decision"
+                          " FROM unnest(%s::int[], %s::text[]) AS a(ref, token_level)",
+                          (uid, list(range(len(token_levels))), token_levels))
+            conditions = [f"trigger_test_{i}" for i in range(20)]
+            _execute_both(cursor, "INSERT INTO rule (type, condition, confidence)"
+                          " SELECT 'WORD_TYPE', ARRAY[c.condition], c.confidence FROM unnest(%s::text[], %s::int[])"
+                          " AS c(condition, confidence)", (conditions, [rng.randint(-5, 5) for _ in conditions]))
+
+            def link(refs, rules) -> None:
+                # Multi-row insert with duplicates
+                _execute_both(cursor, "INSERT INTO annotation_rule (annotation, rule)"
+                              " SELECT a.id, r.id FROM unnest(%s::int[], %s::text[]) AS l(ref, condition)"
+                              " JOIN annotation a ON a.ref_start = l.ref"
+                              "  and a.submission = (SELECT id FROM submission WHERE uid = %s)"
+                              " JOIN rule r ON r.condition = ARRAY[l.condition]"
+                              " ON CONFLICT DO NOTHING", (refs, rules, uid))
+
+            # Every annotation is linked (the original cleanup removed all unlinked annotations without decision)
+            link(list(range(len(token_levels))), [rng.choice(conditions) for _ in token_levels])
+            for step in range(40):
+                operation = rng.choice(["link", "update", "delete"])
+                if operation == "link":
+                    refs = list(_rule_levels(cursor, "public", uid))
+                    link([rng.choice(refs) for _ in range(15)], [rng.choice(conditions) for _ in range(15)])
+                elif operation == "update":
+                    changed = rng.sample(conditions, min(5, len(conditions)))
+                    _execute_both(cursor, "UPDATE rule SET confidence = c.confidence"
+                                  " FROM unnest(%s::text[], %s::int[]) AS c(condition, confidence)"
+                                  " WHERE rule.condition = ARRAY[c.condition]",
+                                  (changed, [rng.randint(-5, 5) for _ in changed]))
+                elif len(conditions) > 3:
+                    deleted = rng.sample(conditions, 3)
+                    conditions = [condition for condition in conditions if condition not in deleted]
+                    _execute_both(cursor, "DELETE FROM rule WHERE condition[1] = ANY(%s)", (deleted,))
+                assert _rule_levels(cursor, "public", uid) == _rule_levels(cursor, _BASELINE_SCHEMA, uid), \
+                    f"step {step}: {operation}"
+        get_db().rollback()
+
+
+def test_schema_is_migrated(client: FlaskClient) -> None:
+    """
+    Test that database has all migrations applied
+    """
+    with app.app_context():
+        assert migrate(get_db()) == []
+        with get_cursor() as cursor:
+            cursor.execute("SELECT version, name FROM schema_version ORDER BY version")
+            assert [tuple(row) for row in cursor] == list_migrations()
+
+
+def test_settings(client: FlaskClient) -> None:
+    """
+    Test that settings of the application are written to the database and changes rebuild the work queue
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("SELECT rule_autoapply_confidence() AS confidence")
+            assert cursor.fetchone()["confidence"] == app.config["RULE_AUTOAPPLY_CONFIDENCE"]
+            assert sync_settings(cursor, database_settings(app.config)) == []
+
+            cursor.execute("INSERT INTO submission (name, uid, status) VALUES ('setting_test', gen_random_uuid(),"
+                           " 'PRE_ANNOTATED') RETURNING id")
+            submission = cursor.fetchone()["id"]
+            cursor.execute("INSERT INTO annotation (submission, ref_start, ref_end, rule_level)"
+                           " VALUES (%s, 0, 0, %s)", (submission, app.config["RULE_AUTOAPPLY_CONFIDENCE"]))
+
+            def queued() -> int:
+                cursor.execute("SELECT count(*) AS queued FROM annotation_work WHERE submission = %s", (submission,))
+                return cursor.fetchone()["queued"]
+
+            # Decided by rules until the threshold increases
+            assert queued() == 0
+            settings = {"rule_autoapply_confidence": app.config["RULE_AUTOAPPLY_CONFIDENCE"] + 1}
+            assert sync_settings(cursor, settings) == ["rule_autoapply_confidence"]
+            assert queued() == 1
+        get_db().rollback()
+
+
+def _index_names(plan) -> set:
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= _index_names(child)
+    return names
+
+
+@pytest.mark.parametrize("index_name, query, params", [
+    ("rule_first_token_idx", "SELECT condition[1] AS first_word, max(array_length(condition, 1)) as length FROM rule"
+     " WHERE condition[1] = %s GROUP BY first_word", ("explain_test_7",)),
+    ("rule_first_token_idx", "SELECT id, condition FROM rule WHERE type = %s and condition[1] = %s",
+     (RuleType.WORD_TYPE.value, "explain_test_7")),
+    ("annotation_rule_rule_idx", "SELECT annotation FROM annotation_rule WHERE rule = (SELECT max(id) FROM rule)", ()),
+    ("annotation_undecided_idx", "SELECT submission.id FROM submission WHERE status = 'PRE_ANNOTATED' AND EXISTS"
+     " (SELECT 1 FROM annotation WHERE submission.id = annotation.submission and"
+     " (token_level IS NULL and ABS(rule_level) < %s))", (1,)),
+    ("annotation_work_claim_idx", "SELECT annotation FROM annotation_work"
+     " WHERE lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP"
+     " ORDER BY ref_start, submission LIMIT 1 FOR UPDATE SKIP LOCKED", ()),
+    ("annotation_work_leased_by_idx", "UPDATE annotation_work SET leased_by = NULL, lease_until = NULL"
+     " WHERE leased_by = %s", (1,)),
+    ("annotation_work_submission_idx", "SELECT ref_start, ref_end FROM annotation_work WHERE submission = %s"
+     " ORDER BY ref_start LIMIT 1", (1,)),
+])
+def test_hot_queries_use_indexes(client: FlaskClient, index_name: str, query: str, params) -> None:
+    """
+    Test that hot queries can use their indexes on seeded database
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("INSERT INTO submission (name, uid, status) VALUES ('explain_test', gen_random_uuid(), %s)"
+                           " RETURNING id", ("PRE_ANNOTATED",))
+            submission = cursor.fetchone()["id"]
+            cursor.execute("INSERT INTO rule (type, condition, confidence)"
+                           " SELECT %s, ARRAY['explain_test_' || i, 'next'], i %% 3 - 1 FROM generate_series(1, 200) i",
+                           (RuleType.WORD_TYPE.value,))
+            cursor.execute("INSERT INTO annotation (submission, ref_start, ref_end, token_level)"
+                           " SELECT %s, i, i, CASE WHEN i %% 2 = 0 THEN 'SECRET'::annotation_decision END"
+                           " FROM generate_series(1, 200) i", (submission,))
+            cursor.execute("INSERT INTO annotation_rule (annotation, rule)"
+                           " SELECT a.id, r.id FROM annotation a JOIN rule r ON r.condition[1] = 'explain_test_' || a.ref_start"
+                           " WHERE a.submission = %s", (submission,))
+            cursor.execute("ANALYZE rule, annotation, annotation_rule")
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cursor.fetchone()[0][0]["Plan"]
+            assert index_name in _index_names(plan)
+        get_db().rollback()
+
+
+def test_stream(client: FlaskClient) -> None:
+    """
+    Test that streamed query fetches rows in batches through server-side cursor
+    """
+    with app.app_context():
+        rows = stream("SELECT i FROM generate_series(1, %s) i", (10,), itersize=3)
+        assert next(rows)["i"] == 1
+        with get_cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_cursors WHERE name LIKE 'psan_stream_%%'")
+            assert cursor.fetchone()[0] == 1
+        assert [row["i"] for row in rows] == list(range(2, 11))
+        get_db().rollback()
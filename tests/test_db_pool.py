@@ -0,0 +1,79 @@
+import os
+
+import pytest
+from psycopg2.pool import PoolError
+
+from psan.db import _connect, get_pool
+from psan.db_pool import ConnectionPool
+
+
+def test_connections_are_reused() -> None:
+    pool = ConnectionPool(_connect, min_size=1, max_size=2)
+    first = pool.getconn()
+    with first.cursor() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE pool_test (id INT)")
+    pool.putconn(first)
+    # Uncommitted work is rolled back on return
+    second = pool.getconn()
+    assert second is first
+    with second.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('pool_test')")
+        assert cursor.fetchone()[0] is None
+    pool.putconn(second)
+    stats = pool.statistics()
+    assert stats["size"] == 1
+    assert stats["checkouts"] == 2
+    pool.close()
+
+
+def test_broken_connection_is_replaced() -> None:
+    pool = ConnectionPool(_connect, min_size=1, max_size=1, check_idle=0)
+    connection = pool.getconn()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        backend = cursor.fetchone()[0]
+    pool.putconn(connection)
+    # Kill the backend behind idle connection
+    admin = _connect()
+    with admin.cursor() as cursor:
+        cursor.execute("SELECT pg_terminate_backend(%s)", (backend,))
+    admin.close()
+    replacement = pool.getconn()
+    assert replacement is not connection
+    with replacement.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    pool.putconn(replacement)
+    assert pool.statistics()["discarded"] == 1
+    pool.close()
+
+
+def test_exhausted_pool_times_out() -> None:
+    pool = ConnectionPool(_connect, min_size=0, max_size=1, timeout=0.1)
+    connection = pool.getconn()
+    assert pool.statistics()["utilisation"] == 1
+    with pytest.raises(PoolError):
+        pool.getconn()
+    pool.putconn(connection)
+    assert pool.statistics()["timeouts"] == 1
+    pool.close()
+
+
+def test_pool_after_fork() -> None:
+    parent_pool = get_pool()
+    connection = parent_pool.getconn()
+    pid = os.fork()
+    if pid == 0:
+        # Child gets its own pool and leaves parent's connections alone
+        code = 1
+        try:
+            child_connection = get_pool().getconn()
+            with child_connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            code = 0 if get_pool() is not parent_pool and child_connection is not connection else 2
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    parent_pool.putconn(connection)
@@ -0,0 +1,86 @@
+import io
+import os
+import uuid
+import zipfile
+
+import pytest
+from flask import url_for
+from flask.testing import FlaskClient
+from psan import app
+from psan.celery.export import build_archive, export_document
+from psan.db import commit, get_cursor
+from psan.generate import OUTPUT_FORMATS
+
+_RECOGNIZED = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n"
+               + "".join(f"<sentence start=\"{i}\" end=\"{i + 1}\"><token id=\"{i}\">Jan{i}</token> "
+                         f"<token id=\"{i + 1}\">žije</token></sentence>\n" for i in range(0, 200, 2))
+               + "</submission>")
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        app.config["SERVER_NAME"] = "example.com"
+        yield client
+
+
+@pytest.fixture
+def submissions(tmp_path, admin: int):
+    """Pre-annotated submissions with recognized files and secret annotations (committed, deleted after test)"""
+    data_folder, output_cache = app.config["DATA_FOLDER"], app.config["OUTPUT_CACHE"]
+    app.config["DATA_FOLDER"] = str(tmp_path)
+    app.config["OUTPUT_CACHE"] = str(tmp_path / "output-cache")
+    uids = [str(uuid.uuid4()) for _ in range(3)]
+    with app.app_context():
+        with get_cursor() as cursor:
+            for i, uid in enumerate(uids):
+                os.makedirs(tmp_path / uid)
+                (tmp_path / uid / "02-recognized.txt").write_text(_RECOGNIZED, encoding="utf-8")
+                cursor.execute("INSERT INTO submission (name, uid, status) VALUES (%s, %s, 'PRE_ANNOTATED') RETURNING id",
+                               (f"export test {i}", uid))
+                doc_id = cursor.fetchone()["id"]
+                cursor.execute("INSERT INTO annotation (submission, ref_start, ref_end, token_level)"
+                               " SELECT %s, i, i, 'SECRET' FROM generate_series(0, 198, 2 * %s) i", (doc_id, i + 1))
+            commit()
+    yield uids
+    app.config["DATA_FOLDER"], app.config["OUTPUT_CACHE"] = data_folder, output_cache
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("DELETE FROM submission WHERE uid = ANY(%s::uuid[])", (uids,))
+            cursor.execute("DELETE FROM export WHERE author = %s", (admin,))
+            commit()
+
+
+def test_export(client: FlaskClient, admin: int, submissions) -> None:
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("SELECT id, uid FROM submission WHERE uid = ANY(%s::uuid[]) ORDER BY id", (submissions,))
+            documents = cursor.fetchall()
+            cursor.execute("INSERT INTO export (uid, total, author) VALUES (gen_random_uuid(), %s, %s) RETURNING id, uid",
+                           (len(documents), admin))
+            export = cursor.fetchone()
+            commit()
+
+        # Tasks run by workers
+        parts = [export_document(export["id"], document["id"]) for document in documents]
+        status = client.get(url_for("export.status", uid=export["uid"])).get_json()
+        assert (status["status"], status["done"], status["total"]) == ("RUNNING", 3, 3)
+        assert client.get(url_for("export.download", uid=export["uid"])).status_code == 404
+        build_archive(parts, export["id"])
+        assert client.get(url_for("export.status", uid=export["uid"])).get_json()["status"] == "DONE"
+
+        # Archive contains the same output as single documents
+        download = client.get(url_for("export.download", uid=export["uid"]))
+        assert download.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(download.data)) as archive:
+            assert len(archive.namelist()) == 3 * len(OUTPUT_FORMATS)
+            for uid in submissions:
+                for format, output_format in OUTPUT_FORMATS.items():
+                    name = next(name for name in archive.namelist() if uid in name and name.endswith(output_format.suffix))
+                    output = client.get(url_for("generate.output", doc_uid=uid, format=format))
+                    assert archive.read(name) == output.data
+        # Resumed download
+        partial = client.get(url_for("export.download", uid=export["uid"]), headers={"Range": "bytes=10-"})
+        assert partial.status_code == 206
+        assert partial.data == download.data[10:]
+        assert export["uid"] in client.get(url_for("export.index")).get_data(as_text=True)
@@ -0,0 +1,175 @@
+import csv
+import json
+import os
+import re
+import uuid
+import xml.sax  # nosec - parse only internal XML
+from io import StringIO
+
+import psan.generate
+import pytest
+from flask import url_for
+from flask.testing import FlaskClient
+from psan import app
+from psan.db import commit, get_cursor
+from psan.generate import OutputTagFilter, generate_output, write_outputs
+
+_RECOGNIZED = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n"
+               + "".join(f"<sentence start=\"{i}\" end=\"{i + 1}\"><token id=\"{i}\">Jan{i}</token> "
+                         f"<token id=\"{i + 1}\">žije</token></sentence>\n" for i in range(0, 400, 2))
+               + "</submission>")
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        app.config["SERVER_NAME"] = "example.com"
+        yield client
+
+
+@pytest.fixture
+def recognized_file(tmp_path):
+    file = tmp_path / "02-recognized.txt"
+    file.write_text(_RECOGNIZED, encoding="utf-8")
+    return str(file)
+
+
+def _decisions():
+    return [{"start": i, "end": i, "label": "name" if i % 4 else None, "replacement": "[name]" if i % 4 else None}
+            for i in range(0, 400, 6)]
+
+
+def test_streamed_output(recognized_file, monkeypatch) -> None:
+    """
+    Test that output generated from small chunks and lazily consumed decisions matches whole file parse
+    """
+    expected = StringIO()
+    parser = xml.sax.make_parser()  # nosec - parse only internal XML
+    parser.setContentHandler(OutputTagFilter(_decisions(), expected))
+    parser.parse(recognized_file)
+
+    monkeypatch.setattr(psan.generate, "_OUTPUT_CHUNK_SIZE", 100)
+    consumed = []
+
+    def decisions():
+        for decision in _decisions():
+            consumed.append(decision)
+            yield decision
+
+    chunks = generate_output(recognized_file, decisions())
+    first = next(chunks)
+    # Decisions are read only as far as the parsed text
+    assert 0 < len(consumed) < len(_decisions())
+    output = first + "".join(chunks)
+    assert output == expected.getvalue()
+    assert "Jan0" not in output and "[xxx]" in output and "[name]" in output
+    assert "Jan2 žije" in output
+
+
+def _recognize(text: str) -> str:
+    """Recognized file of the text as written by NER (tokens split by whitespace, capitalized words are entities)"""
+    def escape(text: str) -> str:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    parts = ["<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n"]
+    token_id = 0
+    for line in text.splitlines(keepends=True):
+        tokens = list(re.finditer(r"\S+", line))
+        position = 0
+        for i, token in enumerate(tokens):
+            parts.append(escape(line[position:token.start()]))
+            if i == 0:
+                parts.append(f"<sentence start=\"{token_id}\" end=\"{token_id + len(tokens)}\">")
+            element = f"<token id=\"{token_id}\">{escape(token.group())}</token>"
+            if token.group()[0].isupper():
+                element = f"<ne type=\"P\" start=\"{token_id}\" end=\"{token_id}\">{element}</ne>"
+            parts.append(element)
+            if i + 1 == len(tokens):
+                parts.append("</sentence>")
+            position = token.end()
+            token_id += 1
+        parts.append(escape(line[position:]))
+    parts.append("\n</submission>")
+    return "".join(parts)
+
+
+def test_span_formats(tmp_path) -> None:
+    """
+    Test that JSONL and standoff offsets point to tokens and secret spans of the input text
+    """
+    text = "Jan Novák žije  v Praze.\n\nA&B <firma> s.r.o.\nPetr a Pavel\n"
+    recognized_file = tmp_path / "02-recognized.txt"
+    recognized_file.write_text(_recognize(text), encoding="utf-8")
+    decisions = [{"start": 0, "end": 1, "label": "name", "replacement": "[name]"},
+                 {"start": 5, "end": 5, "label": None, "replacement": None},
+                 {"start": 8, "end": 8, "label": "name", "replacement": "[name]"},
+                 {"start": 10, "end": 10, "label": "name", "replacement": "[name]"}]
+    outputs = {"text": StringIO(), "jsonl": StringIO(), "standoff": StringIO()}
+    write_outputs(str(recognized_file), decisions, outputs)
+
+    # Same text as single format generation
+    assert outputs["text"].getvalue() == "".join(generate_output(str(recognized_file), decisions))
+    assert outputs["jsonl"].getvalue() == "".join(generate_output(str(recognized_file), decisions, "jsonl"))
+
+    sentences = [json.loads(line) for line in outputs["jsonl"].getvalue().splitlines()]
+    assert [sentence["text"] for sentence in sentences] == ["Jan Novák žije  v Praze.", "A&B <firma> s.r.o.", "Petr a Pavel"]
+    for sentence in sentences:
+        assert text[sentence["start"]:sentence["end"]] == sentence["text"]
+        for token in sentence["tokens"]:
+            assert text[token["start"]:token["end"]] == token["text"]
+    secret = [token["text"] for sentence in sentences for token in sentence["tokens"] if token["decision"] == "SECRET"]
+    assert secret == ["Jan", "Novák", "A&B", "Petr", "Pavel"]
+
+    spans = list(csv.DictReader(StringIO(outputs["standoff"].getvalue()), dialect="excel-tab"))
+    assert [(text[int(span["start"]):int(span["end"])], span["label"], span["replacement"]) for span in spans] == [
+        ("Jan Novák", "name", "[name]"), ("A&B", "", "[xxx]"), ("Petr", "name", "[name]"), ("Pavel", "name", "[name]")]
+
+
+def test_output_view(client: FlaskClient, admin: int, tmp_path) -> None:
+    uid = str(uuid.uuid4())
+    os.makedirs(tmp_path / uid)
+    (tmp_path / uid / "02-recognized.txt").write_text(_RECOGNIZED, encoding="utf-8")
+    data_folder, output_cache = app.config["DATA_FOLDER"], app.config["OUTPUT_CACHE"]
+    app.config["DATA_FOLDER"] = str(tmp_path)
+    app.config["OUTPUT_CACHE"] = str(tmp_path / "output-cache")
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("INSERT INTO submission (name, uid) VALUES ('output_test', %s) RETURNING id", (uid,))
+            doc_id = cursor.fetchone()["id"]
+            cursor.execute("INSERT INTO annotation (submission, ref_start, ref_end, token_level)"
+                           " SELECT %s, i, i, 'SECRET' FROM generate_series(0, 398, 2) i", (doc_id,))
+            commit()
+        try:
+            response = client.get(url_for("generate.output", doc_uid=uid))
+            assert response.status_code == 200
+            assert response.is_streamed
+            assert response.get_data(as_text=True).count("[xxx] žije") == 200
+            # Unchanged document
+            assert client.get(url_for("generate.output", doc_uid=uid),
+                              headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+            # Generated output was cached
+            assert len(os.listdir(tmp_path / "output-cache")) == 1
+            cached = client.get(url_for("generate.output", doc_uid=uid))
+            assert cached.data == response.data
+            assert cached.headers["ETag"] == response.headers["ETag"]
+            assert cached.headers["Content-Disposition"] == response.headers["Content-Disposition"]
+
+            # Changed decisions are never served from cache
+            with get_cursor() as cursor:
+                cursor.execute("UPDATE annotation SET token_level = 'PUBLIC' WHERE submission = %s and ref_start = 0",
+                               (doc_id,))
+                commit()
+            changed = client.get(url_for("generate.output", doc_uid=uid))
+            assert changed.headers["ETag"] != response.headers["ETag"]
+            assert changed.get_data(as_text=True).startswith("Jan0 žije")
+
+            # Other formats
+            jsonl = client.get(url_for("generate.output", doc_uid=uid, format="jsonl"))
+            assert jsonl.content_type.startswith("application/x-ndjson")
+            assert jsonl.headers["ETag"] != changed.headers["ETag"]
+            assert client.get(url_for("generate.output", doc_uid=uid, format="xml")).status_code == 400
+        finally:
+            app.config["DATA_FOLDER"], app.config["OUTPUT_CACHE"] = data_folder, output_cache
+            with get_cursor() as cursor:
+                cursor.execute("DELETE FROM submission WHERE id = %s", (doc_id,))
+                commit()
@@ -0,0 +1,38 @@
+from psan.tool.matcher import RuleTrie
+from psan.tool.model import Rule
+
+
+def _match_all(trie: RuleTrie, tokens):
+    matcher = trie.matcher()
+    matches = []
+    for token_id, token in enumerate(tokens):
+        matches.extend(matcher.feed(token_id, token))
+    matches.extend(matcher.close())
+    return sorted(matches)
+
+
+def test_longest_match() -> None:
+    trie = RuleTrie([(["John"], Rule(1)), (["John", "Smith"], Rule(2)), (["Smith", "Street", "10"], Rule(3))])
+    assert len(trie) == 3
+    assert trie.depth == 3
+    assert trie.longest_match(["John", "Smith", "Street"]) == (2, Rule(2))
+    assert trie.longest_match(["John", "Doe"]) == (1, Rule(1))
+    assert trie.longest_match(["Doe"]) is None
+
+
+def test_streaming_matcher() -> None:
+    trie = RuleTrie([(["John"], Rule(1)), (["John", "Smith"], Rule(2)), (["Smith", "Street", "10"], Rule(3))])
+    tokens = ["Hi", "John", "Smith", "Street", "10", "and", "John", "Smith", "Street"]
+    assert _match_all(trie, tokens) == [(1, 2, Rule(2)), (2, 4, Rule(3)), (6, 7, Rule(2))]
+    # Match at the end of document
+    assert _match_all(trie, ["John"]) == [(0, 0, Rule(1))]
+
+
+def test_idle_matcher() -> None:
+    trie = RuleTrie([(["John", "Smith"], Rule(1))])
+    matcher = trie.matcher()
+    assert matcher.idle
+    matcher.feed(0, "John")
+    assert not matcher.idle
+    assert matcher.feed(1, "Smith") == [(0, 1, Rule(1))]
+    assert matcher.idle
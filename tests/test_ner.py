@@ -0,0 +1,204 @@
+import filecmp
+import random
+import re
+import sys
+
+import pytest
+from psan.tool.ner import BinaryNer, NameTag, NerInterface
+from psan.tool.ner_cache import SentenceCache
+from psan.tool.registry import ModelRegistry
+from ufal.nametag import NamedEntity, TokenRange
+
+
+class FakeTokenizer:
+    """Splits text to sentences by dots and to tokens by whitespace"""
+
+    def setText(self, text: str) -> None:
+        self._sentences = [[match for match in re.finditer(r"[^\s.]+|\.", sentence.group())]
+                           for sentence in re.finditer(r"[^.]*\.?", text) if sentence.group().strip()]
+        self._offsets = [sentence.start() for sentence in re.finditer(r"[^.]*\.?", text) if sentence.group().strip()]
+
+    def nextSentence(self, forms, tokens) -> bool:
+        if not self._sentences:
+            return False
+        forms.clear()
+        tokens.clear()
+        offset = self._offsets.pop(0)
+        for match in self._sentences.pop(0):
+            forms.append(match.group())
+            token = TokenRange()
+            token.start = offset + match.start()
+            token.length = len(match.group())
+            tokens.append(token)
+        return True
+
+
+class FakeNer:
+    """Recognizes capitalized words and pairs of capitalized words"""
+
+    def recognize(self, forms, entities) -> None:
+        entities.clear()
+        for i, form in enumerate(forms):
+            if form[0].isupper():
+                entities.append(NamedEntity(i, 1, "P"))
+                if i + 1 < len(forms) and forms[i + 1][0].isupper():
+                    entities.append(NamedEntity(i, 2, "P&<>"))
+
+
+class FakeNameTag(NameTag):
+    def _load(self, model_location) -> None:
+        self._ner = FakeNer()
+        self._tokenizer = FakeTokenizer()
+
+
+class FakeModel(NerInterface):
+    def __init__(self) -> None:
+        self.closed = False
+
+    def recognize_file(self, input_filename: str, output_filename: str, next_id=0) -> int:
+        return 0
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_registry_lru_eviction(tmp_path) -> None:
+    """
+    Test that models are loaded once and least recently used models are evicted (and closed) over the memory budget
+    """
+    models = {}
+    for name in ["cs", "en", "de"]:
+        path = tmp_path / f"{name}.ner"
+        path.write_bytes(b"x" * 100)
+        models[name] = str(path)
+    loads = []
+
+    def loader(path: str):
+        loads.append(path)
+        return FakeModel()
+
+    registry = ModelRegistry(models, memory_budget=250, loader=loader)
+    cs = registry.get("cs")
+    en = registry.get("en")
+    assert registry.get("cs") is cs
+    de = registry.get("de")
+    assert registry.loaded == ["cs", "de"]
+    assert len(loads) == 3
+    assert en.closed and not cs.closed
+    registry.close()
+    assert cs.closed and de.closed and registry.loaded == []
+
+    # Every process of the pool holds its copy of the model
+    registry = ModelRegistry(models, memory_budget=250, loader=loader, processes=2)
+    cs = registry.get("cs")
+    registry.get("en")
+    assert registry.loaded == ["en"] and cs.closed
+
+
+def test_parallel_recognition_close(tmp_path) -> None:
+    """
+    Test that closed recognizer stops processes of its pool
+    """
+    input_file = tmp_path / "01-input.txt"
+    input_file.write_text("Jan Novák bydlí v Praze.\n" * 10)
+    ner = FakeNameTag("fake", workers=2, chunk_lines=3)
+    ner.recognize_file(str(input_file), str(tmp_path / "first.txt"))
+    processes = list(ner._pool._processes.values())
+    assert processes
+    ner.close()
+    assert ner._pool is None
+    assert not any(process.is_alive() for process in processes)
+    # Pool is started again when needed
+    ner.recognize_file(str(input_file), str(tmp_path / "second.txt"))
+    assert filecmp.cmp(tmp_path / "first.txt", tmp_path / "second.txt", shallow=False)
+    ner.close()
+
+
+def test_parallel_recognition_is_identical(tmp_path) -> None:
+    """
+    Test that sentence-sharded parallel recognition produces the same file as serial recognition
+    """
+    random.seed(1)
+    words = ["Jan", "Novák", "bydlí", "v", "Praze", "a", "<b>", "&", "\"quoted\"", "Ostrava.", "."]
+    lines = [" ".join(random.choice(words) for _ in range(random.randint(0, 30))) + "\n" for _ in range(500)]
+    input_file = tmp_path / "01-input.txt"
+    input_file.write_text("".join(lines))
+    serial_file, parallel_file = tmp_path / "serial.txt", tmp_path / "parallel.txt"
+
+    serial_tokens = FakeNameTag("fake").recognize_file(str(input_file), str(serial_file))
+    parallel_tokens = FakeNameTag("fake", workers=3, chunk_lines=7).recognize_file(str(input_file), str(parallel_file))
+
+    assert serial_tokens == parallel_tokens > 0
+    assert filecmp.cmp(serial_file, parallel_file, shallow=False)
+
+
+_FAKE_BINARY = """
+import re, sys, time
+def tag(line):
+    if "hang" in line:
+        time.sleep(60)
+    if "crash" in line:
+        sys.exit(1)
+    return re.sub(r"([A-Z][a-z]+)", r"<ne type=\\"P\\">\\1</ne>", line)
+if len(sys.argv) > 2:
+    source, target = sys.argv[2].split(":")
+    with open(source) as input, open(target, "w") as output:
+        output.writelines(tag(line) for line in input)
+else:
+    for line in sys.stdin:
+        sys.stdout.write(tag(line))
+        sys.stdout.flush()
+"""
+
+
+def test_binary_ner_workers(tmp_path) -> None:
+    """
+    Test that persistent workers produce same output as per-file processes and recover from crashes and hangs
+    """
+    binary = tmp_path / "fake_ner"
+    binary.write_text(f"#!{sys.executable}\n" + _FAKE_BINARY)
+    binary.chmod(0o755)
+    input_file = tmp_path / "input.txt"
+    input_file.write_text("Jan Novák bydlí v Praze.\nA tady je Ostrava\n")
+
+    single = BinaryNer(str(binary), "model")
+    assert single.recognize_file(str(input_file), str(tmp_path / "single.txt")) == 4
+
+    persistent = BinaryNer(str(binary), "model", workers=1, timeout=2)
+    try:
+        for i in range(3):
+            assert persistent.recognize_file(str(input_file), str(tmp_path / f"persistent{i}.txt")) == 4
+            assert filecmp.cmp(tmp_path / "single.txt", tmp_path / f"persistent{i}.txt", shallow=False)
+        # Broken documents
+        for word in ["crash", "hang"]:
+            broken_file = tmp_path / f"{word}.txt"
+            broken_file.write_text(f"Jan {word}\n")
+            with pytest.raises((RuntimeError, TimeoutError)):
+                persistent.recognize_file(str(broken_file), str(tmp_path / "broken.txt"))
+            # Worker is restarted
+            assert persistent.recognize_file(str(input_file), str(tmp_path / "restarted.txt")) == 4
+    finally:
+        persistent.close()
+
+
+def test_sentence_cache(tmp_path) -> None:
+    """
+    Test that cached sentences are not recognized again and the output stays the same
+    """
+    model = tmp_path / "model.ner"
+    model.write_text("fake")
+    input_file = tmp_path / "01-input.txt"
+    input_file.write_text("Dobrý den. Jan Novák.\nDobrý den. Petr Svoboda.\n")
+    cache = SentenceCache(str(tmp_path / "cache.sqlite"))
+
+    FakeNameTag(str(model)).recognize_file(str(input_file), str(tmp_path / "uncached.txt"))
+    first = FakeNameTag(str(model), cache=cache)
+    first.recognize_file(str(input_file), str(tmp_path / "first.txt"))
+    assert first.statistics == {"cache_hits": 1, "cache_misses": 3}
+    # New worker with the same cache
+    second = FakeNameTag(str(model), workers=2, chunk_lines=1, cache=SentenceCache(str(tmp_path / "cache.sqlite")))
+    second.recognize_file(str(input_file), str(tmp_path / "second.txt"))
+    assert second.statistics == {"cache_hits": 4, "cache_misses": 0}
+
+    assert filecmp.cmp(tmp_path / "uncached.txt", tmp_path / "first.txt", shallow=False)
+    assert filecmp.cmp(tmp_path / "uncached.txt", tmp_path / "second.txt", shallow=False)
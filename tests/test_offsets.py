@@ -0,0 +1,91 @@
+import random
+from io import StringIO
+from xml import sax
+from xml.sax import make_parser
+from xml.sax.saxutils import XMLGenerator
+
+import pytest
+from psan.annotate import RecognizedTagFilter
+from psan.tool.offsets import SentenceIndex
+from psan.tool.parser import ENGINES, AnnotationParser, parse_annotations
+
+
+@pytest.fixture
+def recognized_file(tmp_path):
+    random.seed(42)
+    token_id = 0
+    parts = ["<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n"]
+    for _ in range(200):
+        length = random.randint(1, 12)
+        parts.append(f"<sentence start=\"{token_id}\" end=\"{token_id + length}\">")
+        for i in range(length):
+            word = random.choice(["Praha", "žlutý", "kůň", "a", "&amp;", "Jan", "Novák"])
+            if i == 1:
+                parts.append(f"<ne type=\"P\" start=\"{token_id}\" end=\"{token_id}\">"
+                             f"<token id=\"{token_id}\">{word}</token></ne> ")
+            else:
+                parts.append(f"<token id=\"{token_id}\">{word}</token> ")
+            token_id += 1
+        parts.append("</sentence>" + random.choice(["", " ", "\n", "\n\n"]))
+    parts.append("\n</submission>")
+    file = tmp_path / "02-recognized.txt"
+    file.write_text("".join(parts), encoding="utf-8")
+    return str(file)
+
+
+def _render(source, start: int, end: int) -> str:
+    output = StringIO()
+    filter = RecognizedTagFilter(start, end, make_parser())
+    filter.setContentHandler(XMLGenerator(output))
+    sax.parse(source, filter)
+    filter.appendNeTypes()
+    return output.getvalue()
+
+
+def test_index_build_and_load(recognized_file, tmp_path, monkeypatch) -> None:
+    index = SentenceIndex.build(recognized_file)
+    assert len(index) == 200
+    # Tags split between read chunks
+    monkeypatch.setattr(SentenceIndex, "_CHUNK_SIZE", 7)
+    small_chunks = SentenceIndex.build(recognized_file)
+    index_file = str(tmp_path / "02-recognized.idx")
+    small_chunks.save(index_file)
+    loaded = SentenceIndex.load(index_file)
+    assert loaded._starts == index._starts and loaded._offsets == index._offsets
+
+
+def test_window_matches_full_parse(recognized_file) -> None:
+    """
+    Test that window rendered from indexed sentences is identical to window rendered from whole file
+    """
+    index = SentenceIndex.build(recognized_file)
+    windows = [(0, 0), (0, 50), (-10, 30), (500, 700), (1200, 5000), (5000, 6000)]
+    windows += [(start, start + random.randint(0, 300)) for start in random.sample(range(1300), 30)]
+    assert "token-" in _render(recognized_file, 0, 50)
+    for start, end in windows:
+        assert _render(index.read_window(recognized_file, start, end), start, end) == _render(recognized_file, start, end)
+
+
+class _TokenParser(AnnotationParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.tokens = []
+
+    def onWord(self, word) -> None:
+        self.tokens.append((self._last_token_id, word.token))
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_open_from(recognized_file, engine: str) -> None:
+    """
+    Test that parsing resumed from a token gives tokens of the whole file from the following sentence start
+    """
+    index = SentenceIndex.build(recognized_file)
+    full = _TokenParser()
+    parse_annotations(recognized_file, full, engine)
+    for token_id in [0, 1, 500, 501, 502, full.tokens[-1][0], full.tokens[-1][0] + 1]:
+        first = min(start for start in index._starts.tolist() + [len(full.tokens)] if start >= token_id)
+        resumed = _TokenParser()
+        with index.open_from(recognized_file, token_id) as source:
+            parse_annotations(source, resumed, engine)
+        assert resumed.tokens == full.tokens[first:]
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+from psan.output_cache import OutputCache
+
+
+def _put(cache: OutputCache, key: str, content: bytes) -> None:
+    with cache.new_file() as file:
+        file.write(content)
+    cache.put(key, file.name)
+
+
+def test_cache_evicts_least_recently_used(tmp_path) -> None:
+    cache = OutputCache(str(tmp_path), max_bytes=250)
+    assert cache.open("a") is None
+    _put(cache, "a", b"a" * 100)
+    _put(cache, "b", b"b" * 100)
+    os.utime(tmp_path / "a", (1, 1))
+    os.utime(tmp_path / "b", (2, 2))
+    # Opening marks the file as recently used
+    with cache.open("a") as file:
+        assert file.read() == b"a" * 100
+    _put(cache, "c", b"c" * 100)
+    assert cache.open("b") is None
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+
+
+def test_cache_keeps_opened_file(tmp_path) -> None:
+    cache = OutputCache(str(tmp_path), max_bytes=100)
+    _put(cache, "a", b"a" * 100)
+    with cache.open("a") as file:
+        # Evicted while being sent
+        os.utime(tmp_path / "a", (1, 1))
+        _put(cache, "b", b"b" * 100)
+        assert cache.open("a") is None
+        assert file.read() == b"a" * 100
+
+
+def test_invalid_key(tmp_path) -> None:
+    cache = OutputCache(str(tmp_path))
+    with pytest.raises(ValueError):
+        cache.open("../a")
+    with pytest.raises(ValueError):
+        cache.open(".hidden")
@@ -0,0 +1,48 @@
+from io import BytesIO
+
+import pytest
+
+from psan.tool.parser import ENGINES, AnnotationParser, parse_annotations
+
+_DOCUMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<submission>
+<sentence start="0" end="5"><token id="0">Hi</token> <ne start="1" end="2" type="P"><ne start="1" end="1" type="pf">\
+<token id="1">John</token></ne> <token id="2">Smith</token></ne> <token id="3">&amp;</token> <token id="4">\
+A&amp;B&lt;C</token></sentence>
+<sentence start="5" end="6"><token id="5"> spaced </token></sentence>
+</submission>"""
+
+
+class RecordingParser(AnnotationParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.events = []
+
+    def onNameEntity(self, start, end, ne_type, depth) -> None:
+        self.events.append(("ne", start, end, ne_type, depth))
+
+    def onWord(self, word) -> None:
+        self.events.append(("token", self._last_token_id, word.token))
+
+    def onSentenceStart(self, start) -> None:
+        self.events.append(("sentence", start))
+
+    def onDocumentEnd(self) -> None:
+        self.events.append(("end",))
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_engines_emit_same_events(engine: str, tmp_path) -> None:
+    expected = [("sentence", 0), ("token", 0, "Hi"), ("ne", 1, 2, "P", 1), ("ne", 1, 1, "pf", 2), ("token", 1, "John"),
+                ("token", 2, "Smith"), ("token", 3, "&"), ("token", 4, "A&B<C"), ("sentence", 5), ("token", 5, "spaced"),
+                ("end",)]
+    # Binary file
+    handler = RecordingParser()
+    parse_annotations(BytesIO(_DOCUMENT), handler, engine)
+    assert handler.events == expected
+    # File name
+    filename = tmp_path / "recognized.xml"
+    filename.write_bytes(_DOCUMENT)
+    handler = RecordingParser()
+    parse_annotations(str(filename), handler, engine)
+    assert handler.events == expected
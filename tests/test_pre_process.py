@@ -0,0 +1,221 @@
+import os
+import uuid
+
+import pytest
+from flask.testing import FlaskClient
+from psan import app
+from psan.celery import celery
+from psan.celery.pre_process import (_PRE_PROCESS_LOCK, apply_rules,
+                                     pre_annotate, pre_process_chain)
+from psan.db import _connect, commit, get_cursor, get_db
+from psan.tool.controller import Controller
+from psan.tool.model import RuleType
+from psan.tool.offsets import SentenceIndex
+from psan.tool.parser import AnnotationParser
+from psan.tool.task.checkpoint import run_resumable
+from psan.tool.task.index_tokens import TokenIndexParser
+from psan.tool.task.pre_annotate import PreAnnotationParser
+from psan.tool.task.re_annotate import ReAnnotateParser
+
+_RECOGNIZED = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n"
+               "<sentence start=\"0\" end=\"4\"><token id=\"0\">Hi</token> <token id=\"1\">stage_test_john</token>"
+               " <token id=\"2\">stage_test_smith</token><token id=\"3\">.</token></sentence>\n"
+               "<sentence start=\"4\" end=\"6\"><ne type=\"P\" start=\"4\" end=\"5\">"
+               "<ne type=\"PF\" start=\"4\" end=\"4\"><token id=\"4\">stage_test_john</token></ne>"
+               " <token id=\"5\">stage_test_doe</token></ne></sentence>"
+               "\n</submission>")
+
+_LARGE = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n"
+          + "".join(f"<sentence start=\"{i}\" end=\"{i + 3}\"><ne type=\"P\" start=\"{i}\" end=\"{i + 1}\">"
+                    f"<token id=\"{i}\">stage_test_john</token> <token id=\"{i + 1}\">stage_test_smith</token></ne>"
+                    f"<token id=\"{i + 2}\">.</token></sentence>\n" for i in range(0, 300, 3))
+          + "</submission>")
+
+
+class _FailingParser(AnnotationParser):
+    """Fails at the token (worker killed during the stage)"""
+
+    def __init__(self, token_id: int) -> None:
+        super().__init__()
+        self._token_id = token_id
+        self.tokens = 0
+
+    def onWord(self, word) -> None:
+        self.tokens += 1
+        if self._last_token_id == self._token_id:
+            raise RuntimeError("Worker lost")
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        app.config["SERVER_NAME"] = "example.com"
+        yield client
+
+
+def _annotations(cursor, doc_id: int):
+    cursor.execute("SELECT ref_start, ref_end, token_level, rule_level, array_agg(ar.rule ORDER BY ar.rule) AS rules"
+                   " FROM annotation a LEFT JOIN annotation_rule ar ON ar.annotation = a.id"
+                   " WHERE submission = %s GROUP BY a.id ORDER BY ref_start, ref_end", (doc_id,))
+    return [tuple(row) for row in cursor]
+
+
+def _status(cursor, doc_id: int) -> str:
+    cursor.execute("SELECT status FROM submission WHERE id = %s", (doc_id,))
+    return cursor.fetchone()["status"]
+
+
+def test_chain_routing() -> None:
+    """
+    Test that pre-processing stages are chained and routed to their own queues
+    """
+    stages = pre_process_chain(1).tasks
+    assert [stage.task for stage in stages] == ["psan.celery.pre_process.recognize",
+                                                "psan.celery.pre_process.pre_annotate",
+                                                "psan.celery.pre_process.apply_rules"]
+    # Stages ignore results of previous stages
+    assert all(stage.immutable for stage in stages)
+    queues = [celery.amqp.router.route({}, stage.task)["queue"].name for stage in stages]
+    assert queues == ["ner", "annotate", "rules"]
+
+
+def test_staged_pre_processing(client: FlaskClient, tmp_path) -> None:
+    """
+    Test that stages record their status and annotate named entities and rule matches
+    """
+    data_folder = app.config["DATA_FOLDER"]
+    app.config["DATA_FOLDER"] = str(tmp_path)
+    uid = str(uuid.uuid4())
+    os.makedirs(tmp_path / uid)
+    (tmp_path / uid / "02-recognized.txt").write_text(_RECOGNIZED)
+    try:
+        with app.app_context():
+            with get_cursor() as cursor:
+                ctl = Controller(cursor, None)
+                john = ctl.set_rule(RuleType.WORD_TYPE, ["stage_test_john"], 1)
+                john_smith = ctl.set_rule(RuleType.WORD_TYPE, ["stage_test_john", "stage_test_smith"], -1)
+                person, first_name = ctl.add_ne_type("P"), ctl.add_ne_type("PF")
+                cursor.execute("INSERT INTO submission (name, uid, status) VALUES (%s, %s, 'RECOGNIZED') RETURNING id",
+                               ("stage test", uid))
+                doc_id = cursor.fetchone()["id"]
+                commit()
+
+                pre_annotate(doc_id)
+                assert _status(cursor, doc_id) == "NE_ANNOTATED"
+                # Rules are not applied yet
+                assert [(start, end) for start, end, *_ in _annotations(cursor, doc_id)] == [(4, 4), (4, 5)]
+                apply_rules(doc_id)
+                assert _status(cursor, doc_id) == "PRE_ANNOTATED"
+                # Repeated (redelivered) stages do nothing
+                pre_annotate(doc_id)
+                apply_rules(doc_id)
+                assert _annotations(cursor, doc_id) == [
+                    (1, 2, None, -1, [john_smith.id]), (4, 4, "NESTED", 1, sorted([first_name.id, john.id])),
+                    (4, 5, None, 0, [person.id])]
+                cursor.execute("SELECT count(*) AS tokens FROM token WHERE submission = %s", (doc_id,))
+                assert cursor.fetchone()["tokens"] == 6
+    finally:
+        app.config["DATA_FOLDER"] = data_folder
+        with app.app_context():
+            with get_cursor() as cursor:
+                cursor.execute("DELETE FROM submission WHERE uid = %s", (uid,))
+                cursor.execute("DELETE FROM rule WHERE condition[1] = %s", ("stage_test_john",))
+                commit()
+
+
+def test_claimed_stage(client: FlaskClient, tmp_path) -> None:
+    """
+    Test that a stage is skipped while another worker holds the submission (across its checkpoint commits)
+    """
+    data_folder = app.config["DATA_FOLDER"]
+    app.config["DATA_FOLDER"] = str(tmp_path)
+    uid = str(uuid.uuid4())
+    os.makedirs(tmp_path / uid)
+    (tmp_path / uid / "02-recognized.txt").write_text(_RECOGNIZED)
+    other = _connect()
+    try:
+        with app.app_context():
+            with get_cursor() as cursor:
+                cursor.execute("INSERT INTO submission (name, uid, status) VALUES (%s, %s, 'RECOGNIZED') RETURNING id",
+                               ("stage test", uid))
+                doc_id = cursor.fetchone()["id"]
+                commit()
+
+                # Worker running the stage (lock survives its commits)
+                with other.cursor() as other_cursor:
+                    other_cursor.execute("SELECT pg_advisory_lock(%s, %s)", (_PRE_PROCESS_LOCK, doc_id))
+                    other.commit()
+                    pre_annotate(doc_id)
+                    assert _status(cursor, doc_id) == "RECOGNIZED"
+                    other_cursor.execute("SELECT pg_advisory_unlock(%s, %s)", (_PRE_PROCESS_LOCK, doc_id))
+                    other.commit()
+                pre_annotate(doc_id)
+                assert _status(cursor, doc_id) == "NE_ANNOTATED"
+                # Lock is released by the finished stage
+                cursor.execute("SELECT count(*) AS locks FROM pg_locks WHERE locktype = 'advisory' and objid = %s",
+                               (doc_id,))
+                assert cursor.fetchone()["locks"] == 0
+                commit()
+    finally:
+        other.close()
+        app.config["DATA_FOLDER"] = data_folder
+        with app.app_context():
+            with get_cursor() as cursor:
+                cursor.execute("DELETE FROM submission WHERE uid = %s", (uid,))
+                commit()
+
+
+def test_resumed_stage(client: FlaskClient, tmp_path) -> None:
+    """
+    Test that interrupted stage resumes from its last checkpoint and annotates the same as an uninterrupted run
+    """
+    recognized_file = str(tmp_path / "02-recognized.txt")
+    with open(recognized_file, mode="w") as output:
+        output.write(_LARGE)
+    index = SentenceIndex.build(recognized_file)
+    with app.app_context():
+        with get_cursor() as cursor:
+            ctl = Controller(cursor, None)
+            rules = [ctl.set_rule(RuleType.WORD_TYPE, ["stage_test_john"], 1),
+                     ctl.set_rule(RuleType.WORD_TYPE, ["stage_test_john", "stage_test_smith", "."], 1)]
+            uids = [str(uuid.uuid4()) for _ in range(2)]
+            cursor.execute("INSERT INTO submission (name, uid) SELECT 'checkpoint test', unnest(%s::uuid[]) RETURNING id",
+                           (uids,))
+            doc_ids = [row["id"] for row in cursor.fetchall()]
+            commit()
+            try:
+                def handlers(ctl: Controller):
+                    return [TokenIndexParser(ctl), PreAnnotationParser(ctl), ReAnnotateParser(ctl, ctl.load_rules())]
+
+                # Uninterrupted run
+                single = ctl.for_document(doc_ids[0])
+                assert run_resumable(recognized_file, index, single, "PRE_ANNOTATED", handlers(single), commit, 7,
+                                     batch_size=20) == 7
+                single.clear_checkpoint("PRE_ANNOTATED")
+                commit()
+
+                # Interrupted after the batch of tokens 0-20 (checkpoint at the start of the following sentence)
+                resumed = ctl.for_document(doc_ids[1])
+                failing = _FailingParser(40)
+                with pytest.raises(RuntimeError):
+                    run_resumable(recognized_file, index, resumed, "PRE_ANNOTATED", handlers(resumed) + [failing], commit,
+                                  7, batch_size=20)
+                get_db().rollback()
+                assert resumed.checkpoint("PRE_ANNOTATED") == (21, 7)
+                cursor.execute("SELECT max(id) AS last FROM token WHERE submission = %s", (doc_ids[1],))
+                assert cursor.fetchone()["last"] == 20
+
+                # Resumed with the rule epoch of the first run
+                counting = _FailingParser(-1)
+                assert run_resumable(recognized_file, index, resumed, "PRE_ANNOTATED", handlers(resumed) + [counting],
+                                     commit, 9, batch_size=20) == 7
+                assert counting.tokens == 300 - 21
+                resumed.clear_checkpoint("PRE_ANNOTATED")
+                commit()
+                assert _annotations(cursor, doc_ids[1]) == _annotations(cursor, doc_ids[0])
+                assert resumed.checkpoint("PRE_ANNOTATED") is None
+            finally:
+                get_db().rollback()
+                cursor.execute("DELETE FROM submission WHERE id = ANY(%s)", (doc_ids,))
+                cursor.execute("DELETE FROM rule WHERE id = ANY(%s)", ([rule.id for rule in rules],))
+                commit()
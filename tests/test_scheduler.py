@@ -0,0 +1,109 @@
+from fnmatch import fnmatch
+
+from psan.celery.scheduler import ReAnnotationScheduler
+
+
+class FakeRedis:
+    """In-memory subset of Redis commands used by the scheduler"""
+
+    def __init__(self) -> None:
+        self.data = {}
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        return 1 if self.data.pop(key, None) is not None else 0
+
+    def hincrby(self, key, field, amount):
+        hash = self.data.setdefault(key, {})
+        hash[field] = hash.get(field, 0) + amount
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def sadd(self, key, *values):
+        self.data.setdefault(key, set()).update(values)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def scard(self, key):
+        return len(self.data.get(key, set()))
+
+    def scan_iter(self, pattern):
+        return [key for key in self.data if fnmatch(key, pattern)]
+
+    def pipeline(self):
+        redis = self
+
+        class Pipeline:
+            def __init__(self) -> None:
+                self.commands = []
+
+            def __getattr__(self, name):
+                return lambda *args: self.commands.append((name, args))
+
+            def execute(self):
+                return [getattr(redis, name)(*args) for name, args in self.commands]
+
+        return Pipeline()
+
+
+def _scheduler():
+    queued = {"documents": [], "propagations": 0}
+
+    def enqueue_propagation(countdown):
+        queued["propagations"] += 1
+
+    scheduler = ReAnnotationScheduler(FakeRedis(), lambda doc_id, countdown: queued["documents"].append(doc_id),
+                                      enqueue_propagation)
+    return scheduler, queued
+
+
+def test_burst_is_coalesced() -> None:
+    scheduler, queued = _scheduler()
+    for _ in range(30):
+        scheduler.request(1, ["John"])
+    scheduler.request(2, ["Smith"])
+    assert queued == {"documents": [1, 2], "propagations": 1}
+    stats = scheduler.statistics()
+    assert stats["queue_depth"] == 2
+    assert stats["coalesced"] == 29
+    assert stats["coalescing_ratio"] == 29 / 31
+    # Single run covers the whole burst
+    generation = scheduler.start_document(1)
+    assert generation == 30
+    scheduler.finish_document(1, generation)
+    assert scheduler.statistics()["queue_depth"] == 1
+    assert scheduler.start_propagation() == ["John", "Smith"]
+    assert scheduler.statistics()["pending_tokens"] == 0
+
+
+def test_request_during_run_schedules_new_run() -> None:
+    scheduler, queued = _scheduler()
+    scheduler.request(1)
+    generation = scheduler.start_document(1)
+    scheduler.request(1)
+    assert queued["documents"] == [1, 1]
+    scheduler.finish_document(1, generation)
+    assert scheduler.start_document(1) == 2
+
+
+def test_stale_run_is_dropped() -> None:
+    scheduler, _ = _scheduler()
+    scheduler.request(1)
+    # Two runs queued for the same changes (e.g. by reconciliation)
+    scheduler.finish_document(1, scheduler.start_document(1))
+    assert scheduler.start_document(1) is None
+    assert scheduler.statistics()["dropped"] == 1
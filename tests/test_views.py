@@ -2,6 +2,7 @@ import pytest
 from flask import url_for
 from flask.testing import FlaskClient
 from psan import app
+from psan.db import commit, get_cursor
 
 
 @pytest.fixture
@@ -39,7 +40,9 @@ def test_reset(client: FlaskClient) -> None:
                          ["auth.register", "auth.users", "account.index", "account.delete_account", "account.change_password",
                           "annotate.index", "annotate.next", "annotate.detail", "annotate.decisions", "annotate.show",
                           "submission.index", "submission.new", "submission.download", "rule.index", "rule.export",
-                          "rule.upload", "label.index", "label.data", "label.export", "generate.output"])
+                          "rule.upload", "label.index", "label.data", "label.export", "generate.output",
+                          "export.index", "export.status", "export.download", "stats.re_annotation", "stats.db_pool",
+                          "stats.window_cache"])
 def test_restricted(client: FlaskClient, page_name) -> None:
     with app.app_context():
         page = url_for(page_name)
@@ -47,3 +50,71 @@ def test_restricted(client: FlaskClient, page_name) -> None:
         print(f"Testing page {page}")
         assert response.status_code == 302
         assert response.location == url_for("auth.login", _external=True)
+
+
+def test_label_export(client: FlaskClient, admin: int) -> None:
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("INSERT INTO label (name, replacement) SELECT 'export_test_' || i, 'r' || i"
+                           " FROM generate_series(1, 5000) i")
+            commit()
+        try:
+            response = client.get(url_for("label.export"))
+            lines = response.get_data(as_text=True).splitlines()
+            assert response.status_code == 200
+            assert lines[0] == "label,replacement"
+            assert len([line for line in lines if line.startswith("export_test_")]) == 5000
+        finally:
+            with get_cursor() as cursor:
+                cursor.execute("DELETE FROM label WHERE name LIKE 'export_test_%%'")
+                commit()
+
+
+def test_label_data(client: FlaskClient, admin: int) -> None:
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("INSERT INTO label (name, replacement) SELECT 'data_test_' || i, 'r' || i"
+                           " FROM generate_series(1, 50) i")
+            cursor.execute("SELECT count(*) FROM label")
+            total = cursor.fetchone()[0]
+            commit()
+        try:
+            response = client.get(url_for("label.data"))
+            assert response.status_code == 200
+            assert response.json["total"] == response.json["totalNotFiltered"] == len(response.json["rows"]) == total
+            response = client.get(url_for("label.data", search="data_test_1%"))
+            assert response.json["total"] == len(response.json["rows"]) == 11
+            assert response.json["totalNotFiltered"] == total
+            assert all("replacement" in row for row in response.json["rows"])
+        finally:
+            with get_cursor() as cursor:
+                cursor.execute("DELETE FROM label WHERE name LIKE 'data_test_%%'")
+                commit()
+
+
+def test_decisions_etag(client: FlaskClient, admin: int) -> None:
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("INSERT INTO submission (name, uid) VALUES ('etag_test', gen_random_uuid()) RETURNING id")
+            doc_id = cursor.fetchone()["id"]
+            cursor.execute("INSERT INTO annotation (submission, ref_start, ref_end) VALUES (%s, 1, 1)", (doc_id,))
+            commit()
+        try:
+            with client.session_transaction() as session:
+                session.update(permitted_doc_id=doc_id, permitted_win_start=0, permitted_win_end=10)
+            url = url_for("annotate.decisions", doc_id=doc_id, start=0, end=10)
+            first = client.get(url)
+            assert first.status_code == 200
+            assert len(first.get_json()) == 1
+            # Unchanged window is not queried again
+            assert client.get(url, headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+            with get_cursor() as cursor:
+                cursor.execute("UPDATE annotation SET token_level = 'PUBLIC' WHERE submission = %s", (doc_id,))
+                commit()
+            changed = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+            assert changed.status_code == 200
+            assert changed.get_json()[0]["decision"] == "PUBLIC"
+        finally:
+            with get_cursor() as cursor:
+                cursor.execute("DELETE FROM submission WHERE id = %s", (doc_id,))
+                commit()
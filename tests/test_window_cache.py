@@ -0,0 +1,88 @@
+import os
+import uuid
+
+import pytest
+from flask import url_for
+from flask.testing import FlaskClient
+from psan import app
+from psan.db import commit, get_cursor
+from psan.model import SubmissionStatus
+from psan.window_cache import WindowCache
+
+_RECOGNIZED = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<submission>\n"
+               + "".join(f"<sentence start=\"{i}\" end=\"{i}\"><token id=\"{i}\">Word{i}</token></sentence>\n"
+                         for i in range(300))
+               + "</submission>")
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        app.config["SERVER_NAME"] = "example.com"
+        yield client
+
+
+def test_cache_evicts_least_recently_used(tmp_path) -> None:
+    cache = WindowCache(str(tmp_path / "cache.sqlite"), max_bytes=250)
+    keys = [WindowCache.key("uid", i, i + 10, 1) for i in range(3)]
+    cache.put(keys[0], "a" * 100)
+    cache.put(keys[1], "b" * 100)
+    assert cache.get(keys[0]) == "a" * 100
+    # Over budget, the second window is least recently used
+    cache.put(keys[2], "c" * 100)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) == "c" * 100
+    # Counters are shared through the database
+    stats = WindowCache(str(tmp_path / "cache.sqlite"), max_bytes=250).statistics()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 200
+
+
+def test_key_depends_on_file_version() -> None:
+    assert WindowCache.key("uid", 0, 10, 1) != WindowCache.key("uid", 0, 10, 2)
+    assert WindowCache.key("uid", 0, 10, 1) != WindowCache.key("uid", 0, 11, 1)
+
+
+@pytest.fixture
+def submission(tmp_path, admin: int):
+    """Pre-annotated submission with recognized file and work waiting behind the first window"""
+    uid = str(uuid.uuid4())
+    os.makedirs(tmp_path / uid)
+    (tmp_path / uid / "02-recognized.txt").write_text(_RECOGNIZED, encoding="utf-8")
+    data_folder, window_cache = app.config["DATA_FOLDER"], app.config["WINDOW_CACHE"]
+    app.config["DATA_FOLDER"] = str(tmp_path)
+    app.config["WINDOW_CACHE"] = str(tmp_path / "window-cache.sqlite")
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("INSERT INTO submission (name, uid, status) VALUES ('cache_test', %s, %s) RETURNING id",
+                           (uid, SubmissionStatus.PRE_ANNOTATED.value))
+            doc_id = cursor.fetchone()["id"]
+            cursor.execute("INSERT INTO annotation (submission, ref_start, ref_end) VALUES (%s, 200, 200)", (doc_id,))
+            commit()
+    yield doc_id
+    app.config["DATA_FOLDER"], app.config["WINDOW_CACHE"] = data_folder, window_cache
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("DELETE FROM submission WHERE id = %s", (doc_id,))
+            commit()
+
+
+def test_window_is_cached_and_prefetched(client: FlaskClient, admin: int, submission: int) -> None:
+    with client.session_transaction() as session:
+        session.update(permitted_doc_id=submission, permitted_win_start=0, permitted_win_end=100)
+    with app.app_context():
+        cache = WindowCache(app.config["WINDOW_CACHE"])
+        first = client.get(url_for("annotate.window", doc_id=submission, start=0, end=100))
+        assert first.status_code == 200
+        assert "Word99<" in first.get_data(as_text=True)
+        # Server closes the response after it is sent
+        first.close()
+        # Second request is served from cache, the following window (admin has window size 50) was prefetched
+        second = client.get(url_for("annotate.window", doc_id=submission, start=0, end=100))
+        assert second.get_data() == first.get_data()
+        assert client.get(url_for("annotate.window", doc_id=submission, start=150, end=250)).status_code == 200
+        stats = cache.statistics()
+        assert (stats["misses"], stats["hits"], stats["prefetches"]) == (1, 2, 1)
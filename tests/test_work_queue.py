@@ -0,0 +1,177 @@
+import uuid
+
+import pytest
+from flask.testing import FlaskClient
+from psan import app
+from psan.annotate import _claim_work, _release_work
+from psan.db import _connect, commit, get_cursor, get_db
+from psan.model import SubmissionStatus
+from psan.tool.controller import Controller
+from psan.tool.model import AnnotationDecision, Interval, RuleType
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        app.config["SERVER_NAME"] = "example.com"
+        yield client
+
+
+def _new_submission(cursor, status: SubmissionStatus = SubmissionStatus.PRE_ANNOTATED) -> int:
+    cursor.execute("INSERT INTO submission (name, uid, status) VALUES (%s, %s, %s) RETURNING id",
+                   ("work_test", str(uuid.uuid4()), status.value))
+    return cursor.fetchone()["id"]
+
+
+def _queue(cursor, doc_id: int):
+    cursor.execute("SELECT ref_start, ref_end FROM annotation_work WHERE submission = %s ORDER BY ref_start", (doc_id,))
+    return [tuple(row) for row in cursor]
+
+
+def _pending(cursor, doc_id: int):
+    """Original query for annotations waiting for annotator"""
+    cursor.execute("SELECT DISTINCT ref_start, ref_end"
+                   " FROM annotation a"
+                   " JOIN submission s ON s.id = a.submission AND s.status = %s"
+                   " LEFT JOIN (annotation_rule ar "
+                   " INNER JOIN rule r ON r.id = ar.rule AND r.label IS NOT NULL AND r.confidence < 0)"
+                   " ON ar.annotation = a.id"
+                   " WHERE submission=%s and ((token_level IS NULL AND ABS(rule_level) < %s)"
+                   " OR ((token_level = %s OR (token_level IS NULL AND rule_level < %s))"
+                   " and COALESCE(a.label, r.label) IS NULL))"
+                   " ORDER BY ref_start",
+                   (SubmissionStatus.PRE_ANNOTATED.value, doc_id, 1, AnnotationDecision.SECRET.value, 1))
+    return [tuple(row) for row in cursor]
+
+
+def test_queue_follows_annotations(client: FlaskClient) -> None:
+    """
+    Test that triggers keep the work queue equal to the original query of missing annotations
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            cursor.execute("INSERT INTO label (name, replacement) VALUES ('work_test', 'X') RETURNING id")
+            label = cursor.fetchone()["id"]
+            doc_id = _new_submission(cursor, SubmissionStatus.RECOGNIZED)
+            ctl = Controller(cursor, doc_id)
+            undecided = ctl.set_rule(RuleType.WORD_TYPE, ["work_test_a"], 0)
+            secret = ctl.set_rule(RuleType.WORD_TYPE, ["work_test_b"], -1)
+            for start in range(0, 10, 2):
+                ctl.annotate_from_rule(Interval(start, start + 1), undecided if start < 6 else secret)
+            assert _queue(cursor, doc_id) == _pending(cursor, doc_id) == []
+
+            steps = [
+                lambda: cursor.execute("UPDATE submission SET status = %s WHERE id = %s",
+                                       (SubmissionStatus.PRE_ANNOTATED.value, doc_id)),
+                lambda: ctl.token_annotation(Interval(0, 1), AnnotationDecision.PUBLIC),
+                lambda: ctl.token_annotation(Interval(2, 3), AnnotationDecision.SECRET),
+                lambda: ctl.set_label(Interval(2, 3), label),
+                lambda: ctl.set_rule_label(["work_test_b"], label),
+                lambda: cursor.execute("UPDATE rule SET confidence = 1 WHERE id = %s", (undecided.id,)),
+                lambda: cursor.execute("DELETE FROM rule WHERE id = %s", (secret.id,)),
+            ]
+            for step in steps:
+                step()
+                assert _queue(cursor, doc_id) == _pending(cursor, doc_id)
+            assert _queue(cursor, doc_id) == []
+        get_db().rollback()
+
+
+def test_claims_do_not_overlap(client: FlaskClient) -> None:
+    """
+    Test that concurrent annotators lease different windows
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            doc_id = _new_submission(cursor)
+            ctl = Controller(cursor, doc_id)
+            rule = ctl.set_rule(RuleType.WORD_TYPE, ["work_test_claim"], 0)
+            for start in range(0, 100, 10):
+                ctl.annotate_from_rule(Interval(start, start), rule)
+            cursor.execute("INSERT INTO account (full_name, type, window_size, email, password)"
+                           " VALUES ('Work Test', 'USER', 25, %s, '-') RETURNING id", (f"{uuid.uuid4()}@example.com",))
+            account = cursor.fetchone()["id"]
+            # Hide work of other submissions
+            cursor.execute("UPDATE annotation_work SET lease_until = CURRENT_TIMESTAMP + INTERVAL '1 hour'"
+                           " WHERE submission <> %s AND (lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP)",
+                           (doc_id,))
+            commit()
+        other = _connect()
+        try:
+            with get_cursor() as cursor:
+                first = _claim_work(cursor, account, 25)
+                assert first == (doc_id, 0, 0)
+                # Other annotator skips locked and leased work
+                with other.cursor(cursor_factory=type(cursor)) as other_cursor:
+                    second = _claim_work(other_cursor, account, 25)
+                assert second == (doc_id, 30, 30)
+                other.commit()
+                commit()
+                with other.cursor(cursor_factory=type(cursor)) as other_cursor:
+                    assert _claim_work(other_cursor, account, 25) == (doc_id, 60, 60)
+                other.rollback()
+                # Released work is available again
+                _release_work(cursor, account)
+                assert _claim_work(cursor, account, 25) == (doc_id, 0, 0)
+        finally:
+            other.close()
+            with get_cursor() as cursor:
+                cursor.execute("UPDATE annotation_work SET lease_until = NULL, leased_by = NULL"
+                               " WHERE lease_until > CURRENT_TIMESTAMP + INTERVAL '50 minutes'")
+                cursor.execute("DELETE FROM submission WHERE id = %s", (doc_id,))
+                cursor.execute("DELETE FROM rule WHERE condition = %s", (["work_test_claim"],))
+                cursor.execute("DELETE FROM account WHERE id = %s", (account,))
+                commit()
+
+
+def test_claims_spread_across_submissions(client: FlaskClient) -> None:
+    """
+    Test that concurrent annotators claim work of different submissions
+    """
+    with app.app_context():
+        with get_cursor() as cursor:
+            doc_ids = [_new_submission(cursor) for _ in range(2)]
+            ctl = Controller(cursor, None)
+            rule = ctl.set_rule(RuleType.WORD_TYPE, ["work_test_spread"], 0)
+            for doc_id in doc_ids:
+                for start in range(0, 100, 10):
+                    ctl.for_document(doc_id).annotate_from_rule(Interval(start, start), rule)
+            accounts = []
+            for _ in range(2):
+                cursor.execute("INSERT INTO account (full_name, type, window_size, email, password)"
+                               " VALUES ('Work Test', 'USER', 25, %s, '-') RETURNING id", (f"{uuid.uuid4()}@example.com",))
+                accounts.append(cursor.fetchone()["id"])
+            # Hide work of other submissions
+            cursor.execute("UPDATE annotation_work SET lease_until = CURRENT_TIMESTAMP + INTERVAL '1 hour'"
+                           " WHERE submission <> ALL(%s) AND (lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP)",
+                           (doc_ids,))
+            commit()
+        other = _connect()
+        try:
+            with get_cursor() as cursor:
+                # Both claims are in progress (first one is not committed yet)
+                first = _claim_work(cursor, accounts[0], 25)
+                with other.cursor(cursor_factory=type(cursor)) as other_cursor:
+                    second = _claim_work(other_cursor, accounts[1], 25)
+                other.commit()
+                commit()
+                assert first[1:] == second[1:] == (0, 0)
+                assert {first[0], second[0]} == set(doc_ids)
+                # Windows leased by others are skipped by later claims
+                _release_work(cursor, accounts[0])
+                commit()
+                assert _claim_work(cursor, accounts[0], 25) == first
+                commit()
+                with other.cursor(cursor_factory=type(cursor)) as other_cursor:
+                    _release_work(other_cursor, accounts[1])
+                    assert _claim_work(other_cursor, accounts[1], 25) == second
+                other.commit()
+        finally:
+            other.close()
+            with get_cursor() as cursor:
+                cursor.execute("UPDATE annotation_work SET lease_until = NULL, leased_by = NULL"
+                               " WHERE lease_until > CURRENT_TIMESTAMP + INTERVAL '50 minutes'")
+                cursor.execute("DELETE FROM submission WHERE id = ANY(%s)", (doc_ids,))
+                cursor.execute("DELETE FROM rule WHERE condition = %s", (["work_test_spread"],))
+                cursor.execute("DELETE FROM account WHERE id = ANY(%s)", (accounts,))
+                commit()